@@ -1,7 +1,10 @@
+import hashlib
 import inspect
+import json
 import types
 import django.db.models
 from .graph import _valid_django_rel
+from . import adjacency, serialize
 
 
 def deferred_to_real(objs):
@@ -36,8 +39,42 @@ class ModelManager(object):
     # Fields returned by Curious represented by @properties of the model
     self.property_fields = []
 
+    # Relationships whose neighbors are cached across requests, for
+    # relationships that rarely change; see adjacency.py. Assigned, rather
+    # than changed in place, so signal handlers of adjacency.py see changes.
+    self.cached_relationships = []
+
+    # Field of the model whose value labels objects of the model, instead of
+    # their __unicode__, e.g. in values of foreign keys to the model; lets
+    # object data be loaded without model instances, see serialize.py
+    self.label_field = None
+
     self.url_function = None
 
+  @property
+  def cached_relationships(self):
+    return self.__cached_relationships
+
+  @cached_relationships.setter
+  def cached_relationships(self, relationships):
+    self.__cached_relationships = relationships
+    adjacency.reset()
+
+  @property
+  def config(self):
+    """
+    Configuration of the manager affecting query results and object data.
+    """
+
+    return dict(model_name=self.model_name,
+                short_name=self.short_name,
+                allowed_relationships=sorted(self.allowed_relationships),
+                disallowed_relationships=sorted(self.disallowed_relationships),
+                field_excludes=sorted(self.field_excludes),
+                property_fields=list(self.property_fields),
+                cached_relationships=sorted(self.cached_relationships),
+                label_field=self.label_field)
+
   def is_rel_allowed(self, f):
     try:
       rel = getattr(self.model_class, f)
@@ -71,6 +108,9 @@ class ModelRegistry(object):
   def clear(self):
     self.__managers = {}
     self.__short_names = {}
+    self.__classes = {}
+    serialize.invalidate()
+    adjacency.reset()
 
   def __add_model_by_class(self, cls, short_name=None):
     manager = ModelManager(cls, short_name)
@@ -79,6 +119,10 @@ class ModelRegistry(object):
       if manager.short_name not in self.__short_names:
         self.__short_names[manager.short_name] = []
       self.__short_names[manager.short_name].append(manager)
+      self.__classes.setdefault(cls, manager)
+      # names of models may be ambiguous now
+      serialize.invalidate()
+      adjacency.reset()
 
   def register(self, model, short_name=None):
     if isinstance(model, types.ModuleType):
@@ -99,10 +143,14 @@ class ModelRegistry(object):
     # will error out if model_name is ambiguious
     full_model_name = self.__translate_name(model_name)
 
-    del self.__managers[full_model_name]
+    manager = self.__managers.pop(full_model_name)
+    if self.__classes.get(manager.model_class) is manager:
+      del self.__classes[manager.model_class]
 
     # if we get here, we can be sure there's exactly one entry in short_names
     del self.__short_names[model_name]
+    serialize.invalidate()
+    adjacency.reset()
 
   def __translate_name(self, name):
     if name in self.__managers:
@@ -128,11 +176,20 @@ class ModelRegistry(object):
   def model_names(self):
     return [m.model_name for m in self.__managers.values()]
 
+  @property
+  def version(self):
+    """
+    Digest of registered models and their configuration, the same in every
+    process registering the same models the same way.
+    """
+
+    configs = [self.__managers[name].config for name in sorted(self.__managers)]
+    return hashlib.sha1(json.dumps(configs, sort_keys=True)).hexdigest()
+
   def get_name(self, cls):
-    managers = [m for m in self.__managers.values() if m.model_class == cls]
-    if len(managers) == 0:
+    manager = self.__classes.get(cls)
+    if manager is None:
       return ModelManager.model_name(cls)
-    manager = managers[0]
     if (
       manager.short_name in self.__short_names
       and len(self.__short_names[manager.short_name]) == 1
@@ -0,0 +1,153 @@
+"""
+Cache of neighbors of objects over relationships, shared across requests, for
+relationships that rarely change, e.g. hierarchies traversed recursively.
+Relationships are cached if listed in cached_relationships of the manager of
+their model. Neighbors are cached by relationship, generation and pk; saving
+or deleting objects of a model involved in a cached relationship, or changing
+its many-to-many rows, starts a new generation of the relationship, so all of
+its cached neighbors are dropped at once.
+"""
+
+import time
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.fields.related_descriptors import (
+  ForwardOneToOneDescriptor,
+  ForwardManyToOneDescriptor,
+  ManyToManyDescriptor,
+  ReverseManyToOneDescriptor,
+  ReverseOneToOneDescriptor,
+)
+from . import settings
+from .cache import cache
+
+
+def _generation_key(relationship):
+  return 'curious_adjacency_generation_%s' % relationship
+
+
+def _key(relationship, generation, node):
+  return 'curious_adjacency_%s_%s_%s' % (relationship, generation, node)
+
+
+def _new_generation():
+  # if the generation is evicted, start from a value not used before
+  return int(time.time()*1000000)
+
+
+def generation(relationship):
+  """
+  Returns current generation of relationship.
+  """
+
+  key = _generation_key(relationship)
+  g = cache.get(key)
+  if g is None:
+    cache.add(key, _new_generation(), None)
+    g = cache.get(key)
+  return g
+
+
+def invalidate(relationship):
+  """
+  Drops cached neighbors of relationship.
+  """
+
+  key = _generation_key(relationship)
+  try:
+    cache.incr(key)
+  except ValueError:
+    cache.set(key, _new_generation(), None)
+
+
+def fetch(relationship, nodes, f):
+  """
+  Returns (pk, input pk) edges of relationship from nodes, which are pks.
+  Takes neighbors from the cache, and calls f with a list of the nodes
+  missing from the cache, expecting (pk, input pk) edges of those nodes.
+  """
+
+  g = generation(relationship)
+  keys = dict((_key(relationship, g, node), node) for node in set(nodes))
+  cached = cache.get_many(keys.keys())
+
+  edges = []
+  missing = []
+  for key, node in keys.iteritems():
+    if key in cached:
+      edges.extend((pk, node) for pk in cached[key])
+    else:
+      missing.append(node)
+
+  if len(missing) > 0:
+    fetched = dict((node, []) for node in missing)
+    for pk, src in f(missing):
+      fetched.setdefault(src, []).append(pk)
+      edges.append((pk, src))
+    cache.set_many(dict((_key(relationship, g, node), pks) for node, pks in fetched.iteritems()),
+                   settings.ADJACENCY_CACHE_TIMEOUT)
+
+  return edges
+
+
+def models_of(rel_obj_descriptor):
+  """
+  Returns models whose changes may change edges of a Django relationship:
+  the models on both sides, and the through model of many-to-many
+  relationships.
+  """
+
+  t = type(rel_obj_descriptor)
+  if t in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor, ManyToManyDescriptor):
+    field = rel_obj_descriptor.field
+  elif t == ReverseManyToOneDescriptor:
+    field = rel_obj_descriptor.rel.field
+  elif t == ReverseOneToOneDescriptor:
+    field = rel_obj_descriptor.related.field
+  else:
+    return set()
+
+  models = set([field.model, field.related_model])
+  if t == ManyToManyDescriptor:
+    models.add(field.remote_field.through)
+  return models
+
+
+# cached relationships by models whose changes may change their edges; built
+# on first use after models are registered, or cached relationships change
+_changed_by = None
+
+
+def reset():
+  """
+  Drops cached relationships by model, so they are found again on next use.
+  """
+
+  global _changed_by
+  _changed_by = None
+
+
+def _relationships_changed_by(model):
+  global _changed_by
+  from curious import model_registry
+
+  changed_by = _changed_by
+  if changed_by is None:
+    changed_by = {}
+    for name in model_registry.model_names:
+      manager = model_registry.get_manager(name)
+      for method in manager.cached_relationships:
+        for m in models_of(getattr(manager.model_class, method)):
+          changed_by.setdefault(m, []).append('%s.%s' % (manager.model_name, method))
+    _changed_by = changed_by
+  return changed_by.get(model, [])
+
+
+def _invalidate_changed(sender, **kwargs):
+  if kwargs.get('action', 'post_').startswith('post_'):
+    for relationship in _relationships_changed_by(sender):
+      invalidate(relationship)
+
+
+post_save.connect(_invalidate_changed, dispatch_uid='curious_adjacency_post_save')
+post_delete.connect(_invalidate_changed, dispatch_uid='curious_adjacency_post_delete')
+m2m_changed.connect(_invalidate_changed, dispatch_uid='curious_adjacency_m2m_changed')
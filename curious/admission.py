@@ -0,0 +1,107 @@
+"""
+Admission policy of query results into the cache. A result is worth caching
+if the time it saves, the time it took to compute times the number of times
+the query was requested recently, pays for the room it takes. So a quick
+query requested often is cached, while a slow query requested once may not
+be.
+"""
+
+import threading
+from . import settings
+from .cache import cache
+
+
+class Decision(object):
+  """
+  Whether a result was admitted, and what it was decided on.
+  """
+
+  def __init__(self, admitted, cost, requests, size, saved, price):
+    self.admitted = admitted
+    self.cost = cost
+    self.requests = requests
+    self.size = size
+    self.saved = saved
+    self.price = price
+
+  def __str__(self):
+    return '%s; cost=%.3f; requests=%s; size=%s; saved=%.3f; price=%.3f' %\
+           ('admitted' if self.admitted else 'rejected',
+            self.cost, self.requests, self.size, self.saved, self.price)
+
+
+class Stats(object):
+  """
+  Counts of decisions, of cache hits, stale or not, and of results shared by
+  identical requests, in this process.
+  """
+
+  def __init__(self):
+    self.__lock = threading.Lock()
+    self.reset()
+
+  def add(self, name):
+    with self.__lock:
+      setattr(self, name, getattr(self, name)+1)
+
+  def reset(self):
+    with self.__lock:
+      self.hits = 0
+      self.stale = 0
+      self.shared = 0
+      self.admitted = 0
+      self.rejected = 0
+
+  def as_dict(self):
+    return dict(hits=self.hits, stale=self.stale, shared=self.shared,
+                admitted=self.admitted, rejected=self.rejected)
+
+
+class CachePolicy(object):
+  """
+  Admits results if seconds saved over the last window seconds, cost times
+  requests, are at least min_saved plus price_per_row seconds for each row of
+  the result.
+  """
+
+  def __init__(self, window=60*60, min_saved=20, price_per_row=0.001):
+    self.window = window
+    self.min_saved = min_saved
+    self.price_per_row = price_per_row
+
+  def _requests_key(self, key):
+    return '%s_requests' % key
+
+  def requested(self, key):
+    """
+    Counts a request of the result cached under key, and returns the number of
+    requests in the current window.
+    """
+
+    requests_key = self._requests_key(key)
+    cache.add(requests_key, 0, self.window)
+    try:
+      return cache.incr(requests_key)
+    except ValueError:
+      # counter expired since it was added
+      cache.set(requests_key, 1, self.window)
+      return 1
+
+  def decide(self, cost, requests, size):
+    saved = cost*requests
+    price = self.min_saved+self.price_per_row*size
+    return Decision(saved >= price, cost, requests, size, saved, price)
+
+
+stats = Stats()
+
+
+def policy_for(app):
+  """
+  Returns policy of app: CachePolicy with QUERY_CACHE_POLICY, overridden by
+  QUERY_CACHE_POLICIES[app].
+  """
+
+  config = dict(settings.QUERY_CACHE_POLICY)
+  config.update(settings.QUERY_CACHE_POLICIES.get(app, {}))
+  return CachePolicy(**config)
@@ -1,25 +1,77 @@
+import hashlib
+import itertools
 import json
+import threading
 import types
-from decimal import Decimal
 from datetime import datetime
 from humanize import naturaltime
-from django.core.cache import caches, InvalidCacheBackendError
 from django.db.models.fields.related import ForeignKey
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.generic.base import View
 
-from curious import model_registry
+from curious import (
+  ModelManager,
+  admission,
+  columns,
+  encoding,
+  flight,
+  join,
+  model_registry,
+  refresh,
+  serialize,
+  settings,
+  table,
+)
+from .cache import cache
 from .query import Query
 from .utils import report_time
 import time
 
 
-CACHE_VERSION = 5
+CACHE_VERSION = 6
 CACHE_TIMEOUT = 60 * 60
-try:
-  cache = caches['curious']
-except InvalidCacheBackendError:
-  cache = caches['default']
+
+
+def cache_key(kind, *parts, **kwargs):
+  """
+  Returns cache key of kind for parts. Keys are digests of parts,
+  CACHE_VERSION and version of the model registry, so they are the same in
+  every process, and change when models are configured differently. Pass
+  version, the version of the model registry, to make many keys without
+  computing it for each key.
+  """
+
+  version = kwargs.get('version')
+  if version is None:
+    version = model_registry.version
+  data = json.dumps([CACHE_VERSION, version]+list(parts), sort_keys=True, default=unicode)
+  return 'curious_cache_v%s_%s_%s' % (CACHE_VERSION, kind, hashlib.sha1(data).hexdigest())
+
+
+class HitCounter(object):
+  """
+  Counts hits and misses of a cache in this process.
+  """
+
+  def __init__(self):
+    self.hits = 0
+    self.misses = 0
+    self.__lock = threading.Lock()
+
+  def add(self, hits, misses):
+    with self.__lock:
+      self.hits += hits
+      self.misses += misses
+
+  @property
+  def hit_rate(self):
+    total = self.hits+self.misses
+    return float(self.hits)/total if total > 0 else None
+
+  def reset(self):
+    with self.__lock:
+      self.hits = 0
+      self.misses = 0
 
 
 def get_param_value(params, k, default):
@@ -36,7 +88,11 @@ class JSONView(View):
 
   def _return(self, code, result):
     res = {'result': result}
-    return HttpResponse(json.dumps(res), status=code, content_type='application/json')
+    return HttpResponse(encoding.dumps(res), status=code, content_type='application/json')
+
+  def _stream(self, code, result):
+    chunks = encoding.buffered(encoding.iterencode({'result': result}))
+    return StreamingHttpResponse(chunks, status=code, content_type='application/json')
 
   def _error(self, code, message):
     res = {'error': {'message': message}}
@@ -61,113 +117,181 @@ class ModelView(JSONView):
     return d
 
   @staticmethod
-  def objects_to_dict(objects, ignore_excludes=False, follow_fk=True):
+  def objects_to_dict(objects, ignore_excludes=False, follow_fk=True, fields=None):
     if len(objects) == 0:
       return dict(fields=[], objects=[])
 
-    fields = []
-    fk = []
-    is_model = True
-    add_pk = False
+    serializer = serialize.serializer_of(objects[0], ignore_excludes=ignore_excludes,
+                                         follow_fk=follow_fk, fields=fields)
+    packed, urls = serializer(objects)
+    return dict(fields=list(serializer.fields), objects=packed, urls=urls)
 
-    obj = objects[0]
-    model_name = model_registry.get_name(obj.__class__)
-    model_manager = model_registry.get_manager(model_name)
-    if ignore_excludes is True:
-      excludes = []
-    else:
-      excludes = model_manager.field_excludes
+  # hits and misses of objects looked up in the cache
+  object_cache_stats = HitCounter()
 
-    if hasattr(obj, '_meta'):
-      for f in obj._meta.fields:
-        if f.column not in excludes:
-          fields.append(f.column)
-          fk.append(f.name if type(f) == ForeignKey else None)
+  @staticmethod
+  def _load_objects(model_class, ids, ignore_excludes, follow_fk, fields):
+    """
+    Returns pks of objects with ids, and their fields, values and urls.
+    Objects of Django models are loaded with values_list if they can be, or
+    else as instances of only the fields needed.
+    """
 
-      if 'id' not in fields:
-        fields.append('pk')
-        fk.append(None)
-        add_pk = True
+    if not hasattr(model_class, '_meta'):
+      objs = model_class.fetch(ids)
+      r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk,
+                                    fields=fields)
+      return [obj.pk for obj in objs], r
+
+    q = model_class.objects.filter(pk__in=ids)
+    values = serialize.values_serializer_of(model_class, ignore_excludes, follow_fk, fields)
+    if values is not None:
+      pks, packed, urls = values(q)
+      if len(pks) == 0:
+        return [], dict(fields=[], objects=[])
+      return pks, dict(fields=list(values.fields), objects=packed, urls=urls)
+
+    only, related = serialize.projection(model_class, ignore_excludes, follow_fk, fields)
+    if only is not None:
+      q = q.only(*only)
+    if len(related) > 0:
+      q = q.select_related(*related)
+    objs = list(q)
+    r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk,
+                                  fields=fields)
+    return [obj.pk for obj in objs], r
 
-      for f in model_manager.property_fields:
-        fields.append(f)
-        fk.append(None)
+  @staticmethod
+  def _ids_of(pks, ids):
+    """
+    Returns the id each object was requested by, or None if that cannot be
+    told: objects are matched by pk, or else by position if fetch returned an
+    object for each id.
+    """
 
-    else:
-      is_model = False
-      for f in obj.fields():
-        fields.append(f)
-        fk.append(None)
+    requested = set(ids)
+    pks = [unicode(pk) for pk in pks]
+    if all(pk in requested for pk in pks):
+      return pks
+    if len(pks) == len(ids):
+      return ids
+    return None
 
-    packed = []
-    urls = []
-    for obj in objects:
-      obj_url = model_registry.get_manager(model_name).url_of(obj)
-      values = []
+  @staticmethod
+  def get_objects_as_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app,
+                          fields=None, encoded=False):
+    """
+    Returns fields, values and urls of objects with ids; only of fields, and
+    id, if fields is not None. Each object is cached on its own, so
+    overlapping batches share cached objects, and only objects missing from
+    the cache are fetched. If encoded is True, fields, values and urls are
+    Encoded, so cached JSON is spliced into responses as it is.
+    """
 
-      for column, fk_name in zip(fields, fk):
-        if is_model:
-          value = getattr(obj, column)
-        else:
-          value = obj.get(column)
-
-        if type(value) is Decimal:
-          value = float(value)
-        elif not type(value) in (long, int, float, bool, types.NoneType):
-          value = unicode(value)
-        if fk_name is not None and follow_fk is True:
-          v = getattr(obj, fk_name)
-          if v is not None:
-            fk_model_name = model_registry.get_name(v.__class__)
-            fk_url = None
-            try:
-              fk_url = model_registry.get_manager(fk_model_name).url_of(v)
-            except:
-              fk_url = None
-            value = (fk_model_name, v.pk, str(v), fk_url)
-        values.append(value)
-
-      urls.append(obj_url)
-      packed.append(values)
-
-    if add_pk is True:
-      assert fields[-1] == 'pk'
-      fields[-1] = 'id'
-    return dict(fields=fields, objects=packed, urls=urls)
+    obj_fields, objects = ModelView._encoded_objects(model_class, ids, ignore_excludes, follow_fk,
+                                                     force_reload, app, fields)
+    if len(objects) == 0:
+      return dict(fields=[], objects=[])
+    r = dict(fields=obj_fields,
+             objects=encoding.EncodedList([obj[0] for obj in objects]),
+             urls=encoding.EncodedList([obj[1] for obj in objects]))
+    return r if encoded else encoding.decoded(r)
 
   @staticmethod
-  def get_objects_as_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app):
-    cache_k = 'curious_cache_v%s_app_%s_object_data_%s/%s_%s_%s' % (
-      CACHE_VERSION, app, model_class, ids, ignore_excludes, follow_fk
-    )
-    cache_k = hash(cache_k)
-    if app is None or force_reload:
-      cache_v = None
-    else:
-      cache_v = cache.get(cache_k)
-
-    if cache_v is None:
-      if hasattr(model_class, '_meta'):
-        fks = []
-        for f in model_class._meta.fields:
-          if type(f) == ForeignKey:
-            fks.append(f.name)
-        q = model_class.objects.filter(pk__in=ids)
-        if len(fks) > 0 and follow_fk is True:
-          q = q.select_related(*fks)
-        r = ModelView.objects_to_dict(list(q), ignore_excludes=ignore_excludes, follow_fk=follow_fk)
+  def _encoded_objects(model_class, ids, ignore_excludes, follow_fk, force_reload, app, fields):
+    """
+    Returns Encoded fields, and a list of Encoded values and url of each
+    object, for get_objects_as_json.
+    """
 
+    # ids of left joined objects not found are None
+    ids = [i for i in ids if i is not None]
+    if hasattr(model_class, '_meta'):
+      # objects are returned in order of pks, whatever the order of ids
+      ids = sorted(set(ids))
+    # ids are looked up as they are, and cached under their unicode
+    native = dict((unicode(i), i) for i in ids)
+    ids = join.unique([unicode(i) for i in ids])
+    if fields is not None:
+      fields = sorted(set(fields))
+
+    model_name = ModelManager.model_name(model_class)
+    version = model_registry.version
+    keys = dict((cache_key('object', app, model_name, i, ignore_excludes, follow_fk, fields,
+                           version=version), i) for i in ids)
+    fields_k = cache_key('object_fields', app, model_name, ignore_excludes, follow_fk, fields,
+                         version=version)
+
+    # Encoded fields, and Encoded values and url of each object
+    obj_fields = None
+    found = {}
+    if app is not None and not force_reload:
+      cached = cache.get_many(keys.keys()+[fields_k])
+      if fields_k in cached:
+        obj_fields = encoding.Encoded(cached[fields_k])
+        for k, i in keys.iteritems():
+          if k in cached:
+            found[i] = tuple(encoding.Encoded(v) for v in cached[k])
+      ModelView.object_cache_stats.add(len(found), len(ids)-len(found))
+
+    missing = [i for i in ids if i not in found]
+    unmatched = []
+    if len(missing) > 0:
+      pks, r = ModelView._load_objects(model_class, [native[i] for i in missing], ignore_excludes,
+                                       follow_fk, fields)
+      fetched = [(encoding.encode(values), encoding.encode(url))
+                 for values, url in zip(r['objects'], r['urls'])] if len(pks) > 0 else []
+      obj_ids = ModelView._ids_of(pks, missing)
+
+      if obj_ids is None:
+        unmatched = fetched
       else:
-        objs = model_class.fetch(ids)
-        r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk)
+        found.update(zip(obj_ids, fetched))
+        if len(fetched) > 0:
+          obj_fields = encoding.encode(r['fields'])
+          if app is not None:
+            to_cache = dict((k, tuple(v.json for v in found[i]))
+                            for k, i in keys.iteritems() if i in missing)
+            to_cache[fields_k] = obj_fields.json
+            cache.set_many(to_cache, CACHE_TIMEOUT)
 
-      if app is not None:
-        cache.set(cache_k, json.dumps(r), CACHE_TIMEOUT)
+      if obj_fields is None:
+        obj_fields = encoding.encode(r['fields'])
 
-    else:
-      r = json.loads(cache_v)
+    return obj_fields, [found[i] for i in ids if i in found]+unmatched
+
+  @staticmethod
+  def stream_objects_as_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app,
+                             fields=None):
+    """
+    Returns the same as get_objects_as_json with encoded set, but with objects
+    loaded and encoded STREAM_BATCH_SIZE at a time, as the result is encoded
+    by encoding.iterencode. Keys are encoded in sorted order, so urls of
+    every batch are collected by the time they are encoded, after objects;
+    only the JSON of urls of each batch is kept.
+    """
+
+    ids = [i for i in ids if i is not None]
+    ids = sorted(set(ids)) if hasattr(model_class, '_meta') else join.unique(ids)
+    size = settings.STREAM_BATCH_SIZE
+    batches = (ModelView._encoded_objects(model_class, ids[i:i+size], ignore_excludes, follow_fk,
+                                          force_reload, app, fields)
+               for i in xrange(0, len(ids), size))
+    batches = ((obj_fields, objects) for obj_fields, objects in batches if len(objects) > 0)
 
-    return r
+    first = next(batches, None)
+    if first is None:
+      return dict(fields=[], objects=[])
+
+    urls = []
+
+    def objects():
+      for obj_fields, objects in itertools.chain([first], batches):
+        urls.append(encoding.Encoded(encoding.dumps([obj[1] for obj in objects])))
+        yield [obj[0] for obj in objects]
+
+    return dict(fields=first[0], objects=encoding.Batches(objects()),
+                urls=encoding.Batches(urls))
 
   def get(self, request, model_name):
     try:
@@ -200,7 +324,14 @@ class ModelView(JSONView):
       return self._error(404, "Unknown model '%s'" % model_name)
 
     ignore_excludes = get_param_value(data, 'x', False)
-    r = ModelView.get_objects_as_json(cls, data['ids'], ignore_excludes, True, True, app)
+    force_reload = get_param_value(data, 'r', False)
+    fields = data.get('fields', None)
+    if get_param_value(data, 's', settings.STREAM_RESPONSES):
+      r = ModelView.stream_objects_as_json(cls, data['ids'], ignore_excludes, True, force_reload,
+                                           app, fields)
+      return self._stream(200, r)
+    r = ModelView.get_objects_as_json(cls, data['ids'], ignore_excludes, True, force_reload, app,
+                                      fields, encoded=True)
     return self._return(200, r)
 
 
@@ -248,45 +379,83 @@ class ObjectView(JSONView):
 
 class QueryView(JSONView):
 
-  # if query takes longer than this number of seconds, cache it
-  QUERY_TIME_CACHING_THRESHOLD = 10
-
   def get_query_results(self, query, force_reload, force_cache, app):
-    cache_k = 'curious_cache_v%s_query_%s' % (CACHE_VERSION, query.query_string)
-    cache_k = hash(cache_k)
-    if app is None or force_reload:
-      cache_v = None
-    else:
-      cache_v = cache.get(cache_k)
+    """
+    Returns results of query, from the cache if they are there. Results are
+    cached if force_cache is set, or if the cache policy of app admits them;
+    the decision, 'hit', or 'shared' if results were computed by another
+    request at the same time, is kept in cache_decision.
+    """
 
-    if cache_v is None:
+    self.cache_decision = None
+    if app is None:
+      return self.run_query(query)
+
+    cache_k = cache_key('query', query.canonical)
+    policy = admission.policy_for(app)
+    requests = policy.requested(cache_k)
+    cache_v = None if force_reload else cache.get(cache_k)
+    if cache_v is not None:
+      admission.stats.add('hits')
+      self.cache_decision = 'hit'
+      if QueryView.is_stale(cache_v):
+        # serve stale results while they are recomputed
+        admission.stats.add('stale')
+        refreshing = refresh.submit(cache_k,
+                                    lambda: QueryView.refresh_query_results(query, cache_k))
+        self.cache_decision = 'stale; refreshing' if refreshing else 'stale'
+      return cache_v
+
+    started = datetime.now()
+
+    def compute():
       t = time.time()
       cache_v = self.run_query(query)
       t = time.time() - t
 
-      if app is not None:
-        if t > QueryView.QUERY_TIME_CACHING_THRESHOLD or force_cache:
-          cache.set(cache_k, cache_v, CACHE_TIMEOUT)
-        else:
-          # remove old cache if there are any
-          cache.set(cache_k, None)
+      size = sum(len(result['objects']) for result in cache_v['results'])
+      decision = policy.decide(t, requests, size)
+      if force_cache:
+        decision.admitted = True
+      if decision.admitted:
+        cache.set(cache_k, cache_v, settings.QUERY_CACHE_HARD_TIMEOUT)
+        admission.stats.add('admitted')
+      else:
+        # remove old cache if there are any
+        cache.delete(cache_k)
+        admission.stats.add('rejected')
+      return cache_v, decision
 
+    def computed_elsewhere():
+      cache_v = cache.get(cache_k)
+      if cache_v is not None and cache_v['computed_on'] >= started:
+        return cache_v, 'shared'
+
+    # identical queries running at the same time are computed once
+    (cache_v, self.cache_decision), computed = flight.run(cache_k, compute, computed_elsewhere)
+    if not computed:
+      admission.stats.add('shared')
+      self.cache_decision = 'shared'
     return cache_v
 
+  @staticmethod
+  def is_stale(results):
+    """
+    Returns True if results were computed more than CACHE_TIMEOUT seconds ago.
+    """
+
+    return (datetime.now() - results['computed_on']).total_seconds() > CACHE_TIMEOUT
+
+  @staticmethod
+  def refresh_query_results(query, cache_k):
+    cache.set(cache_k, QueryView().run_query(query), settings.QUERY_CACHE_HARD_TIMEOUT)
+
   @report_time
   def run_query(self, query):
-    res, last_model = query()
+    res, last_model = query.pks()
     results = []
 
-    for obj_src, join_index, tree in res:
-      model = None
-      for obj, src in obj_src:
-        if obj is not None:
-          model = obj.__class__
-          if hasattr(model, '_deferred') and model._deferred:
-            model = model.__base__
-          break
-
+    for pk_src, join_index, tree, model in res:
       if model is not None:
         model_name = model_registry.get_name(model)
       else:
@@ -295,7 +464,7 @@ class QueryView(JSONView):
       d = {
         'model': model_name,
         'join_index': join_index,
-        'objects': [(obj.pk, src) if obj is not None else (None, src) for obj, src in obj_src],
+        'objects': columns.to_list(pk_src),
         'tree': tree,
       }
       results.append(d)
@@ -318,8 +487,18 @@ class QueryView(JSONView):
     ignore_excludes = get_param_value(params, 'x', False)
     force = get_param_value(params, 'r', False)
     force_cache = get_param_value(params, 'fc', False)
+    stream = get_param_value(params, 's', settings.STREAM_RESPONSES)
+    table_mode = get_param_value(params, 't', False)
+    left_join = get_param_value(params, 'lj', False)
     app = params['app'] if 'app' in params else None
 
+    try:
+      page_size = int(params.get('n', settings.TABLE_PAGE_SIZE))
+      if page_size < 1:
+        raise ValueError()
+    except ValueError:
+      return self._error(400, 'Bad page size')
+
     try:
       query = Query(q)
     except Exception as e:
@@ -331,34 +510,129 @@ class QueryView(JSONView):
     if check_only:
       return self._return(200, dict(query=q))
 
+    # later pages of tables are read from the cache, without running the query
+    if table_mode and 'cursor' in params:
+      try:
+        snapshot, offset = table.parse_cursor(params['cursor'])
+        table_k = QueryView.table_key(query, left_join, snapshot)
+        header, rows = table.page(table_k, offset, page_size)
+      except table.CursorExpired as e:
+        return self._error(410, str(e))
+      except Exception as e:
+        return self._error(400, str(e))
+      return self._table(header, rows, snapshot, offset, load_data, ignore_excludes, follow_fk,
+                         force, app)
+
     try:
       results = self.get_query_results(query, force, force_cache, app)
+    except flight.Timeout as e:
+      response = self._error(503, str(e))
+      response['Retry-After'] = str(settings.SINGLE_FLIGHT_TIMEOUT)
+      return response
     except Exception as e:
       import traceback
       traceback.print_exc()
       return self._error(400, str(e))
 
+    # table mode
+    if table_mode:
+      snapshot = str(results['computed_on'])
+      table_k = QueryView.table_key(query, left_join, snapshot)
+      try:
+        header, rows = table.page(table_k, 0, page_size)
+      except table.CursorExpired:
+        col_names, rows = table.join_columns(results['results'], left_join)
+        last_model = results['last_model']
+        header = table.store(table_k, dict(columns=col_names, last_model=last_model,
+                                           computed_on=results['computed_on']), rows)
+        rows = rows[:page_size]
+      response = self._table(header, rows, snapshot, 0, load_data, ignore_excludes, follow_fk,
+                             force, app)
+      return self._with_cache_headers(response)
+
+    # results may be shared with other requests for the same query
+    results = dict(results)
     t = datetime.now() - results['computed_on']
-    if t.seconds > 300:
+    if t.total_seconds() > 300:
       results['computed_since'] = str(naturaltime(results['computed_on']))
     results['computed_on'] = str(results['computed_on'])
 
     # data mode
-    objects = []
     if load_data:
-      for result in results['results']:
-        if result['model']:
-          model = model_registry.get_manager(result['model']).model_class
-          ids = [obj[0] for obj in result['objects']]
-          objs = ModelView.get_objects_as_json(model, ids, ignore_excludes, follow_fk, force, app)
-          objects.append(objs)
-        else:
-          objects.append([])
-      results['data'] = objects
+      data = QueryView.result_data(results['results'], ignore_excludes, follow_fk, force, app,
+                                   stream)
+      results['data'] = encoding.Lazy(data) if stream else list(data)
 
     # print results
+    if stream:
+      results['results'] = encoding.Lazy(results['results'])
+      response = self._stream(200, results)
+    else:
+      response = self._return(200, results)
+    return self._with_cache_headers(response)
+
+  def _with_cache_headers(self, response):
+    if self.cache_decision is not None:
+      response['X-Curious-Cache'] = str(self.cache_decision)
+      stats = sorted(admission.stats.as_dict().items())
+      response['X-Curious-Cache-Stats'] = '; '.join('%s=%s' % kv for kv in stats)
+    return response
+
+  @staticmethod
+  def table_key(query, left_join, snapshot):
+    return cache_key('table', query.canonical, left_join, snapshot)
+
+  def _table(self, header, rows, snapshot, offset, load_data, ignore_excludes, follow_fk,
+             force_reload, app):
+    """
+    Returns response with a page of rows of a table, from offset, with a
+    cursor to the next page if there are more rows.
+    """
+
+    end = offset+len(rows)
+    results = dict(last_model=header['last_model'],
+                   columns=header['columns'],
+                   rows=rows,
+                   offset=offset,
+                   total=header['total'],
+                   next=table.cursor(snapshot, end) if end < header['total'] else None,
+                   computed_on=str(header['computed_on']))
+    t = datetime.now() - header['computed_on']
+    if t.total_seconds() > 300:
+      results['computed_since'] = str(naturaltime(header['computed_on']))
+
+    # data mode, only of objects on the page
+    if load_data:
+      data = []
+      for i, column in enumerate(header['columns']):
+        model = model_registry.get_manager(column['model']).model_class
+        ids = join.unique(row[i] for row in rows if row[i] is not None)
+        data.append(ModelView.get_objects_as_json(model, ids, ignore_excludes, follow_fk,
+                                                  force_reload, app, encoded=True))
+      results['data'] = data
+
     return self._return(200, results)
 
+  @staticmethod
+  def result_data(results, ignore_excludes, follow_fk, force_reload, app, stream):
+    """
+    Yields data of objects of each column of results. If stream is True, data
+    is loaded as it is encoded, see ModelView.stream_objects_as_json.
+    """
+
+    for result in results:
+      if result['model']:
+        model = model_registry.get_manager(result['model']).model_class
+        ids = [obj[0] for obj in result['objects']]
+        if stream:
+          yield ModelView.stream_objects_as_json(model, ids, ignore_excludes, follow_fk,
+                                                 force_reload, app)
+        else:
+          yield ModelView.get_objects_as_json(model, ids, ignore_excludes, follow_fk,
+                                              force_reload, app, encoded=True)
+      else:
+        yield []
+
   def get(self, request):
     return self._process(request.GET)
 
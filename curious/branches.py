@@ -0,0 +1,55 @@
+"""
+Runs independent branches of a query, e.g. the branches of an OR query,
+concurrently on a bounded pool of threads. Each thread uses its own database
+connections, and closes them when done, but shares the memo of edges of the
+query.
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+from django.db import connections
+from . import memo, settings
+
+
+_worker = threading.local()
+
+
+def _can_run_concurrently(n):
+  if n < 2 or settings.BRANCH_THREADS < 2:
+    return False
+  # branches inside a branch already running on a thread run on that thread,
+  # so the number of threads stays bounded
+  if getattr(_worker, 'active', False):
+    return False
+  # other threads use other connections, which do not see changes made in a
+  # transaction on this thread's connections
+  return not any(connection.in_atomic_block for connection in connections.all())
+
+
+def run_branches(f, branches):
+  """
+  Calls f on each branch, and returns the results in order of branches.
+  Exceptions raised by f are raised here.
+  """
+
+  if not _can_run_concurrently(len(branches)):
+    return [f(branch) for branch in branches]
+
+  # branches share the memo of the query
+  edges = memo.current()
+
+  def run(branch):
+    _worker.active = True
+    try:
+      with memo.execution(edges):
+        return f(branch)
+    finally:
+      _worker.active = False
+      connections.close_all()
+
+  pool = ThreadPool(min(settings.BRANCH_THREADS, len(branches)))
+  try:
+    return pool.map(run, branches)
+  finally:
+    pool.close()
+    pool.join()
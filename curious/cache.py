@@ -0,0 +1,10 @@
+"""
+Cache of Curious: the 'curious' cache if configured, else the default cache.
+"""
+
+from django.core.cache import caches, InvalidCacheBackendError
+
+try:
+  cache = caches['curious']
+except InvalidCacheBackendError:
+  cache = caches['default']
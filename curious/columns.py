@@ -0,0 +1,140 @@
+"""
+Columnar representation of (output, input) pairs, for large intermediate
+results: two int64 NumPy arrays instead of a list of tuples, which takes a
+fraction of the memory. Only used if NumPy is installed, and outputs and
+inputs are integers, i.e. pks of Django models with integer pks. Code
+iterating over pairs gets Python int tuples, so it works the same with
+either representation.
+"""
+
+import itertools
+from . import settings
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+class Pairs(object):
+  """
+  (output, input) pairs as an array of outputs and an array of inputs. Inputs
+  is None if all inputs are None, e.g. for the first result of a query.
+  """
+
+  def __init__(self, outputs, inputs=None):
+    self.outputs = outputs
+    self.inputs = inputs
+
+  def __len__(self):
+    return len(self.outputs)
+
+  def __iter__(self):
+    inputs = itertools.repeat(None) if self.inputs is None else self.inputs.tolist()
+    return itertools.izip(self.outputs.tolist(), inputs)
+
+  def __repr__(self):
+    return 'Pairs(%d)' % len(self)
+
+  def tolist(self):
+    return list(self)
+
+
+def _is_int(value):
+  return type(value) in (int, long)
+
+
+def to_columns(pairs):
+  """
+  Returns pairs as Pairs, or None if pairs cannot be represented by Pairs.
+  """
+
+  if isinstance(pairs, Pairs):
+    return pairs
+  pairs = list(pairs)
+  if len(pairs) == 0 or not _is_int(pairs[0][0]):
+    return None
+  if pairs[0][1] is None:
+    if any(src is not None for obj, src in pairs):
+      return None
+    return Pairs(_array([obj for obj, src in pairs]))
+  if not _is_int(pairs[0][1]):
+    return None
+  try:
+    a = numpy.array(pairs, dtype=numpy.int64)
+  except (TypeError, ValueError, OverflowError):
+    return None
+  if a.ndim != 2:
+    return None
+  return Pairs(numpy.ascontiguousarray(a[:, 0]), numpy.ascontiguousarray(a[:, 1]))
+
+
+def _array(values):
+  return numpy.array(values, dtype=numpy.int64)
+
+
+def use_columns(*pair_lists):
+  """
+  True if joins of pair lists should use Pairs: NumPy is installed, and one
+  of the lists is already Pairs or has at least COLUMNAR_SIZE pairs.
+  """
+
+  if numpy is None or settings.COLUMNAR_SIZE is None:
+    return False
+  return any(isinstance(p, Pairs) or len(p) >= settings.COLUMNAR_SIZE for p in pair_lists)
+
+
+def unique(pairs):
+  """
+  Returns Pairs without duplicates, keeping the first of each, in order.
+  """
+
+  if pairs.inputs is None:
+    values, first = numpy.unique(pairs.outputs, return_index=True)
+    if len(first) == len(pairs):
+      return pairs
+    first.sort()
+    return Pairs(pairs.outputs[first])
+
+  order = numpy.lexsort((pairs.inputs, pairs.outputs))
+  outputs, inputs = pairs.outputs[order], pairs.inputs[order]
+  # lexsort is stable, so the first of each run of equal pairs is the first
+  # occurrence of the pair
+  new = numpy.ones(len(order), dtype=bool)
+  new[1:] = (outputs[1:] != outputs[:-1]) | (inputs[1:] != inputs[:-1])
+  if new.all():
+    return pairs
+  first = numpy.sort(order[new])
+  return Pairs(pairs.outputs[first], pairs.inputs[first])
+
+
+def hash_join(left, right):
+  """
+  Columnar version of join.hash_join: joins Pairs of (obj, src) in left with
+  Pairs of (next_obj, next_src) in right, where next_src is obj, and returns
+  unique Pairs of (next_obj, src), in order of right. Matches are found by
+  sorting left and binary searching it, rather than hashing.
+  """
+
+  order = numpy.argsort(left.outputs, kind='mergesort')
+  keys = left.outputs[order]
+  lo = numpy.searchsorted(keys, right.inputs, 'left')
+  counts = numpy.searchsorted(keys, right.inputs, 'right')-lo
+
+  # one output for each match, i.e. counts[i] outputs for right[i]
+  right_index = numpy.repeat(numpy.arange(len(right)), counts)
+  ends = numpy.cumsum(counts)
+  offsets = numpy.arange(len(right_index))-numpy.repeat(ends-counts, counts)
+  left_index = order[numpy.repeat(lo, counts)+offsets]
+
+  outputs = right.outputs[right_index]
+  inputs = None if left.inputs is None else left.inputs[left_index]
+  return unique(Pairs(outputs, inputs))
+
+
+def to_list(pairs):
+  """
+  Returns pairs as a list of tuples.
+  """
+
+  return pairs.tolist() if isinstance(pairs, Pairs) else pairs
@@ -0,0 +1,211 @@
+"""
+Encoding of JSON responses. Values already encoded as JSON, e.g. object data
+taken from the cache, are wrapped in Encoded, and spliced into responses as
+they are, instead of being decoded and encoded again. Responses are the same,
+byte for byte, as if the values were encoded with the response.
+
+Responses can also be encoded incrementally, with iterencode, so lists of
+values produced by generators, wrapped in Lazy, are encoded as they are
+produced, and never held in memory at once. Lists produced a batch of values
+at a time, wrapped in Batches, are encoded a batch at a time.
+
+Keys of dicts are encoded in sorted order, by dumps and iterencode alike, so
+responses do not depend on the order of dicts, nor on hash randomization.
+
+JSON is encoded by the module named by JSON_ENCODER, or simplejson if it is
+installed, or else json; the module's dumps must take default and sort_keys,
+and encode like json.dumps.
+"""
+
+import importlib
+import json
+import os
+import re
+from . import settings
+
+
+_NOT_DECODED = object()
+
+
+class Encoded(object):
+  """
+  Value encoded as JSON, and the value itself, decoded from JSON on first use
+  if not given.
+  """
+
+  __slots__ = ('json', '__value')
+
+  def __init__(self, json, value=_NOT_DECODED):
+    self.json = json
+    self.__value = value
+
+  @property
+  def value(self):
+    if self.__value is _NOT_DECODED:
+      self.__value = json.loads(self.json)
+    return self.__value
+
+
+class EncodedList(Encoded):
+  """
+  List of Encoded items, encoded as one value.
+  """
+
+  __slots__ = ('items',)
+
+  def __init__(self, items):
+    # separator of items of lists encoded by json.dumps
+    Encoded.__init__(self, '[%s]' % ', '.join(item.json for item in items))
+    self.items = items
+
+  @property
+  def value(self):
+    return [item.value for item in self.items]
+
+
+class Lazy(object):
+  """
+  List of items produced by an iterable, encoded as they are produced by
+  iterencode.
+  """
+
+  def __init__(self, items):
+    self.items = items
+
+
+class Batches(Lazy):
+  """
+  List of items produced by an iterable of batches, lists of items, or Encoded
+  lists, encoded a batch at a time by iterencode.
+  """
+
+
+def decoded(value):
+  """
+  Returns value, with Encoded values in lists and dicts replaced by the
+  values they encode.
+  """
+
+  if isinstance(value, Encoded):
+    return value.value
+  if isinstance(value, list):
+    return [decoded(v) for v in value]
+  if isinstance(value, Batches):
+    return [v for batch in value.items for v in decoded(batch)]
+  if isinstance(value, Lazy):
+    return [decoded(v) for v in value.items]
+  if isinstance(value, dict):
+    return dict((k, decoded(v)) for k, v in value.iteritems())
+  return value
+
+
+def encoder():
+  if settings.JSON_ENCODER is not None:
+    return importlib.import_module(settings.JSON_ENCODER)
+  try:
+    import simplejson
+    return simplejson
+  except ImportError:
+    return json
+
+
+# placeholders of Encoded values while the rest of a response is encoded;
+# nonce keeps them apart from any string in responses
+_NONCE = os.urandom(8).encode('hex')
+_PLACEHOLDER = u'\x00%s:%%d\x00' % _NONCE
+_PLACEHOLDER_RE = re.compile(r'"\\u0000%s:(\d+)\\u0000"' % _NONCE)
+
+
+def encode(value):
+  """
+  Returns Encoded value.
+  """
+
+  return Encoded(encoder().dumps(value, sort_keys=True), value)
+
+
+def dumps(value):
+  """
+  Returns JSON of value, splicing in JSON of Encoded values.
+  """
+
+  fragments = []
+
+  def default(obj):
+    if isinstance(obj, Encoded):
+      fragments.append(obj.json)
+      return _PLACEHOLDER % (len(fragments)-1)
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+  data = encoder().dumps(value, default=default, sort_keys=True)
+  if len(fragments) == 0:
+    return data
+  return _PLACEHOLDER_RE.sub(lambda m: fragments[int(m.group(1))], data)
+
+
+def iterencode(value):
+  """
+  Yields chunks of JSON of value, the same as dumps. Dicts and Lazy lists are
+  encoded item by item, and Batches a batch at a time; other values, including
+  lists, are encoded whole, so Lazy lists must only be in dicts and other Lazy
+  lists.
+  """
+
+  if isinstance(value, Batches):
+    yield '['
+    first = True
+    for batch in value.items:
+      # items of the batch, without brackets
+      items = dumps(batch)[1:-1]
+      if len(items) == 0:
+        continue
+      if not first:
+        yield ', '
+      first = False
+      yield items
+    yield ']'
+
+  elif isinstance(value, Lazy):
+    yield '['
+    first = True
+    for item in value.items:
+      if not first:
+        yield ', '
+      first = False
+      for chunk in iterencode(item):
+        yield chunk
+    yield ']'
+
+  elif isinstance(value, dict) and all(isinstance(k, basestring) for k in value):
+    yield '{'
+    first = True
+    for k, v in sorted(value.iteritems(), key=lambda kv: kv[0]):
+      if not first:
+        yield ', '
+      first = False
+      yield dumps(k)
+      yield ': '
+      for chunk in iterencode(v):
+        yield chunk
+    yield '}'
+
+  else:
+    yield dumps(value)
+
+
+def buffered(chunks, size=64*1024):
+  """
+  Yields chunks joined into chunks of at least size bytes, but the last.
+  """
+
+  buf = []
+  n = 0
+  for chunk in chunks:
+    buf.append(chunk)
+    n += len(chunk)
+    if n >= size:
+      yield ''.join(buf)
+      buf = []
+      n = 0
+  if len(buf) > 0:
+    yield ''.join(buf)
@@ -0,0 +1,92 @@
+"""
+Single flight of computations of the same result. When many requests ask for
+the same uncached result at once, e.g. when a dashboard loads, only the first
+computes it. Other threads of the process wait for the first, and other
+processes wait for the result to show up in the cache, while a lock in the
+cache is held by the process computing it.
+"""
+
+import threading
+import time
+from . import settings
+from .cache import cache
+
+
+# seconds between checks of the cache, while another process computes
+POLL_INTERVAL = 0.1
+
+
+class Timeout(Exception):
+  pass
+
+
+class _Flight(object):
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _lock_key(key):
+  return '%s_flight' % key
+
+
+def _run_once(key, f, get):
+  lock_key = _lock_key(key)
+  deadline = time.time()+settings.SINGLE_FLIGHT_TIMEOUT
+
+  while not cache.add(lock_key, True, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+    value = get()
+    if value is not None:
+      return value, False
+    if time.time() >= deadline:
+      raise Timeout('Timed out waiting for the same query to finish')
+    time.sleep(POLL_INTERVAL)
+
+  try:
+    # another process may have finished before the lock was taken
+    value = get()
+    if value is not None:
+      return value, False
+    return f(), True
+  finally:
+    cache.delete(lock_key)
+
+
+def run(key, f, get):
+  """
+  Returns (value, computed): value is f() computed here if computed is True,
+  otherwise the value computed by another thread, or returned by get once
+  another process computed it. Get returns None until then. Raises Timeout if
+  waiting for another thread or process takes more than SINGLE_FLIGHT_TIMEOUT
+  seconds.
+  """
+
+  with _flights_lock:
+    flight = _flights.get(key)
+    first = flight is None
+    if first:
+      flight = _flights[key] = _Flight()
+
+  if not first:
+    if not flight.done.wait(settings.SINGLE_FLIGHT_TIMEOUT):
+      raise Timeout('Timed out waiting for the same query to finish')
+    if flight.error is not None:
+      raise flight.error
+    return flight.result[0], False
+
+  try:
+    flight.result = _run_once(key, f, get)
+    return flight.result
+  except Exception as e:
+    flight.error = e
+    raise
+  finally:
+    with _flights_lock:
+      del _flights[key]
+    flight.done.set()
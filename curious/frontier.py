@@ -0,0 +1,109 @@
+"""
+Frontiers are lists of pks, or other values, that a traversal step looks up
+with __in. Small frontiers are passed to the database as they are. Larger
+frontiers are split into chunks, and the results for all chunks are merged.
+Frontiers past FRONTIER_TABLE_SIZE are passed as one array parameter on
+PostgreSQL, or loaded into a temporary table on SQLite, and the query selects
+from that instead.
+"""
+
+import itertools
+from contextlib import contextmanager
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+from . import settings
+
+
+TEMP_TABLE = 'curious_frontier'
+
+# ids of frontiers in the temporary table; temporary tables are per
+# connection, so these only need to be unique within the process
+_frontier_ids = itertools.count(1)
+
+
+class FrontierSQL(RawSQL):
+  """
+  SQL selecting values of a large frontier. Unlike RawSQL, does not wrap the
+  SQL in parentheses, since __in lookups already do.
+  """
+
+  def as_sql(self, compiler, connection):
+    return self.sql, self.params
+
+
+def fetch(model, values, f, chunk=True):
+  """
+  Calls f with something to look up values with, as the right hand side of a
+  __in lookup, and returns a list of what f returns. The queryset f builds
+  should be on model, or at least on the same database.
+
+  If chunk is True, f may be called once for each chunk of values, and the
+  results are concatenated; callers should only allow this if results for
+  different values are independent, i.e. there is no paging or aggregation
+  after the lookup.
+  """
+
+  values = list(values)
+  if len(values) <= settings.FRONTIER_CHUNK_SIZE:
+    return list(f(values))
+
+  if len(values) <= settings.FRONTIER_TABLE_SIZE:
+    if chunk:
+      return _fetch_chunks(values, f)
+    return list(f(values))
+
+  with large_frontier(model, values) as rhs:
+    if rhs is not None:
+      return list(f(rhs))
+  if chunk:
+    return _fetch_chunks(values, f)
+  return list(f(values))
+
+
+def _fetch_chunks(values, f):
+  size = settings.FRONTIER_CHUNK_SIZE
+  results = []
+  for i in xrange(0, len(values), size):
+    results.extend(f(values[i:i+size]))
+  return results
+
+
+def to_sql(rhs):
+  """
+  Returns SQL and params for selecting values in rhs, which is what fetch
+  calls f with, for use in IN clauses of raw queries.
+  """
+
+  if isinstance(rhs, FrontierSQL):
+    return rhs.sql, list(rhs.params)
+  return ', '.join(['%s']*len(rhs)), list(rhs)
+
+
+@contextmanager
+def large_frontier(model, values):
+  """
+  Context manager yielding a FrontierSQL expression selecting values, or None
+  if the database of model does not support large frontiers. Model instances
+  are stored by their pks.
+  """
+
+  connection = connections[router.db_for_read(model)]
+  values = [getattr(v, 'pk', v) for v in values]
+
+  if connection.vendor == 'postgresql':
+    yield FrontierSQL('SELECT unnest(%s)', (values,))
+
+  elif connection.vendor == 'sqlite':
+    frontier_id = next(_frontier_ids)
+    with connection.cursor() as cursor:
+      cursor.execute('CREATE TEMP TABLE IF NOT EXISTS %s (frontier INTEGER, value)' % TEMP_TABLE)
+      cursor.executemany('INSERT INTO %s (frontier, value) VALUES (%%s, %%s)' % TEMP_TABLE,
+                         [(frontier_id, v) for v in values])
+    try:
+      yield FrontierSQL('SELECT value FROM %s WHERE frontier = %%s' % TEMP_TABLE, (frontier_id,))
+    finally:
+      with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE frontier = %%s' % TEMP_TABLE, (frontier_id,))
+
+  else:
+    yield None
@@ -6,9 +6,13 @@ these instances.
 """
 
 import types
+from django.core.exceptions import FieldDoesNotExist
 from django.db import connections, router
 from django.db.models.query import QuerySet
-from django.db.models import Count, Avg, Max, Min, Sum
+from django.db.models import Count, Avg, Max, Min, Sum, AutoField, IntegerField, BooleanField
+from django.db.models import Case, When, Value, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.manager import BaseManager
 from django.db.models.fields.related_descriptors import (
   ForwardOneToOneDescriptor,
   ForwardManyToOneDescriptor,
@@ -16,6 +20,7 @@ from django.db.models.fields.related_descriptors import (
   ReverseManyToOneDescriptor,
   ReverseOneToOneDescriptor,
 )
+from . import adjacency, frontier, memo
 
 
 def mk_filter_function(filters):
@@ -92,6 +97,11 @@ def _valid_django_rel(rel_obj_descriptor):
 # producing the output object using the query.
 INPUT_ATTR_PREFIX = '_origin_'
 
+
+def _with_origin(objects):
+  return [(obj, getattr(obj, INPUT_ATTR_PREFIX)) for obj in objects]
+
+
 def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=False):
   """
   From a related object descriptor (there are a few types of descriptors
@@ -101,6 +111,11 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
   The instance variable is an example instance, required by Django to construct
   a related object manager; it does not affect the query produced by the
   returned function.
+
+  The returned function returns output, input tuples, where input is the pk
+  of the instance producing the output object. Django relationships select
+  the input pk into the INPUT_ATTR_PREFIX attribute of each output object, so
+  reading it back is a single attribute lookup.
   """
 
   if not _valid_django_rel(rel_obj_descriptor) and\
@@ -111,7 +126,6 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
       raise Exception("Cannot handle related object descriptor %s." % rel_obj_descriptor)
 
   def get_related_objects(instances, filters=None):
-    queryset = None
     apply_filters = mk_filter_function(filters)
 
     # functioning defining a relationship
@@ -121,18 +135,7 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
     # FK from instance to a related object
     elif type(rel_obj_descriptor) in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor):
       field = rel_obj_descriptor.field
-
-      rel_obj_attr = field.get_foreign_related_value
-      instance_attr = field.get_local_related_value
-      query = {'%s__in' % field.related_query_name(): instances}
-      rel_mgr = field.rel.to._default_manager
-      # If the related manager indicates that it should be used for related
-      # fields, respect that.
-      if getattr(rel_mgr, 'use_for_related_fields', False):
-        queryset = rel_mgr
-      else:
-        queryset = QuerySet(field.rel.to)
-      queryset = queryset.filter(**query).only('pk')
+      model = field.rel.to
 
       table = instances[0]._meta.db_table
       pk_field = instances[0]._meta.pk.column
@@ -140,7 +143,18 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
       if table == related_table:
         # XXX hack: assuming django uses T2 for joining two tables of same name
         table = 'T2'
-      queryset = queryset.extra(select={INPUT_ATTR_PREFIX: '%s.%s' % (table, pk_field)})
+
+      def get_queryset(rhs):
+        query = {'%s__in' % field.related_query_name(): rhs}
+        rel_mgr = field.rel.to._default_manager
+        # If the related manager indicates that it should be used for related
+        # fields, respect that.
+        if getattr(rel_mgr, 'use_for_related_fields', False):
+          queryset = rel_mgr
+        else:
+          queryset = QuerySet(field.rel.to)
+        queryset = queryset.filter(**query).only('pk')
+        return queryset.extra(select={INPUT_ATTR_PREFIX: '%s.%s' % (table, pk_field)})
 
     # reverse FK from instance to related objects with FK to the instance
     elif type(rel_obj_descriptor) in (ReverseManyToOneDescriptor, ReverseOneToOneDescriptor):
@@ -148,16 +162,30 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
         rel_obj_descriptor.rel
 
       rel_field = rel_obj.field
-      rel_obj_attr = rel_field.get_local_related_value
       rel_column = rel_field.column
 
-      rel_model = rel_obj.related_model
-      rel_mgr = rel_model._default_manager.__class__()
-      rel_mgr.model = rel_model
-
-      query = {'%s__in' % rel_field.name: instances}
-      queryset = rel_mgr.get_queryset().filter(**query).only('pk')
-      queryset = queryset.extra(select={INPUT_ATTR_PREFIX: '%s' % rel_column})
+      model = rel_obj.related_model
+      rel_mgr = model._default_manager.__class__()
+      rel_mgr.model = model
+
+      lookup = rel_field.name
+      origin = rel_column
+      target = rel_field.target_field
+      if not target.primary_key:
+        # the FK refers to another field of the instances; look them up, and
+        # select them, by pk instead
+        qn = connections[router.db_for_read(model)].ops.quote_name
+        lookup = '%s%spk' % (rel_field.name, LOOKUP_SEP)
+        origin = '(SELECT T_origin.%s FROM %s T_origin WHERE T_origin.%s = %s.%s)' %\
+                 (qn(target.model._meta.pk.column), qn(target.model._meta.db_table),
+                  qn(target.column), qn(model._meta.db_table), qn(rel_column))
+
+      def get_queryset(rhs):
+        if lookup != rel_field.name and isinstance(rhs, list):
+          rhs = [getattr(obj, 'pk', obj) for obj in rhs]
+        query = {'%s__in' % lookup: rhs}
+        queryset = rel_mgr.get_queryset().filter(**query).only('pk')
+        return queryset.extra(select={INPUT_ATTR_PREFIX: origin})
 
     # M2M from instance to related objects
     elif type(rel_obj_descriptor) in (ReverseManyToOneDescriptor, ManyToManyDescriptor):
@@ -165,27 +193,608 @@ def get_related_obj_accessor(rel_obj_descriptor, instance, allow_missing_rel=Fal
       connection = connections[db]
 
       mgr = rel_obj_descriptor.__get__(instance)
-      query = {'%s__in' % mgr.query_field_name: instances}
-      queryset = super(mgr.__class__, mgr).get_queryset().filter(**query).only('pk')
+      model = mgr.model
 
       fk = mgr.through._meta.get_field(mgr.source_field_name)
       join_table = mgr.through._meta.db_table
       qn = connection.ops.quote_name
-      queryset = queryset.extra(select=dict(
-        ('%s%s' % (INPUT_ATTR_PREFIX, f.attname),
-         '%s.%s' % (qn(join_table), qn(f.column))) for f in fk.local_related_fields))
+      # M2M through tables always use single column FKs
+      column = fk.local_related_fields[0].column
 
-    # if you just do 'if queryset', that triggers query execution because
-    # python checks length of the enumerable. to prevent query execution, check
-    # if queryset is not None.
-    if queryset is not None:
-      return apply_filters(queryset)
+      def get_queryset(rhs):
+        query = {'%s__in' % mgr.query_field_name: rhs}
+        queryset = super(mgr.__class__, mgr).get_queryset().filter(**query).only('pk')
+        return queryset.extra(select={INPUT_ATTR_PREFIX: '%s.%s' % (qn(join_table), qn(column))})
 
-    return []
+    else:
+      return []
+
+    return frontier.fetch(model, instances,
+                          lambda rhs: _with_origin(apply_filters(get_queryset(rhs))),
+                          chunk=chain_filters(model, filters, True))
 
   return get_related_objects
 
 
+def get_related_lookup(rel_obj_descriptor):
+  """
+  For a Django relationship descriptor, returns the related model and the
+  lookup from the related model back to the model the descriptor is on, e.g.
+  (Entry, 'blog') for Blog.entry_set. Returns (None, None) if the descriptor
+  is not a Django relationship, or the relationship cannot be queried from the
+  related model, or the lookup does not give pks, i.e. a reverse FK to a field
+  other than the pk.
+  """
+
+  t = type(rel_obj_descriptor)
+  if t in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor):
+    field = rel_obj_descriptor.field
+    if field.remote_field.is_hidden():
+      return None, None
+    return field.related_model, field.related_query_name()
+
+  elif t in (ReverseOneToOneDescriptor, ReverseManyToOneDescriptor):
+    if t == ReverseOneToOneDescriptor:
+      field = rel_obj_descriptor.related.field
+    else:
+      field = rel_obj_descriptor.rel.field
+    if not field.target_field.primary_key:
+      return None, None
+    return field.model, field.name
+
+  elif t == ManyToManyDescriptor:
+    field = rel_obj_descriptor.field
+    if rel_obj_descriptor.reverse:
+      return field.model, field.name
+    if field.remote_field.is_hidden() and not field.remote_field.symmetrical:
+      return None, None
+    return field.related_model, field.related_query_name()
+
+  return None, None
+
+
+def get_chain_link(rel_obj_descriptor):
+  """
+  Returns the related model if the relationship can be part of a chain of
+  relationships compiled into one query, otherwise returns None.
+  """
+
+  related_model, lookup = get_related_lookup(rel_obj_descriptor)
+  if related_model is None or not _uses_plain_manager(related_model):
+    return None
+  return related_model
+
+
+def _uses_plain_manager(model):
+  """
+  True if the default manager of the model does not change which objects are
+  visible, i.e. joining through the model's table without going through its
+  manager returns the same rows.
+  """
+
+  manager = model._default_manager
+  return type(manager).get_queryset.__func__ is BaseManager.get_queryset.__func__
+
+
+def _local_field_lookup(model, lookup):
+  """
+  True if lookup only refers to a non-relational field of model.
+  """
+
+  name = lookup.split(LOOKUP_SEP)[0]
+  if name == 'pk':
+    return True
+  try:
+    field = model._meta.get_field(name)
+  except FieldDoesNotExist:
+    return False
+  return field.concrete and not field.is_relation
+
+
+def chain_filters(model, filters, last):
+  """
+  Checks if filters for a relationship to model can be applied when the
+  relationship is part of a chain of relationships compiled into one query.
+  The last relationship in the chain can filter and exclude like a regular
+  relationship. Other relationships can only filter on the model's own fields,
+  since those filters get merged into the single filter call that joins the
+  chain together, and cannot filter on the same lookup twice.
+  """
+
+  lookups = set()
+  for _filter in filters or []:
+    if 'method' not in _filter or 'kwargs' not in _filter:
+      return False
+    if last:
+      if _filter['method'] not in ('filter', 'exclude'):
+        return False
+    else:
+      if _filter['method'] != 'filter':
+        return False
+      if not all(_local_field_lookup(model, k) for k in _filter['kwargs']):
+        return False
+      if any(k in lookups for k in _filter['kwargs']):
+        return False
+      lookups.update(_filter['kwargs'])
+  return True
+
+
+def _chain_queryset(rel_obj_descriptors, filters):
+  """
+  Builds a function that takes in pks, or anything else __in lookups accept,
+  and returns a queryset of objects at the end of a chain of Django
+  relationships reached from those pks, and the lookup from the queryset's
+  model back to the start of the chain. Filters must satisfy chain_filters.
+  """
+
+  models = []
+  lookups = []
+  for descriptor in rel_obj_descriptors:
+    related_model, lookup = get_related_lookup(descriptor)
+    if related_model is None:
+      raise Exception("Cannot chain related object descriptor %s." % descriptor)
+    models.append(related_model)
+    lookups.append(lookup)
+
+  def get_queryset(rhs):
+    # lookups from the last model of the chain to each model along the way;
+    # all conditions on the path go into a single filter call, so they share
+    # the same joins.
+    query = {}
+    path = None
+    for i in range(len(lookups)-1, -1, -1):
+      path = lookups[i] if path is None else '%s%s%s' % (path, LOOKUP_SEP, lookups[i])
+      if i > 0:
+        for _filter in filters[i-1] or []:
+          for k, v in _filter['kwargs'].iteritems():
+            k = '%s%s%s' % (path, LOOKUP_SEP, k)
+            if k in query:
+              raise Exception('Cannot chain relationships with repeated filter "%s"' % k)
+            query[k] = v
+    query['%s__in' % path] = rhs
+
+    queryset = models[-1]._default_manager.get_queryset().filter(**query)
+    return mk_filter_function(filters[-1])(queryset), path
+
+  return get_queryset
+
+
+def get_chain_accessor(rel_obj_descriptors, filters):
+  """
+  Builds a function that traverses a chain of Django relationships, starting
+  from the model of the first descriptor, with a single joined query. The
+  filters argument is a list of filters, one for each relationship; filters
+  must satisfy chain_filters. The function takes in pks, or anything else
+  __in lookups accept, and returns a queryset of (pk, input pk) tuples, where
+  pk is of an object at the end of the chain and input pk is the pk the
+  object was reached from.
+  """
+
+  get_queryset = _chain_queryset(rel_obj_descriptors, filters)
+
+  def get_related_pks(rhs):
+    queryset, path = get_queryset(rhs)
+    return queryset.values_list('pk', path).distinct()
+
+  return get_related_pks
+
+
+def traverse_chain(nodes, attrs, filters):
+  """
+  Traverse a chain of relationships on list of pks, using one query. Returns
+  output, input tuple array, where output and input are pks, and the model of
+  the output objects.
+  """
+
+  if len(nodes) == 0:
+    return [], None
+  f = get_chain_accessor(attrs, filters)
+  related_model = get_related_lookup(attrs[-1])[0]
+  pairs = memo.fetch(_memo_key('chain', None, tuple(attrs), filters, filters[-1]),
+                     nodes, lambda nodes: frontier.fetch(related_model, nodes, f))
+  return pairs, related_model if len(pairs) else None
+
+
+def traverse_union(nodes, chains):
+  """
+  Traverse several chains of relationships on list of pks, all ending at the
+  same model, using one UNION query. Chains is a list of (attrs, filters)
+  tuples, as taken by traverse_chain. Returns unique output, input tuple
+  array, where output and input are pks, and the model of the output
+  objects.
+  """
+
+  if len(nodes) == 0:
+    return [], None
+  accessors = [get_chain_accessor(attrs, filters) for attrs, filters in chains]
+
+  def get_pairs(rhs):
+    querysets = [f(rhs).order_by() for f in accessors]
+    return querysets[0].union(*querysets[1:])
+
+  model = get_related_lookup(chains[0][0][-1])[0]
+  pairs = frontier.fetch(model, nodes, get_pairs)
+  return pairs, model if len(pairs) else None
+
+
+def filter_by_chain(nodes, model, attrs, filters, having=True):
+  """
+  Returns pks of nodes, of model, from which a chain of Django relationships
+  reaches at least one object, or, if having is False, no objects. Filters
+  must satisfy chain_filters. Uses one query, with the chain as a subselect,
+  so the objects reached are never fetched.
+  """
+
+  if len(nodes) == 0:
+    return []
+  get_queryset = _chain_queryset(attrs, filters)
+
+  def get_pks(rhs):
+    queryset, path = get_queryset(rhs)
+    reached = Q(pk__in=queryset.values(path))
+    queryset = model._base_manager.filter(pk__in=rhs)
+    queryset = queryset.filter(reached) if having else queryset.exclude(reached)
+    return queryset.values_list('pk', flat=True)
+
+  return frontier.fetch(model, nodes, get_pks)
+
+
+def is_django_model(cls):
+  return hasattr(cls, '_meta')
+
+
+def model_of(obj):
+  """
+  Returns model class of an object.
+  """
+
+  t = obj.__class__
+  if hasattr(t, '_deferred') and t._deferred:
+    t = t.__base__
+  return t
+
+
+def to_nodes(objects):
+  """
+  Converts objects to nodes, which is what the query engine passes around:
+  pks for Django model instances, and the objects themselves for custom
+  models, since custom models can only be reached via relationship functions
+  that return objects. Returns nodes and the model of the objects.
+  """
+
+  if len(objects) == 0:
+    return [], None
+  model = model_of(objects[0])
+  if is_django_model(model):
+    return [obj.pk for obj in objects], model
+  return list(objects), model
+
+
+def node_pk(model):
+  """
+  Returns function returning the pk of a node of model.
+  """
+
+  if model is None or is_django_model(model):
+    return lambda node: node
+  return lambda node: None if node is None else node.pk
+
+
+def to_instances(model, nodes):
+  """
+  Converts nodes of a model to objects. Django model instances are built from
+  pks without querying the database, as deferred instances like the ones
+  .only('pk') returns.
+  """
+
+  if model is None or not is_django_model(model):
+    return list(nodes)
+  db = router.db_for_read(model)
+  field_names = [model._meta.pk.attname]
+  return [None if node is None else model.from_db(db, field_names, [node]) for node in nodes]
+
+
+def _related_queryset(rel_obj_descriptor, related_model):
+  rel_mgr = related_model._default_manager
+  if type(rel_obj_descriptor) in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor):
+    # If the related manager indicates that it should be used for related
+    # fields, respect that.
+    if not getattr(rel_mgr, 'use_for_related_fields', False):
+      return QuerySet(related_model)
+  return rel_mgr.get_queryset()
+
+
+def _memo_key(kind, model, attrs, filters, last_filters):
+  """
+  Returns key of edges of relationships in the execution memo, or None if
+  edges of a node depend on other nodes, e.g. when filters page.
+  """
+
+  if not chain_filters(model, last_filters, True):
+    return None
+  return (kind, model, attrs, repr(filters))
+
+
+def _cached_edges(nodes, attr, related_model, lookup, cache_as):
+  """
+  Returns output, input tuple array of a relationship cached across requests
+  under cache_as, regardless of filters.
+  """
+
+  def get_edges(rhs):
+    queryset = _related_queryset(attr, related_model).filter(**{'%s__in' % lookup: rhs})
+    return queryset.values_list('pk', lookup)
+
+  def fetch_missing(missing):
+    return frontier.fetch(related_model, missing, get_edges)
+
+  return memo.fetch(('adjacency', cache_as), nodes,
+                    lambda nodes: adjacency.fetch(cache_as, nodes, fetch_missing))
+
+
+def _passing(attr, related_model, filters, pks):
+  """
+  Returns set of pks of related objects passing filters, which must satisfy
+  chain_filters.
+  """
+
+  def get_pks(rhs):
+    queryset = _related_queryset(attr, related_model).filter(pk__in=rhs)
+    queryset = mk_filter_function(filters)(queryset)
+    return queryset.values_list('pk', flat=True)
+
+  return set(frontier.fetch(related_model, list(pks), get_pks))
+
+
+def traverse_pks(nodes, model, attr, filters=None, cache_as=None):
+  """
+  Traverse one relationship on list of nodes of model, without instantiating
+  model objects for Django relationships. Returns output, input tuple array,
+  where input is the pk of the node producing the output, and the model of the
+  output nodes. If cache_as is not None, neighbors are cached across requests
+  under that name; filters are then applied to the cached neighbors.
+  """
+
+  if len(nodes) == 0:
+    return [], None
+
+  related_model, lookup = get_related_lookup(attr)
+  if (
+    related_model is not None
+    and cache_as is not None
+    and chain_filters(related_model, filters, True)
+  ):
+    pairs = _cached_edges(nodes, attr, related_model, lookup, cache_as)
+    if filters:
+      passing = _passing(attr, related_model, filters, set(pk for pk, src in pairs))
+      pairs = [t for t in pairs if t[0] in passing]
+    return pairs, related_model if len(pairs) else None
+
+  if related_model is not None:
+    def get_pairs(rhs):
+      queryset = _related_queryset(attr, related_model).filter(**{'%s__in' % lookup: rhs})
+      queryset = mk_filter_function(filters)(queryset)
+      return queryset.values_list('pk', lookup)
+
+    chunk = chain_filters(related_model, filters, True)
+    pairs = memo.fetch(_memo_key('pks', model, attr, filters, filters),
+                       nodes,
+                       lambda nodes: frontier.fetch(related_model, nodes, get_pairs, chunk=chunk))
+    return pairs, related_model if len(pairs) else None
+
+  # relationship functions, and Django relationships we cannot query in
+  # reverse, work on objects
+  obj_src = traverse(to_instances(model, nodes), attr, filters)
+  if len(obj_src) == 0:
+    return [], None
+  next_nodes, next_model = to_nodes([obj for obj, src in obj_src])
+  return zip(next_nodes, [src for obj, src in obj_src]), next_model
+
+
+def _local_filters_q(model, filters):
+  """
+  Returns a Q object equivalent to filters, if filters only filter and exclude
+  on the model's own fields; otherwise returns None.
+  """
+
+  q = Q()
+  for _filter in filters:
+    if not all(_local_field_lookup(model, k) for k in _filter['kwargs']):
+      return None
+    if _filter['method'] == 'filter':
+      q &= Q(**_filter['kwargs'])
+    else:
+      q &= ~Q(**_filter['kwargs'])
+  return q
+
+
+# Annotation marking outputs of traverse_pks_marked passing filters
+PASSED_ATTR = '%spassed' % INPUT_ATTR_PREFIX
+
+
+def traverse_pks_marked(nodes, model, attr, filters=None, cache_as=None):
+  """
+  Like traverse_pks, but does not drop output objects not passing the
+  filters. Returns output, input, passed tuple array, where passed is True if
+  the output passes the filters, and the model of the output nodes. Returns
+  None if the relationship is not a Django relationship, or the filters do
+  more than filter and exclude, e.g. paging, which cannot be decided for one
+  object at a time. Cache_as is as in traverse_pks.
+  """
+
+  related_model, lookup = get_related_lookup(attr)
+  if related_model is None or not chain_filters(related_model, filters, True):
+    return None
+  if len(nodes) == 0:
+    return [], None
+
+  if cache_as is not None:
+    pairs = _cached_edges(nodes, attr, related_model, lookup, cache_as)
+    if not filters:
+      triples = [(obj, src, True) for obj, src in pairs]
+    else:
+      passing = _passing(attr, related_model, filters, set(pk for pk, src in pairs))
+      triples = [(obj, src, obj in passing) for obj, src in pairs]
+    return triples, related_model if len(triples) else None
+
+  if filters:
+    condition = _local_filters_q(related_model, filters)
+    if condition is None:
+      # filters on other models can join multiple rows, so check them in a
+      # subquery
+      passing = mk_filter_function(filters)(_related_queryset(attr, related_model))
+      condition = Q(pk__in=passing.order_by().values('pk'))
+    passed = Case(When(condition, then=Value(True)), default=Value(False),
+                  output_field=BooleanField())
+  else:
+    passed = Value(True, output_field=BooleanField())
+
+  def get_triples(rhs):
+    queryset = _related_queryset(attr, related_model).filter(**{'%s__in' % lookup: rhs})
+    queryset = queryset.annotate(**{PASSED_ATTR: passed})
+    return queryset.values_list('pk', lookup, PASSED_ATTR)
+
+  triples = memo.fetch(_memo_key('marked', model, attr, filters, filters),
+                       nodes, lambda nodes: frontier.fetch(related_model, nodes, get_triples))
+  triples = [(obj, src, bool(p)) for obj, src, p in triples]
+  return triples, related_model if len(triples) else None
+
+
+def get_edge_table(rel_obj_descriptor):
+  """
+  For a Django relationship whose edges are rows of one table, returns the
+  table, the column referencing objects the relationship starts from, and the
+  column referencing the related objects. Returns None for other
+  relationships.
+  """
+
+  t = type(rel_obj_descriptor)
+  if t in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor):
+    field = rel_obj_descriptor.field
+    if not field.target_field.primary_key:
+      return None
+    return field.model._meta.db_table, field.model._meta.pk.column, field.column
+
+  elif t in (ReverseManyToOneDescriptor, ReverseOneToOneDescriptor):
+    if t == ReverseOneToOneDescriptor:
+      rel_obj = rel_obj_descriptor.related
+    else:
+      rel_obj = rel_obj_descriptor.rel
+    field = rel_obj.field
+    if not field.target_field.primary_key:
+      return None
+    return field.model._meta.db_table, field.column, field.model._meta.pk.column
+
+  elif t == ManyToManyDescriptor:
+    field = rel_obj_descriptor.field
+    if rel_obj_descriptor.reverse:
+      return field.m2m_db_table(), field.m2m_reverse_name(), field.m2m_column_name()
+    return field.m2m_db_table(), field.m2m_column_name(), field.m2m_reverse_name()
+
+  return None
+
+
+RECURSIVE_QUERY_VENDORS = ('sqlite', 'postgresql')
+
+
+def traverse_recursive(nodes, model, attr, filters, collect):
+  """
+  Traverse a relationship from model back to model recursively, with a single
+  WITH RECURSIVE query. Returns (node, root, parent, passed) rows, one for
+  each edge from parent to node reached starting from root, and one with None
+  parent for each root; passed is true if node passes the filters.
+
+  Relationships are followed past nodes according to the collect mode, the
+  same way Query._recursive_rel does: 'all' follows every edge, 'until' and
+  'terminal' only edges to nodes passing the filters ('until' also drops roots
+  not passing the filters), and 'search' only edges from roots.
+
+  Returns None if the relationship cannot be traversed this way, e.g. if it is
+  a relationship function, or the database does not support recursive
+  queries. Also returns None for 'search' with filters, since the loop in
+  Query._recursive_rel stops at nodes passing the filters one level at a
+  time, across all roots with the same source.
+  """
+
+  related_model, lookup = get_related_lookup(attr)
+  edge_table = get_edge_table(attr)
+  if related_model is not model or edge_table is None or\
+     not _uses_plain_manager(model) or\
+     not isinstance(model._meta.pk, (AutoField, IntegerField)) or\
+     not chain_filters(model, filters, True) or\
+     (collect == 'search' and filters):
+    return None
+
+  db = router.db_for_read(model)
+  connection = connections[db]
+  if connection.vendor not in RECURSIVE_QUERY_VENDORS:
+    return None
+
+  qn = connection.ops.quote_name
+  table, src_column, dst_column = edge_table
+  pk = '%s.%s' % (qn(model._meta.db_table), qn(model._meta.pk.column))
+
+  edges = 'edges(src, dst) AS (SELECT %s, %s FROM %s WHERE %s IS NOT NULL AND %s IS NOT NULL)' %\
+          (qn(src_column), qn(dst_column), qn(table), qn(src_column), qn(dst_column))
+  anchor = 'SELECT %s, %s, NULLIF(%s, %s) FROM %s WHERE %s IN (%%s)' %\
+           (pk, pk, pk, pk, qn(model._meta.db_table), pk)
+  recursive = 'SELECT edges.dst, reach.root, reach.node FROM reach'\
+              ' INNER JOIN edges ON edges.src = reach.node'
+  if collect == 'search':
+    recursive += ' WHERE reach.node = reach.root'
+
+  # passing holds pks of objects passing the filters, among objects reachable
+  # from the roots, so filters are not evaluated over the whole table. It is
+  # joined rather than used in IN clauses in the recursive term, since
+  # databases evaluate IN subqueries again at every level of recursion. If
+  # passing limits the traversal, objects reachable from the roots are first
+  # found without the filters.
+  passing_sql, passing_params = None, []
+  follows_passing = collect in ('until', 'terminal') and filters
+  if filters:
+    reached = 'reachable' if follows_passing else 'reach'
+    queryset = mk_filter_function(filters)(_related_queryset(attr, model))
+    queryset = queryset.extra(where=['%s IN (SELECT %s.node FROM %s)' % (pk, reached, reached)])
+    queryset = queryset.order_by().values_list('pk').distinct()
+    passing_sql, passing_params = queryset.query.get_compiler(using=db).as_sql()
+    passing_sql = 'passing(pk) AS (%s)' % passing_sql
+
+  if collect == 'until' and filters:
+    anchor += ' AND %s IN (SELECT passing.pk FROM passing)' % pk
+  if follows_passing:
+    recursive += ' INNER JOIN passing ON passing.pk = edges.dst'
+
+  passed = 'CASE WHEN reach.node IN (SELECT passing.pk FROM passing) THEN 1 ELSE 0 END'\
+           if filters else '1'
+
+  # rows for different roots are independent, so large frontiers of roots can
+  # be split into chunks
+  def get_rows(rhs):
+    roots_sql, roots_params = frontier.to_sql(rhs)
+    reach = 'reach(node, root, parent) AS (%s UNION %s)' % (anchor % roots_sql, recursive)
+    if follows_passing:
+      reachable = 'reachable(node) AS (SELECT %s FROM %s WHERE %s IN (%s)'\
+                  ' UNION SELECT edges.dst FROM reachable'\
+                  ' INNER JOIN edges ON edges.src = reachable.node)' %\
+                  (pk, qn(model._meta.db_table), pk, roots_sql)
+      ctes = [edges, reachable, passing_sql, reach]
+      params = roots_params+list(passing_params)+roots_params
+    elif filters:
+      ctes = [edges, reach, passing_sql]
+      params = roots_params+list(passing_params)
+    else:
+      ctes = [edges, reach]
+      params = roots_params
+    sql = 'WITH RECURSIVE %s SELECT reach.node, reach.root, reach.parent, %s FROM reach' %\
+          (', '.join(ctes), passed)
+    with connection.cursor() as cursor:
+      cursor.execute(sql, params)
+      return cursor.fetchall()
+
+  rows = frontier.fetch(model, nodes, get_rows)
+  return [(node, root, parent, bool(p)) for node, root, parent, p in rows]
+
+
 def traverse(nodes, attr, filters=None):
   """
   Traverse one relationship on list of nodes. Returns output, input tuple
@@ -201,11 +810,7 @@ def traverse(nodes, attr, filters=None):
     return nodes
 
   f = get_related_obj_accessor(attr, nodes[0])
-  nodes = f(nodes, filters=filters)
-
-  def _execute(nodes):
-    return list(nodes)
-  nodes = _execute(nodes)
+  nodes = list(f(nodes, filters=filters))
 
   if len(nodes) == 0:
     return []
@@ -214,14 +819,6 @@ def traverse(nodes, attr, filters=None):
   elif type(nodes[0]) == tuple:
     return nodes
 
+  # relationship function returning objects only
   else:
-    nodes_with_src = []
-    for node in nodes:
-      src = None
-      for a in dir(node):
-        if a.startswith(INPUT_ATTR_PREFIX):
-          src = getattr(node, a)
-          break
-      nodes_with_src.append((node, src))
-
-    return nodes_with_src
+    return [(node, getattr(node, INPUT_ATTR_PREFIX, None)) for node in nodes]
@@ -0,0 +1,86 @@
+"""
+Joins on lists of (output, input) pairs, the way the query engine combines the
+results of its steps. Outputs are pks, so they hash cheaply; for custom
+models, outputs are objects, and callers pass a key function returning their
+pks. All functions keep the order of their input, and drop duplicates.
+"""
+
+
+def unique(items):
+  """
+  Returns items without duplicates, keeping the first of each.
+  """
+
+  items = list(items)
+  # most of the time there are no duplicates, and building a set is a lot
+  # faster than checking each item in Python
+  if len(set(items)) == len(items):
+    return items
+  seen = set()
+  add = seen.add
+  return [x for x in items if not (x in seen or add(x))]
+
+
+def difference(items, other):
+  """
+  Returns unique items not in other.
+  """
+
+  other = set(other)
+  return [x for x in unique(items) if x not in other]
+
+
+def hash_join(left, right, key=None):
+  """
+  Joins (obj, src) pairs in left with (next_obj, next_src) pairs in right,
+  where next_src is the key of obj, and returns unique (next_obj, src) pairs.
+  Key is a function returning the key of obj; obj itself is the key if key
+  is None.
+  """
+
+  # keys usually have one src each; keep those in a flat dict, and only make
+  # lists for keys with more
+  src_of = {}
+  more_srcs = {}
+  for obj, src in left:
+    k = obj if key is None else key(obj)
+    if k not in src_of:
+      src_of[k] = src
+    elif k in more_srcs:
+      more_srcs[k].append(src)
+    else:
+      more_srcs[k] = [src_of[k], src]
+
+  if len(more_srcs) == 0:
+    return unique([(next_obj, src_of[next_src])
+                   for next_obj, next_src in right if next_src in src_of])
+
+  joined = []
+  for next_obj, next_src in right:
+    if next_src in more_srcs:
+      joined.extend([(next_obj, src) for src in more_srcs[next_src]])
+    elif next_src in src_of:
+      joined.append((next_obj, src_of[next_src]))
+  return unique(joined)
+
+
+def semi_join(pairs, keys, key=None):
+  """
+  Returns unique (obj, src) pairs where the key of obj is in keys.
+  """
+
+  keys = keys if isinstance(keys, (set, frozenset, dict)) else set(keys)
+  if key is None:
+    return unique([t for t in pairs if t[0] in keys])
+  return unique([t for t in pairs if key(t[0]) in keys])
+
+
+def anti_join(pairs, keys, key=None):
+  """
+  Returns unique (obj, src) pairs where the key of obj is not in keys.
+  """
+
+  keys = keys if isinstance(keys, (set, frozenset, dict)) else set(keys)
+  if key is None:
+    return unique([t for t in pairs if t[0] not in keys])
+  return unique([t for t in pairs if key(t[0]) not in keys])
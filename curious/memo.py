@@ -0,0 +1,94 @@
+"""
+Memo of edges fetched while executing one query. The same relationship is
+often followed from the same objects more than once in a query, e.g. by
+recursive relationships reaching objects from several starting objects, or by
+subqueries repeating steps of the main query; with the memo, each edge is only
+fetched from the database once per execution.
+"""
+
+import threading
+from contextlib import contextmanager
+from . import settings
+
+
+_local = threading.local()
+
+
+class EdgeMemo(object):
+  """
+  Edges by relationship, then by the node they start from. Counts rows taken
+  from the memo instead of the database in rows_saved.
+  """
+
+  def __init__(self):
+    self.edges = {}
+    self.rows_saved = 0
+    self.__lock = threading.Lock()
+
+  def fetch(self, key, nodes, f, src):
+    edges = self.edges.setdefault(key, {})
+    nodes = [getattr(node, 'pk', node) for node in nodes]
+    missing = [node for node in set(nodes) if node not in edges]
+
+    if len(missing) > 0:
+      fetched = dict((node, []) for node in missing)
+      for row in f(missing):
+        fetched.setdefault(src(row), []).append(row)
+      # fill in edges at once, so other threads see all edges of a node, or
+      # none of them
+      edges.update(fetched)
+    else:
+      fetched = {}
+
+    rows = []
+    saved = 0
+    seen = set()
+    for node in nodes:
+      if node not in seen:
+        seen.add(node)
+        rows.extend(edges[node])
+        if node not in fetched:
+          saved += len(edges[node])
+    with self.__lock:
+      self.rows_saved += saved
+    return rows
+
+
+def current():
+  """
+  Returns memo of the query executing on this thread, or None.
+  """
+
+  return getattr(_local, 'memo', None)
+
+
+@contextmanager
+def execution(memo=None):
+  """
+  Context manager for executing a query, yielding the memo of the execution:
+  memo if not None, e.g. to share the memo of a query with threads running
+  parts of it, otherwise a new memo.
+  """
+
+  previous = current()
+  _local.memo = memo if memo is not None else EdgeMemo()
+  try:
+    yield _local.memo
+  finally:
+    _local.memo = previous
+
+
+def fetch(key, nodes, f, src=lambda row: row[1]):
+  """
+  Returns rows f returns for nodes, where f takes a list of nodes. If a query
+  is executing, only calls f with nodes not fetched before with the same key,
+  and takes rows for other nodes from the memo. Key identifies the
+  relationship and filters, and must only be given if rows for a node do not
+  depend on other nodes, e.g. filters do not page. Src returns the node a row
+  is for.
+  """
+
+  memo = current()
+  if memo is None or key is None or not settings.EDGE_MEMO:
+    return f(nodes)
+  return memo.fetch(key, nodes, f, src)
@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
 
@@ -6,6 +8,75 @@ from datetime import datetime
 import parsedatetime
 
 from .grammar import QUERY_PEG
+from .rdparser import RDParser
+from . import settings
+
+
+# compiling the grammar is expensive, so only do it once per process
+GRAMMAR = Grammar(QUERY_PEG)
+
+
+def _copy_parsed(value):
+  """
+  Copies a parsed query. Parsed queries only contain dicts, lists and scalar
+  values, so this is a lot cheaper than copy.deepcopy.
+  """
+
+  if type(value) == dict:
+    return dict((k, _copy_parsed(v)) for k, v in value.iteritems())
+  if type(value) == list:
+    return [_copy_parsed(v) for v in value]
+  return value
+
+
+class ParseCache(object):
+  """
+  Thread-safe, bounded LRU cache of query string to parsed query. Parsed
+  queries are copied on the way in and out, so callers are free to modify
+  what they get back.
+  """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.__entries = OrderedDict()
+    self.__lock = threading.Lock()
+
+  def get(self, key):
+    with self.__lock:
+      if key not in self.__entries:
+        self.misses += 1
+        return None
+      self.hits += 1
+      parsed = self.__entries.pop(key)
+      self.__entries[key] = parsed
+    return _copy_parsed(parsed)
+
+  def set(self, key, parsed):
+    if self.max_size <= 0:
+      return
+    parsed = _copy_parsed(parsed)
+    with self.__lock:
+      self.__entries.pop(key, None)
+      self.__entries[key] = parsed
+      while len(self.__entries) > self.max_size:
+        self.__entries.popitem(last=False)
+
+  def clear(self):
+    with self.__lock:
+      self.__entries.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self):
+    return len(self.__entries)
+
+  def stats(self):
+    return dict(hits=self.hits, misses=self.misses, size=len(self), max_size=self.max_size)
+
+
+parse_cache = ParseCache(settings.PARSER_CACHE_SIZE)
 
 
 class Parser(object):
@@ -17,23 +88,37 @@ class Parser(object):
     self.object_query = {}
     self.steps = []
 
-    # parsing:
-    grammar = Grammar(QUERY_PEG)
-    self.__nodes = grammar.parse(code)
-    self._translate()
-
-  def _translate(self):
-    ast_builder = ASTBuilder()
-    query = ast_builder.visit(self.__nodes)
+    query = parse_cache.get(code)
+    if query is None:
+      query = self._parse(code)
     self.object_query = query[0]
     self.steps = query[1:]
 
+  def _parse(self, code):
+    if settings.PARSER_BACKEND == 'rd':
+      builder = RDParser(code)
+      query = builder.parse()
+    elif settings.PARSER_BACKEND == 'peg':
+      builder = ASTBuilder()
+      query = builder.visit(GRAMMAR.parse(code))
+    else:
+      raise Exception('Unknown parser backend "%s"' % settings.PARSER_BACKEND)
+
+    # relative dates, e.g. t"3 days ago", depend on when the query is parsed,
+    # so queries using them cannot be cached
+    if builder.cacheable:
+      parse_cache.set(code, query)
+    return query
+
 
 from parsimonious.nodes import NodeVisitor
 
 
 class ASTBuilder(NodeVisitor):
 
+  def __init__(self):
+    self.cacheable = True
+
   def visit_query(self, node, args):
     (obj_query, _1, steps, _2) = args
     if type(steps) == list:
@@ -222,6 +307,7 @@ class ASTBuilder(NodeVisitor):
     (t, s) = args
     if type(t) == list:
       if t[0].text == 't':
+        self.cacheable = False
         c = parsedatetime.Calendar()
         t = c.parse(s)
         return datetime.fromtimestamp(mktime(t[0]))
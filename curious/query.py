@@ -1,11 +1,34 @@
+import json
 import time
 from curious import model_registry
-from curious.graph import traverse, mk_filter_function
+from curious.graph import (
+  traverse_pks,
+  traverse_pks_marked,
+  traverse_chain,
+  traverse_union,
+  traverse_recursive,
+  filter_by_chain,
+  mk_filter_function,
+  get_chain_link,
+  chain_filters,
+  to_nodes,
+  to_instances,
+  node_pk,
+  is_django_model,
+)
+from . import columns, frontier, join, memo, settings
+from .branches import run_branches
 from .parser import Parser
 from .utils import report_time
 
 
 class Query(object):
+  """
+  Internally, the query engine passes around nodes rather than model
+  instances: pks for Django models, and objects for custom models (see
+  graph.to_nodes), along with the model of the nodes. Only the final results
+  are converted back to objects, if asked for.
+  """
 
   def __init__(self, query):
     parser = Parser(query)
@@ -13,12 +36,22 @@ class Query(object):
     self.__obj_query = parser.object_query
     self.__steps = parser.steps
     self.__validate()
+    self.rows_saved = 0
 
 
   @property
   def query_string(self):
     return self.__query
 
+  @property
+  def canonical(self):
+    """
+    Canonical form of the current query, the same for queries that only
+    differ in whitespace or in order of filter arguments.
+    """
+
+    return json.dumps([self.__obj_query]+self.__steps, sort_keys=True, default=unicode)
+
 
   @staticmethod
   def _validate(query):
@@ -27,7 +60,7 @@ class Query(object):
     relationships or subqueries. This function checks each model relationship
     to make sure the model and the relationship exist.
     """
-    
+
     for rel in query:
       if 'orquery' in rel:
         for q in rel['orquery']:
@@ -49,7 +82,7 @@ class Query(object):
 
   def __get_objects(self):
     """
-    Get initial objects from object query.
+    Get initial objects from object query. Returns nodes and their model.
     """
 
     model = self.__obj_query['model']
@@ -61,57 +94,101 @@ class Query(object):
       cls = model_registry.get_manager(model).model_class
       q = cls.objects.all()
       q = filter_f(q)
-      return q
+      return list(q.values_list('pk', flat=True)), cls
     else:
       f = model_registry.get_manager(model).getattr(method)
-      return f(filter_f)
+      return to_nodes(list(f(filter_f)))
+
+  @staticmethod
+  def _key(model):
+    """
+    Returns key function for join functions, for nodes of model.
+    """
+
+    return None if model is None or is_django_model(model) else node_pk(model)
 
 
   @staticmethod
-  def _extend_result(obj_src, next_obj_src):
-    # build input hash of IDs
-    input_map = {}
-    for obj, src in obj_src:
-      if obj.pk not in input_map:
-        input_map[obj.pk] = []
-      input_map[obj.pk].append(src)
+  def _extend_result(obj_src, model, next_obj_src):
+    """
+    Joins results of a step with results so far. Large results of Django
+    models are joined, and kept, as columns.Pairs, if NumPy is installed.
+    """
 
-    keep = []
-    for next_obj, next_src in next_obj_src:
-      if next_src in input_map:
-        for src in input_map[next_src]:
-          keep.append((next_obj, src))
+    key = Query._key(model)
+    if key is None and columns.use_columns(obj_src, next_obj_src):
+      left = columns.to_columns(obj_src)
+      right = columns.to_columns(next_obj_src) if left is not None else None
+      if right is not None:
+        return columns.hash_join(left, right)
+    return join.hash_join(obj_src, next_obj_src, key)
+
+  @staticmethod
+  def _check_type(obj_src, obj_model, model):
+    """
+    Checks if type of objects matches the model the next step expects.
+    """
 
-    return list(set(keep))
+    if len(obj_src):
+      if obj_model != model_registry.get_manager(model).model_class:
+        raise Exception('Type mismatch when executing query: expecting "%s", got "%s"' %
+                        (model, obj_model))
 
 
   @staticmethod
   @report_time
-  def _graph_step(obj_src, model, step_f, filters, tree=None):
+  def _graph_step(obj_src, obj_model, model, step_f, filters, tree=None, cache_as=None):
     """
     Traverse one step on the graph. Takes in and returns arrays of output,
     input object tuples. The input objects in the tuples are from start of the
-    query, not start of this step.
+    query, not start of this step. Also returns model of the output objects.
     """
 
-    # check if type matches existing object type
-    if len(obj_src):
-      t = type(obj_src[0][0])
-      if hasattr(t, '_deferred') and t._deferred:
-        t = t.__base__
-      if t != model_registry.get_manager(model).model_class:
-        raise Exception('Type mismatch when executing query: expecting "%s", got "%s"' %
-                        (model, type(obj_src[0][0])))
+    Query._check_type(obj_src, obj_model, model)
+    nodes = [obj for obj, src in obj_src]
+    next_obj_src, next_model = traverse_pks(nodes, obj_model, step_f, filters, cache_as)
+    if tree is not None:
+      pk = node_pk(next_model)
+      tree.extend((pk(t[0]), t[1]) for t in next_obj_src)
+
+    return Query._extend_result(obj_src, obj_model, next_obj_src), next_model
+
+  @staticmethod
+  @report_time
+  def _marked_step(obj_src, new_src, obj_model, model, step_f, filters, tree=None, cache_as=None):
+    """
+    Traverse one level of a recursive relationship with one query, fetching
+    edges from all objects in obj_src regardless of filters, each marked with
+    whether the output object passes the filters. Returns output, input object
+    tuples for objects passing filters reached from new_src, like _graph_step;
+    output, input object tuples for all objects reached from obj_src; pks of
+    objects in obj_src with outputs passing filters; and model of the outputs.
+    Returns None if the relationship cannot be traversed this way.
+    """
 
-    next_obj_src = traverse([obj for obj, src in obj_src], step_f, filters)
+    Query._check_type(obj_src, obj_model, model)
+    nodes = list(set([obj for obj, src in obj_src]))
+    marked = traverse_pks_marked(nodes, obj_model, step_f, filters, cache_as)
+    if marked is None:
+      return None
+
+    next_obj_src, next_model = marked
+    pk = node_pk(obj_model)
+    new_nodes = set([pk(obj) for obj, src in new_src])
+    passed = [(obj, src) for obj, src, p in next_obj_src if p]
+    passed_from_new = [t for t in passed if t[1] in new_nodes]
     if tree is not None:
-      tree.extend((t[0].id, t[1]) for t in next_obj_src)
+      tree.extend(passed_from_new)
 
-    return Query._extend_result(obj_src, next_obj_src)
+    reached = [(obj, src) for obj, src, p in next_obj_src]
+    return (Query._extend_result(new_src, obj_model, passed_from_new),
+            Query._extend_result(obj_src, obj_model, reached),
+            set([src for obj, src in passed]),
+            next_model)
 
 
   @staticmethod
-  def _recursive_rel(obj_src, step):
+  def _recursive_rel(obj_src, obj_model, step):
     """
     Traverse a relationship recursively. Collected objects, either loop
     terminating objects or loop continuing objects. Returns arrays of output,
@@ -124,87 +201,133 @@ class Query(object):
     filters = step['filters']
     collect = step['collect']
     step_f = model_registry.get_manager(model).getattr(method)
+    cache_as = Query._cache_as(step)
 
-    collected = {}
+    collected = []
     tree = []
     starting = True
 
     if collect == 'search' and filters is None:
-      return obj_src
-    
-    to_remove = []
+      return obj_src, obj_model, tree
+
+    # cached relationships are traversed one level at a time, from the cache
+    if settings.RECURSIVE_QUERIES and cache_as is None and len(obj_src) > 0:
+      Query._check_type(obj_src, obj_model, model)
+      collected = Query._recursive_query(obj_src, obj_model, step_f, filters, collect)
+      if collected is not None:
+        return collected[0], obj_model, collected[1]
+      collected = []
+
     if collect in ("all", "until", "search"):
       # if traversal or search, then keep starting nodes if starting nodes pass filter
       if filters in (None, {}, []):
-        for tup in obj_src:
-          collected[tup] = 1
+        collected.extend(obj_src)
       else:
         filter_f = mk_filter_function(filters)
         if len(obj_src) > 0:
-          ids = [obj.id for obj, src in obj_src]
-          q = obj_src[0][0].__class__.objects.filter(id__in=ids)
-          q = filter_f(q)
-          matched_objs = {obj.pk: 1 for obj in q}
-          for tup in obj_src:
-            if tup[0].pk in matched_objs:
-              collected[tup] = 1
-            elif collect == 'until':
-              # cannot continue to search with this starting node
-              to_remove.append(tup)
-
-    if len(to_remove) > 0:
-      obj_src = [tup for tup in obj_src if tup not in to_remove]
-
-    visited = {}
+          ids = [obj for obj, src in obj_src]
+
+          def matching(rhs):
+            return filter_f(obj_model.objects.filter(pk__in=rhs)).values_list('pk', flat=True)
+
+          matched = frontier.fetch(obj_model, ids, matching,
+                                   chunk=chain_filters(obj_model, filters, True))
+          matched = join.semi_join(obj_src, set(matched))
+          collected.extend(matched)
+          if collect == 'until':
+            # cannot continue to search from starting nodes not matched
+            obj_src = matched
+
+    visited = set()
+    # model of objects in obj_src, which changes as we traverse; type check in
+    # _graph_step fails if the relationship does not lead back to the same model
+    step_model = obj_model
 
     while len(obj_src) > 0:
       # prevent loops by removing previously encountered edges; because many
       # edges can lead to the same object, preventing revisit of edges rather
       # than objects avoids loops without missing out on an edge.
       new_src = [tup for tup in obj_src if tup not in visited]
-      for tup in obj_src:
-        visited[tup] = 1
+      visited.update(obj_src)
 
       if len(new_src) == 0:
         break
-      next_obj_src = Query._graph_step(new_src, model, step_f, filters, tree)
+
+      # fetch edges once for the level, regardless of filters, and derive
+      # objects passing filters, all reachable objects, and objects with
+      # children passing filters from the same edges. 'until' only needs
+      # objects passing filters, so it does not need to fetch all edges.
+      level = None
+      if collect != 'until':
+        level = Query._marked_step(obj_src, new_src, step_model, model, step_f, filters, tree,
+                                   cache_as)
+
+      if level is not None:
+        next_obj_src, reachable, has_children, next_model = level
+        reachable_model = next_model
+      else:
+        next_obj_src, next_model = Query._graph_step(new_src, step_model, model, step_f, filters,
+                                                     tree, cache_as)
+        if collect == 'terminal':
+          next_demux, m = Query._graph_step([(obj, obj) for obj, src in obj_src], step_model, model,
+                                            step_f, filters, cache_as=cache_as)
+          has_children = set([t[1] for t in next_demux])
+        elif collect in ('search', 'all'):
+          reachable, reachable_model = Query._graph_step(obj_src, step_model, model, step_f, None,
+                                                         cache_as=cache_as)
       # print "from %s\nreach %s" % (new_src, next_obj_src)
 
       if collect == 'terminal':
-        next_demux = Query._graph_step([(obj, obj.pk) for obj, src in obj_src], model, step_f, filters)
-        next_src = [t[1] for t in next_demux]
-
-        for tup in obj_src:
-          if tup[0].pk not in next_src:
-            if tup not in collected:
-              collected[tup] = 1
-        obj_src = next_obj_src
+        collected.extend(join.anti_join(obj_src, has_children))
+        obj_src, step_model = next_obj_src, next_model
 
       elif collect == 'search':
-        reachable = Query._graph_step(obj_src, model, step_f, None)
-        for tup in next_obj_src:
-          if tup not in collected:
-            collected[tup] = 1
-        obj_src = list(set(reachable)-set(next_obj_src))
+        collected.extend(next_obj_src)
+        obj_src, step_model = join.difference(reachable, next_obj_src), reachable_model
 
       elif collect == 'until':
-        for tup in next_obj_src:
-          if tup not in collected:
-            collected[tup] = 1
-        obj_src = next_obj_src
+        collected.extend(next_obj_src)
+        obj_src, step_model = next_obj_src, next_model
 
       else: # traversal
-        reachable = Query._graph_step(obj_src, model, step_f, None)
-        for tup in next_obj_src:
-          if tup not in collected:
-            collected[tup] = 1
-        obj_src = reachable
+        collected.extend(next_obj_src)
+        obj_src, step_model = reachable, reachable_model
 
-    return collected.keys(), tree
+    return join.unique(collected), obj_model, tree
+
+  @staticmethod
+  @report_time
+  def _recursive_query(obj_src, obj_model, step_f, filters, collect):
+    """
+    Traverse a relationship recursively using one query, see
+    graph.traverse_recursive. Returns collected output, input object tuples
+    and the tree of traversed edges, or None if the relationship cannot be
+    traversed with one query.
+    """
+
+    nodes = list(set([obj for obj, src in obj_src]))
+    rows = traverse_recursive(nodes, obj_model, step_f, filters, collect)
+    if rows is None:
+      return None
+
+    tree = join.unique([(node, parent) for node, root, parent, passed in rows
+                        if parent is not None and passed])
+    has_children = set([(parent, root) for node, root, parent, passed in rows
+                        if parent is not None])
+
+    if collect == 'until':
+      reached = rows
+    elif collect == 'terminal':
+      reached = [row for row in rows if (row[0], row[1]) not in has_children]
+    else:
+      reached = [row for row in rows if row[3]]
+
+    collected = join.hash_join(obj_src, [(node, root) for node, root, parent, passed in reached])
+    return collected, tree
 
 
   @staticmethod
-  def _rel_step(obj_src, step):
+  def _rel_step(obj_src, obj_model, step):
     """
     Traverse a relationship, possibly recursively. Takes in and returns arrays
     of output, input object tuples. The input objects in the tuples are from
@@ -218,27 +341,300 @@ class Query(object):
       method = step['method']
       filters = step['filters']
       step_f = model_registry.get_manager(model).getattr(method)
-      obj_src = Query._graph_step(obj_src, model, step_f, filters)
+      obj_src, obj_model = Query._graph_step(obj_src, obj_model, model, step_f, filters,
+                                             cache_as=Query._cache_as(step))
 
     else:
-      obj_src, tree = Query._recursive_rel(obj_src, step)
+      obj_src, obj_model, tree = Query._recursive_rel(obj_src, obj_model, step)
 
     # print '%s: %d' % (step, len(obj_src))
-    return obj_src, tree
+    return obj_src, obj_model, tree
+
+  @staticmethod
+  @report_time
+  def _chain_step(obj_src, obj_model, step):
+    """
+    Traverse a chain of relationships with one query. Takes in and returns
+    arrays of output, input object tuples, like _graph_step.
+    """
+
+    steps = step['chain']
+    Query._check_type(obj_src, obj_model, steps[0]['model'])
+    attrs = [model_registry.get_manager(s['model']).getattr(s['method']) for s in steps]
+    filters = [s['filters'] for s in steps]
+    next_obj_src, next_model = traverse_chain([obj for obj, src in obj_src], attrs, filters)
+    return Query._extend_result(obj_src, obj_model, next_obj_src), next_model
+
+  @staticmethod
+  def _cache_as(step):
+    """
+    Returns name to cache neighbors of the relationship of step under, if
+    the relationship is cached across requests; otherwise returns None.
+    """
+
+    manager = model_registry.get_manager(step['model'])
+    if step['method'] in manager.cached_relationships:
+      return '%s.%s' % (manager.model_name, step['method'])
+    return None
+
+  @staticmethod
+  def _chain_link(step):
+    """
+    Returns model reached by step, if step is a relationship that can be part
+    of a chain of relationships executed as one query.
+    """
+
+    if 'orquery' in step or 'subquery' in step or step.get('recursive', False):
+      return None
+    # cached relationships are traversed from the cache, one at a time
+    if Query._cache_as(step) is not None:
+      return None
+    return get_chain_link(model_registry.get_manager(step['model']).getattr(step['method']))
+
+  @staticmethod
+  def _plan(query):
+    """
+    Plans execution of query: shares steps common to OR branches, then groups
+    runs of plain Django relationships into chain steps.
+    """
+
+    return Query._chain_runs(Query._share_prefixes(query))
+
+  @staticmethod
+  def _chain_runs(query):
+    """
+    Groups runs of plain Django relationships into chain steps, so each run is
+    executed as one joined query rather than one query per relationship. A
+    chain can start a join, but cannot continue past one, and custom
+    relationship functions, recursive relationships, subqueries and OR queries
+    are never part of a chain.
+    """
+
+    planned = []
+    run = []
+    run_model = None
+
+    for step in query + [None]:
+      if step is not None:
+        model = Query._chain_link(step)
+        if model is not None:
+          if (
+            len(run) > 0
+            and step.get('join', False) is False
+            and run_model == model_registry.get_manager(step['model']).model_class
+            and chain_filters(run_model, run[-1]['filters'], False)
+            and chain_filters(model, step['filters'], True)
+          ):
+            run.append(step)
+            run_model = model
+            continue
+
+      if len(run) > 1:
+        planned.append(dict(chain=run, join=run[0].get('join', False)))
+      else:
+        planned.extend(run)
+      run = []
+      run_model = None
+
+      if step is not None:
+        if model is not None and chain_filters(model, step['filters'], True):
+          run = [step]
+          run_model = model
+        else:
+          planned.append(step)
+
+    return planned
+
+  @staticmethod
+  def _as_chain(query):
+    """
+    Returns the relationships of query, if query is a chain of plain Django
+    relationships that can be compiled into SQL as a whole, e.g. to check
+    existence of results or as part of a UNION; otherwise returns None.
+    """
 
+    planned = Query._plan(query)
+    if len(planned) != 1 or planned[0].get('join', False):
+      return None
+    if 'chain' in planned[0]:
+      return planned[0]['chain']
+    model = Query._chain_link(planned[0])
+    if model is not None and chain_filters(model, planned[0]['filters'], True):
+      return planned
+    return None
 
   @staticmethod
-  def _filter_by_subquery(obj_src, step):
+  def _cost(query):
     """
-    Filters existing objects by the subquery.
+    Estimates the number of SQL queries running query takes, for choosing
+    between equivalent plans.
+    """
+
+    cost = 0
+    for step in Query._chain_runs(query):
+      if 'orquery' in step:
+        unions = set()
+        for branch in step['orquery']:
+          steps = Query._as_chain(branch)
+          if steps is None:
+            cost += Query._cost(branch)
+          else:
+            unions.add(Query._chain_link(steps[-1]))
+        cost += len(unions)
+      elif 'subquery' in step:
+        if step['having'] in ('+', '-') and Query._as_chain(step['subquery']) is not None:
+          cost += 1
+        else:
+          cost += Query._cost(step['subquery'])
+      else:
+        cost += 1
+    return cost
+
+  @staticmethod
+  def _shareable(step):
+    """
+    True if step can run once for several branches starting with it: a
+    relationship that does not join or recurse.
+    """
+
+    return 'method' in step and not step.get('join', False) and not step.get('recursive', False)
+
+  @staticmethod
+  def _factor_branches(branches):
+    """
+    Merges OR branches starting with the same step into one branch, which
+    takes that step once, then ORs the rest of the merged branches.
+    """
+
+    groups = []
+    for branch in branches:
+      for group in groups:
+        if group[0][0] == branch[0]:
+          group.append(branch)
+          break
+      else:
+        groups.append([branch])
+
+    factored = []
+    for group in groups:
+      first = group[0][0]
+      if len(group) == 1 or not Query._shareable(first) or\
+         any(len(branch) == 1 for branch in group):
+        factored.extend(group)
+      else:
+        rest = Query._factor_branches([branch[1:] for branch in group])
+        factored.append([first]+(rest[0] if len(rest) == 1 else [dict(orquery=rest, join=False)]))
+    return factored
+
+  @staticmethod
+  def _share_prefixes(query):
+    """
+    Rewrites OR queries with branches starting with the same steps, so those
+    steps run once, and their results fan out to the rest of the branches.
+    Only rewrites if that takes fewer SQL queries, since branches that are
+    chains of relationships already run as one query.
+    """
+
+    shared = []
+    for step in query:
+      if 'orquery' in step:
+        branches = Query._factor_branches(step['orquery'])
+        if len(branches) < len(step['orquery']):
+          steps = branches[0] if len(branches) == 1 else [dict(orquery=branches)]
+          steps = [dict(steps[0], join=step.get('join', False))]+steps[1:]
+          if Query._cost(steps) < Query._cost([step]):
+            shared.extend(steps)
+            continue
+      shared.append(step)
+    return shared
+
+  @staticmethod
+  def _subquery_prefixes(planned):
+    """
+    Finds subqueries adding results, i.e. ?(...) and (...), starting with the
+    same steps, and returns a dict mapping index of each such subquery in
+    planned to the steps it shares, if running those steps once for all the
+    subqueries takes fewer SQL queries.
+    """
+
+    subqueries = [(i, step['subquery']) for i, step in enumerate(planned)
+                  if 'subquery' in step and step['having'] in (None, '?')]
+    prefixes = {}
+    for i, subquery in subqueries:
+      if i in prefixes:
+        continue
+      # number of steps each other subquery shares with this one
+      shares = {}
+      for j, other in subqueries:
+        if j == i or j in prefixes:
+          continue
+        k = 0
+        while (k < min(len(subquery), len(other))-1 and subquery[k] == other[k]
+               and Query._shareable(subquery[k])):
+          k += 1
+        shares[j] = k
+      n = max(shares.values()) if len(shares) > 0 else 0
+      if n == 0:
+        continue
+      # only subqueries sharing all n steps share them; others may share
+      # fewer steps with each other later
+      group = [i]+sorted(j for j, k in shares.iteritems() if k == n)
+      prefix = subquery[:n]
+      unshared = sum(Query._cost(planned[j]['subquery']) for j in group)
+      shared = Query._cost(prefix)+sum(Query._cost(planned[j]['subquery'][n:]) for j in group)
+      if shared < unshared:
+        for j in group:
+          prefixes[j] = prefix
+    return prefixes
+
+  @staticmethod
+  def _shared_subquery(objects, model, subquery, prefix, shared):
+    """
+    Runs subquery, which starts with the steps in prefix. Results of prefix
+    are kept in shared, and reused by other subqueries starting with the same
+    steps, on the same objects.
+    """
+
+    for shared_prefix, shared_objects, prefix_src, prefix_model in shared:
+      if shared_prefix == prefix and shared_objects == objects:
+        break
+    else:
+      res, prefix_model = Query._query(objects, model, prefix)
+      prefix_src = res[-1][0]
+      shared.append((prefix, objects, prefix_src, prefix_model))
+    return Query._run(prefix_src, prefix_model, subquery[len(prefix):])
+
+
+  @staticmethod
+  def _filter_by_subquery(obj_src, obj_model, step, prefix=None, shared=None):
+    """
+    Filters existing objects by the subquery. If prefix is not None, the
+    first steps of the subquery are shared with other subqueries, and their
+    results are kept in shared.
     """
 
     subquery = step['subquery']
     having = step['having']
     #print 'sub %s, having %s' % (subquery, having)
 
+    if having in ('+', '-'):
+      # only existence of subquery results matters; check that in the
+      # database, without fetching the results, if possible
+      steps = Query._as_chain(subquery)
+      if steps is not None:
+        Query._check_type(obj_src, obj_model, steps[0]['model'])
+        attrs = [model_registry.get_manager(s['model']).getattr(s['method']) for s in steps]
+        filters = [s['filters'] for s in steps]
+        nodes = join.unique([obj for obj, src in obj_src])
+        pks = filter_by_chain(nodes, obj_model, attrs, filters, having == '+')
+        return join.semi_join(obj_src, pks), [], None
+
     objects = [obj for obj, src in obj_src]
-    subquery_res, last_model = Query._query(objects, subquery)
+    if prefix is None:
+      subquery_res, last_model = Query._query(objects, obj_model, subquery)
+    else:
+      subquery_res, last_model = Query._shared_subquery(objects, obj_model, subquery, prefix,
+                                                        shared)
     #print 'res %s' % (subquery_res,)
 
     # take only the last result from subquery; grammar should enforce this.
@@ -246,70 +642,111 @@ class Query(object):
       assert(len(subquery_res) == 1)
       subquery_res = subquery_res[-1][0]
 
-    subq_res_map = {}
-    for sub_obj, sub_src in subquery_res:
-      if sub_src not in subq_res_map:
-        subq_res_map[sub_src] = []
-      subq_res_map[sub_src].append(sub_obj)
+    with_results = set([sub_src for sub_obj, sub_src in subquery_res])
+    key = Query._key(obj_model)
 
-    keep = []
-    for obj, src in obj_src:
-      result_from_subq = []
-      if obj.pk in subq_res_map:
-        result_from_subq = subq_res_map[obj.pk]
+    if having is None or having == '+':
+      # should have subquery results
+      keep = join.semi_join(obj_src, with_results, key)
+    elif having == '-':
+      # should not have subquery results
+      keep = join.anti_join(obj_src, with_results, key)
+    else:
+      # don't care, but add empty subquery results for objects without any
+      keep = join.unique(obj_src)
+      pk = node_pk(obj_model)
+      without_results = join.anti_join(obj_src, with_results, key)
+      missing = join.unique([(None, pk(obj)) for obj, src in without_results])
+      subquery_res = columns.to_list(subquery_res)+missing
 
-      if len(result_from_subq) > 0: # subquery has result
-        # if no modifier to subquery, or said should have subquery results ('+' or '?')
-        if having is None or having in ('+', '?'):
-          keep.append((obj, src))
+    return keep, subquery_res, last_model
 
-      if len(result_from_subq) == 0: # no subquery result
-        # if said should not have subquery results ('-') or don't care ('?')
-        if having in ('-', '?'):
-          keep.append((obj, src))
-          if having == '?':
-            subquery_res.append((None, obj.pk))
+  @staticmethod
+  def _or_branch(objects, obj_model, branch):
+    """
+    Runs one branch of an OR query, or several branches that are chains of
+    plain Django relationships to the same model, as one UNION query. Returns
+    output, input tuples, and the model of the outputs.
+    """
 
-    return keep, subquery_res
+    if 'union' in branch:
+      chains = [([model_registry.get_manager(s['model']).getattr(s['method']) for s in steps],
+                 [s['filters'] for s in steps]) for steps in branch['union']]
+      return traverse_union(objects, chains)
+
+    res, m = Query._query(objects, obj_model, branch['query'])
+    return (res[0][0] if len(res) > 0 else []), m
 
 
   @staticmethod
-  def _or(obj_src, step):
+  def _or(obj_src, obj_model, step):
     """
     Or results of multiple queries
     """
 
     or_queries = step['orquery']
-    or_results = []
+    objects = [obj for obj, src in obj_src]
 
+    branches = []
+    unions = {}
     for query in or_queries:
-      objects = [obj for obj, src in obj_src]
-      res, m = Query._query(objects, query)
-      if len(res) > 0 and len(res[0][0]):
-        or_results.append((res, m))
+      steps = Query._as_chain(query)
+      if steps is None:
+        branches.append(dict(query=query))
+        continue
+      Query._check_type(obj_src, obj_model, steps[0]['model'])
+      model = Query._chain_link(steps[-1])
+      if model not in unions:
+        unions[model] = dict(union=[])
+        branches.append(unions[model])
+      unions[model]['union'].append(steps)
+
+    def run_branch(branch):
+      return Query._or_branch(objects, obj_model, branch)
+
+    or_results = []
+    for pairs, m in run_branches(run_branch, branches):
+      if len(pairs):
+        or_results.append((pairs, m))
 
     models = list(set([r[1] for r in or_results]))
     if len(models) > 1:
       raise Exception("Different object types at end of OR query: %s" % (', '.join([str(x) for x in models]),))
 
     next_obj_src = []
-    for res, m in or_results:
-      next_obj_src.extend(res[0][0])
+    for pairs, m in or_results:
+      next_obj_src.extend(pairs)
 
-    return Query._extend_result(obj_src, next_obj_src)
+    next_model = models[0] if len(models) else None
+    return Query._extend_result(obj_src, obj_model, next_obj_src), next_model
 
 
   @staticmethod
-  def _query(objects, query, demux_first=True):
+  def _query(objects, model, query, demux_first=True):
     """
     Executes a query. A query consists of one or more subqueries. Each subquery
     is an array of model relationships. In most cases the outputs of a subquery
-    becomes the inputs to the next query. 
-    
-    Input objects should be an array of model instances. Returns an array of
+    becomes the inputs to the next query.
+
+    Input objects should be an array of nodes of model. Returns an array of
     subquery results. Each subquery result is an array of tuples. First member
-    of tuple is output object from query. Second member of tuple is the pk of
-    the input object that produced the output.
+    of tuple is output node from query. Second member of tuple is the pk of
+    the input object that produced the output. Also returns the model of the
+    last result.
+    """
+
+    pk = node_pk(model)
+    if demux_first is True:
+      obj_src = [(obj, pk(obj)) for obj in objects]
+    else:
+      obj_src = [(obj, None) for obj in objects]
+    return Query._run(obj_src, model, query)
+
+  @staticmethod
+  def _run(obj_src, model, query):
+    """
+    Executes a query on output, input tuples, e.g. results of earlier steps.
+    Returns results like _query.
     """
 
     res = []
@@ -317,58 +754,102 @@ class Query(object):
     last_non_sub_index = -1
     last_tree = None
 
-    if demux_first is True:
-      obj_src = [(obj, obj.pk) for obj in objects]
-    else:
-      obj_src = [(obj, None) for obj in objects]
+    planned = Query._plan(query)
+    prefixes = Query._subquery_prefixes(planned)
+    shared = []
 
-    for step in query:
+    for i, step in enumerate(planned):
 
       if ('join' in step and step['join'] is True) or\
          ('subquery' in step and (step['having'] is None or step['having'] == '?')):
         if more_results:
-          res.append((obj_src, last_non_sub_index, last_tree))
+          res.append((obj_src, last_non_sub_index, last_tree, model))
           last_non_sub_index = len(res)-1
           more_results = False
-          obj_src = list(set([(obj, obj.pk) for obj, src in obj_src]))
+          pk = node_pk(model)
+          obj_src = join.unique([(obj, pk(obj)) for obj, src in obj_src])
 
       if 'orquery' in step:
         #print 'orquery %s' % step
-        obj_src = Query._or(obj_src, step)
+        obj_src, model = Query._or(obj_src, model, step)
         #print 'completed orquery'
         more_results = True
 
+      elif 'chain' in step:
+        obj_src, model = Query._chain_step(obj_src, model, step)
+        last_tree = None
+        more_results = True
+
       elif 'subquery' in step:
         #print 'subquery %s' % step
-        obj_src, subquery_res = Query._filter_by_subquery(obj_src, step)
+        obj_src, subquery_res, subquery_model = Query._filter_by_subquery(obj_src, model, step,
+                                                                          prefixes.get(i), shared)
         #print 'completed subquery'
 
-        if step['having'] is None or step['having'] == '?': 
+        if step['having'] is None or step['having'] == '?':
           # add subquery result to results, even if there are no results from subquery
-          res.append((subquery_res, last_non_sub_index, last_tree))
+          res.append((subquery_res, last_non_sub_index, last_tree, subquery_model))
           # don't increase last_non_sub_index, so caller knows next query
           # should still join with the last non sub query results.
           more_results = False
 
       else:
         #print 'query: %s' % step
-        obj_src, last_tree = Query._rel_step(obj_src, step)
+        obj_src, model, last_tree = Query._rel_step(obj_src, model, step)
         #print 'completed query'
         more_results = True
 
     if more_results:
-      res.append((obj_src, last_non_sub_index, last_tree))
+      res.append((obj_src, last_non_sub_index, last_tree, model))
 
-    # last model, can be None if left join and got no data
-    t = None
+    # models of results, and the last model, can be None if left join and got
+    # no data
+    res = [(r[0], r[1], r[2], Query._result_model(r[0], r[3])) for r in res]
+    return res, Query._result_model(obj_src, model)
+
+  @staticmethod
+  def _result_model(obj_src, model):
+    if isinstance(obj_src, columns.Pairs):
+      return model if len(obj_src) else None
     for obj, src in obj_src:
       if obj is not None:
-        t = obj.__class__
-        if hasattr(t, '_deferred') and t._deferred:
-          t = t.__base__
-        break
+        return model
+    return None
+
+  def __execute(self):
+    """
+    Executes the current query, with a new memo of edges, and returns results
+    of _query. Number of rows the memo saved fetching is kept in rows_saved.
+    """
+
+    with memo.execution() as edges:
+      objects, model = self.__get_objects()
+      res, last_model = Query._query(objects, model, self.__steps, demux_first=False)
+    self.rows_saved = edges.rows_saved
+    if settings.DEBUG:
+      print '%s: %d rows from memo' % (self.__query, self.rows_saved)
+    return res, last_model
 
-    return res, t
+  def pks(self):
+    """
+    Executes the current query, without instantiating model objects. Returns
+    array of (pk_src, join_index, tree, model) tuples, one per result; first
+    member of pk_src tuples is the pk of output object from query, second
+    member is the pk of the object from the first step of the query that
+    produced the output object, and model is the model of the output objects.
+    Large results may be columns.Pairs instead of lists. Also returns current
+    model at end of query.
+    """
+
+    res, last_model = self.__execute()
+
+    results = []
+    for obj_src, join_index, tree, model in res:
+      if not isinstance(obj_src, columns.Pairs):
+        pk = node_pk(model)
+        obj_src = [(pk(obj), src) for obj, src in obj_src]
+      results.append((obj_src, join_index, tree, model))
+    return results, last_model
 
 
   def __call__(self):
@@ -380,5 +861,10 @@ class Query(object):
     last result if last result is a filter query.
     """
 
-    objects = list(self.__get_objects())
-    return Query._query(objects, self.__steps, demux_first=False)
+    res, last_model = self.__execute()
+
+    results = []
+    for obj_src, join_index, tree, model in res:
+      objs = to_instances(model, [obj for obj, src in obj_src])
+      results.append((zip(objs, [src for obj, src in obj_src]), join_index, tree))
+    return results, last_model
@@ -0,0 +1,390 @@
+"""
+Hand-written tokenizer and recursive-descent parser for the query language.
+Accepts exactly the same queries as the PEG in grammar.py and produces the
+same object query and steps as ASTBuilder, but without allocating a parse tree
+node per character class match, which makes it a lot faster on long generated
+queries with large array literals.
+"""
+
+import re
+from time import mktime
+from datetime import datetime
+import parsedatetime
+
+
+# Token kinds. WORD is a maximal run of word characters; it is interpreted as
+# an identifier, id, int, bool or None depending on where it shows up. This is
+# equivalent to the PEG's regex terminals because the grammar never allows a
+# word character right after one of those terminals.
+SPACE = 'space'
+NL = 'nl'
+WORD = 'word'
+FLOAT = 'float'
+NEG_INT = 'neg_int'
+STRING = 'string'
+PUNCT = 'punct'
+
+TOKEN_RE = re.compile(r"""
+  (?P<space>[ \t]+)
+| (?P<nl>\n)
+| (?P<string>[tr]?(?:"[^"]*"|'[^']*'))
+| (?P<float>-?[0-9]\.[0-9]+)
+| (?P<neg_int>-[0-9]+)
+| (?P<word>[A-Za-z0-9_]+)
+| (?P<punct>\*\*|[().,=|\[\]+\-?*$])
+""", re.VERBOSE)
+
+IDENTIFIER_RE = re.compile(r'[_A-Za-z][A-Za-z0-9_]*$')
+INT_RE = re.compile(r'[0-9]+$')
+
+RECURSION = {
+  '$': 'terminal',
+  '?': 'search',
+  '*': 'until',
+  '**': 'all',
+}
+
+
+def tokenize(code):
+  """
+  Splits code into (kind, text, position) tuples.
+  """
+
+  tokens = []
+  pos = 0
+  end = len(code)
+  match = TOKEN_RE.match
+  while pos < end:
+    m = match(code, pos)
+    if m is None:
+      raise Exception('Cannot parse query: unexpected "%s" at position %d' % (code[pos], pos))
+    tokens.append((m.lastgroup, m.group(), pos))
+    pos = m.end()
+  return tokens
+
+
+class _NoMatch(Exception):
+  pass
+
+
+class RDParser(object):
+  """
+  Recursive-descent parser over tokens from tokenize(). Each parse_* method
+  mirrors the grammar rule of the same name; ordered choices are implemented
+  by backtracking to the saved token position.
+  """
+
+  def __init__(self, code):
+    self.code = code
+    self.cacheable = True
+    self.__tokens = tokenize(code)
+    self.__pos = 0
+
+  def parse(self):
+    try:
+      query = self.parse_query()
+    except _NoMatch:
+      query = None
+    if query is None or self.__pos != len(self.__tokens):
+      pos = self.__tokens[self.__pos][2] if self.__pos < len(self.__tokens) else len(self.code)
+      raise Exception('Cannot parse query "%s" at position %d' % (self.code, pos))
+    return query
+
+  # token helpers
+
+  def _peek(self):
+    if self.__pos < len(self.__tokens):
+      return self.__tokens[self.__pos]
+    return None
+
+  def _punct(self, *texts):
+    token = self._peek()
+    if token is None or token[0] != PUNCT or token[1] not in texts:
+      raise _NoMatch()
+    self.__pos += 1
+    return token[1]
+
+  def _kind(self, kind):
+    token = self._peek()
+    if token is None or token[0] != kind:
+      raise _NoMatch()
+    self.__pos += 1
+    return token[1]
+
+  def _spaces(self):
+    token = self._peek()
+    if token is not None and token[0] == SPACE:
+      self.__pos += 1
+
+  def _identifier(self):
+    token = self._peek()
+    if token is None or token[0] != WORD or not IDENTIFIER_RE.match(token[1]):
+      raise _NoMatch()
+    self.__pos += 1
+    return token[1]
+
+  def _attempt(self, f):
+    """
+    Calls f, restoring token position if f does not match. Returns a
+    (matched, result) tuple.
+    """
+
+    saved = self.__pos
+    try:
+      return True, f()
+    except _NoMatch:
+      self.__pos = saved
+      return False, None
+
+  # grammar rules
+
+  def parse_query(self):
+    obj_query = self.parse_object_query()
+    self._spaces()
+    query = [obj_query]
+    matched, steps = self._attempt(self.parse_steps)
+    if matched:
+      query.extend(steps)
+    token = self._peek()
+    if token is not None and token[0] == NL:
+      self.__pos += 1
+    return query
+
+  def parse_object_query(self):
+    model = self._identifier()
+    matched, filters = self._attempt(self.parse_id_arg)
+    if not matched:
+      filters = self.parse_filters()
+    return dict(model=model, method=None, filters=filters)
+
+  def parse_id_arg(self):
+    self._punct('(')
+    self._spaces()
+    id = self._kind(WORD)
+    self._spaces()
+    self._punct(')')
+    return [dict(method='filter', kwargs=dict(id=id))]
+
+  def parse_steps(self):
+    steps = [self.parse_step()]
+    while True:
+      matched, step = self._attempt(self._parse_another_step)
+      if not matched:
+        break
+      steps.append(step)
+    return steps
+
+  def _parse_another_step(self):
+    self._spaces()
+    return self.parse_step()
+
+  def parse_step(self):
+    matched, step = self._attempt(self.parse_join_query)
+    if matched:
+      return step
+    return self.parse_sub_query()
+
+  def parse_join_query(self):
+    matched, _ = self._attempt(lambda: self._punct(','))
+    self._spaces()
+    nj_query = self.parse_nj_query()
+    if matched:
+      nj_query['join'] = True
+    return nj_query
+
+  def parse_nj_query(self):
+    matched, q = self._attempt(self.parse_one_query)
+    if matched:
+      return q
+    return self.parse_or_query()
+
+  def parse_nj_steps(self):
+    steps = [self.parse_nj_query()]
+    while True:
+      matched, step = self._attempt(self._parse_another_nj)
+      if not matched:
+        break
+      steps.append(step)
+    return steps
+
+  def _parse_another_nj(self):
+    self._spaces()
+    return self.parse_nj_query()
+
+  def parse_sub_query(self):
+    matched, having = self._attempt(lambda: self._punct('+', '-', '?'))
+    self._punct('(')
+    q = self.parse_nj_steps()
+    self._punct(')')
+    return dict(subquery=q, having=having if matched else None, join=False)
+
+  def parse_one_query(self):
+    one_rel = self.parse_one_rel()
+    matched, recursion = self._attempt(lambda: self._punct('**', '*', '$', '?'))
+    if matched:
+      one_rel['recursive'] = True
+      one_rel['collect'] = RECURSION[recursion]
+    return one_rel
+
+  def parse_or_query(self):
+    orquery = [self._parse_parenthesized_nj_steps()]
+    self._spaces()
+    self._punct('|')
+    self._spaces()
+    orquery.append(self._parse_parenthesized_nj_steps())
+    while True:
+      matched, steps = self._attempt(self._parse_another_or)
+      if not matched:
+        break
+      orquery.append(steps)
+    return dict(orquery=orquery, join=False)
+
+  def _parse_parenthesized_nj_steps(self):
+    self._punct('(')
+    steps = self.parse_nj_steps()
+    self._punct(')')
+    return steps
+
+  def _parse_another_or(self):
+    self._spaces()
+    self._punct('|')
+    self._spaces()
+    return self._parse_parenthesized_nj_steps()
+
+  def parse_one_rel(self):
+    model = self._identifier()
+    self._punct('.')
+    method = self._identifier()
+    filters = self.parse_filters()
+    return dict(model=model, method=method, filters=filters)
+
+  def parse_filters(self):
+    filters = []
+    matched, f = self._attempt(self.parse_filter_group)
+    if matched:
+      f['method'] = 'filter'
+      filters.append(f)
+    while True:
+      matched, f = self._attempt(self.parse_name_filter)
+      if not matched:
+        break
+      filters.append(f)
+    return filters
+
+  def parse_name_filter(self):
+    self._punct('.')
+    method = self._identifier()
+    f = self.parse_filter_group()
+    f['method'] = method
+    return f
+
+  def parse_filter_group(self):
+    self._punct('(')
+    args = self.parse_filter_args()
+    self._punct(')')
+    return args
+
+  def parse_filter_args(self):
+    matched, kwargs = self._attempt(self.parse_filter_kvs)
+    if matched:
+      return {'kwargs': kwargs}
+    token = self._peek()
+    if token is not None and token[0] == WORD:
+      if IDENTIFIER_RE.match(token[1]):
+        self.__pos += 1
+        return {'field': token[1]}
+      if INT_RE.match(token[1]):
+        self.__pos += 1
+        return {'field': int(token[1])}
+    if token is not None and token[0] == NEG_INT:
+      self.__pos += 1
+      return {'field': int(token[1])}
+    raise _NoMatch()
+
+  def parse_filter_kvs(self):
+    self._spaces()
+    d = self.parse_arg()
+    while True:
+      matched, arg = self._attempt(self._parse_another_arg)
+      if not matched:
+        break
+      d.update(arg)
+    self._spaces()
+    return d
+
+  def _parse_another_arg(self):
+    self._spaces()
+    self._punct(',')
+    self._spaces()
+    return self.parse_arg()
+
+  def parse_arg(self):
+    name = self._identifier()
+    self._spaces()
+    self._punct('=')
+    self._spaces()
+    matched, value = self._attempt(self.parse_array_value)
+    if not matched:
+      value = self.parse_value()
+    return {name: value}
+
+  def parse_array_value(self):
+    self._punct('[', '(')
+    self._spaces()
+    values = []
+    matched, value = self._attempt(self.parse_value)
+    if matched:
+      values.append(value)
+      while True:
+        matched, value = self._attempt(self._parse_another_val)
+        if not matched:
+          break
+        values.append(value)
+    self._spaces()
+    self._punct(']', ')')
+    return values
+
+  def _parse_another_val(self):
+    self._spaces()
+    self._punct(',')
+    self._spaces()
+    return self.parse_value()
+
+  def parse_value(self):
+    token = self._peek()
+    if token is None:
+      raise _NoMatch()
+    kind, text = token[0], token[1]
+    if kind == WORD:
+      if text == 'True':
+        value = True
+      elif text == 'False':
+        value = False
+      elif text == 'None':
+        value = None
+      elif INT_RE.match(text):
+        value = int(text)
+      else:
+        raise _NoMatch()
+    elif kind == NEG_INT:
+      value = int(text)
+    elif kind == FLOAT:
+      value = float(text)
+    elif kind == STRING:
+      value = self._string(text)
+    else:
+      raise _NoMatch()
+    self.__pos += 1
+    return value
+
+  def _string(self, text):
+    if text[0] in ('t', 'r'):
+      prefix, s = text[0], text[2:-1]
+    else:
+      prefix, s = None, text[1:-1]
+    if prefix == 't':
+      self.cacheable = False
+      c = parsedatetime.Calendar()
+      t = c.parse(s)
+      return datetime.fromtimestamp(mktime(t[0]))
+    return s
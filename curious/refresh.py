@@ -0,0 +1,63 @@
+"""
+Background refresh of cached results. Results past their soft expiry are
+still served from the cache, while one worker thread recomputes them, so
+users do not wait for expensive queries to run again. A lock in the cache
+makes sure each result is refreshed once at a time, across processes.
+"""
+
+import Queue
+import threading
+import traceback
+from django.db import connections
+from . import settings
+from .cache import cache
+
+
+_queue = Queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _work():
+  while True:
+    f = _queue.get()
+    try:
+      f()
+    except Exception:
+      traceback.print_exc()
+    finally:
+      connections.close_all()
+
+
+def _start(f):
+  global _worker
+  with _worker_lock:
+    if _worker is None:
+      _worker = threading.Thread(target=_work, name='curious-refresh')
+      _worker.daemon = True
+      _worker.start()
+  _queue.put(f)
+
+
+def _lock_key(key):
+  return '%s_refresh' % key
+
+
+def submit(key, f):
+  """
+  Calls f on the worker thread to refresh the result cached under key, unless
+  a refresh of key is already pending. Returns True if f was submitted.
+  """
+
+  lock_key = _lock_key(key)
+  if not cache.add(lock_key, True, settings.REFRESH_LOCK_TIMEOUT):
+    return False
+
+  def refresh():
+    try:
+      f()
+    finally:
+      cache.delete(lock_key)
+
+  _start(refresh)
+  return True
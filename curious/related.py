@@ -1,4 +1,5 @@
 from curious import deferred_to_real
+from curious import frontier
 
 def remote_fk(from_model_fk_field, to_model, to_model_field=None):
   to_model_field = 'pk' if to_model_field is None else to_model_field
@@ -7,14 +8,18 @@ def remote_fk(from_model_fk_field, to_model, to_model_field=None):
   def rel_f(instances, filter_f):
     instances = deferred_to_real(instances)
 
-    c = {}
-    c['%s__in' % to_model_field] = [getattr(instance, from_model_fk_field) for instance in instances]
-    q = to_model.objects.filter(**c)
-    if to_model_field not in ['pk', 'id']:
-      f = {}
-      f[to_model_field] = to_model_field
-      q = q.extra(select=f)
-    q = filter_f(q)
+    def get_objects(rhs):
+      c = {}
+      c['%s__in' % to_model_field] = rhs
+      q = to_model.objects.filter(**c)
+      if to_model_field not in ['pk', 'id']:
+        f = {}
+        f[to_model_field] = to_model_field
+        q = q.extra(select=f)
+      return filter_f(q)
+
+    q = frontier.fetch(to_model, [getattr(instance, from_model_fk_field) for instance in instances],
+                       get_objects, chunk=False)
 
     to_from = {}
 
@@ -38,14 +43,18 @@ def remote_reverse_fk(to_model_fk_field, to_model, from_model_field=None):
 
   @staticmethod
   def rel_f(instances, filter_f):
-    arg = {}
-    arg['%s__in' % to_model_fk_field] = [getattr(instance, from_model_field) for instance in instances]
-    q = to_model.objects.filter(**arg)
-    if to_model_fk_field not in ['pk', 'id']:
-      f = {}
-      f[to_model_fk_field] = to_model_fk_field
-      q = q.extra(select=f)
-    q = filter_f(q)
+    def get_objects(rhs):
+      arg = {}
+      arg['%s__in' % to_model_fk_field] = rhs
+      q = to_model.objects.filter(**arg)
+      if to_model_fk_field not in ['pk', 'id']:
+        f = {}
+        f[to_model_fk_field] = to_model_fk_field
+        q = q.extra(select=f)
+      return filter_f(q)
+
+    q = frontier.fetch(to_model, [getattr(instance, from_model_field) for instance in instances],
+                       get_objects, chunk=False)
 
     to_from = {}
 
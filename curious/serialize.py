@@ -0,0 +1,307 @@
+"""
+Serializers turning objects into rows of JSON friendly values. Serializers of
+Django models are compiled once per model, ignore_excludes, follow_fk and
+subset of fields, into a tuple of functions, one per column, so serializing an
+object does not look up fields, their types, or the names and managers of
+related models again. Compiled serializers are dropped when models are
+registered or unregistered, or with invalidate, and recompiled when managers
+of the model or of its related models are configured differently.
+
+Values serializers load rows with values_list instead of model instances,
+with labels of related objects looked up through label_field of their
+managers. They can be used when no value needs an instance: the model has no
+property fields or URLs, and related objects followed have a label_field and
+no URLs.
+"""
+
+import types
+from decimal import Decimal
+from operator import attrgetter, itemgetter
+from django.db.models.fields.related import ForeignKey
+
+
+_PLAIN_TYPES = (long, int, float, bool, types.NoneType)
+
+# Django fields whose values from the database are already of _PLAIN_TYPES
+_PLAIN_FIELDS = ('AutoField', 'BigAutoField', 'BigIntegerField', 'BooleanField', 'FloatField',
+                 'IntegerField', 'NullBooleanField', 'PositiveIntegerField',
+                 'PositiveSmallIntegerField', 'SmallIntegerField')
+
+_compiled = {}
+
+
+def coerce(value):
+  if type(value) is Decimal:
+    return float(value)
+  if type(value) in _PLAIN_TYPES:
+    return value
+  return unicode(value)
+
+
+def invalidate():
+  """
+  Drops compiled serializers.
+  """
+
+  _compiled.clear()
+
+
+def _is_plain(f):
+  return f.get_internal_type() in _PLAIN_FIELDS and not hasattr(f, 'from_db_value')
+
+
+def _manager_of(cls):
+  from curious import model_registry
+
+  name = model_registry.get_name(cls)
+  try:
+    return name, model_registry.get_manager(name)
+  except:
+    return name, None
+
+
+def _label(manager, obj):
+  if manager is not None and manager.label_field is not None:
+    return coerce(getattr(obj, manager.label_field))
+  return str(obj)
+
+
+class Serializer(object):
+  """
+  Fields of objects of a model, and functions returning values of the fields
+  of an object, in order of fields.
+  """
+
+  def __init__(self, fields, columns, manager):
+    self.fields = fields
+    self.columns = tuple(columns)
+    self.manager = manager
+
+  def __call__(self, objects):
+    """
+    Returns values of objects, and their URLs.
+    """
+
+    columns = self.columns
+    packed = [[f(obj) for f in columns] for obj in objects]
+    if self.manager.url_function is None:
+      urls = [None]*len(objects)
+    else:
+      urls = [self.manager.url_function(obj) for obj in objects]
+    return packed, urls
+
+
+class ValuesSerializer(object):
+  """
+  Fields of objects of a model, lookups loading them with values_list, and
+  functions returning values of the fields from a row of values_list, in order
+  of fields. The first lookup is the pk.
+  """
+
+  def __init__(self, fields, lookups, columns):
+    self.fields = fields
+    self.lookups = tuple(lookups)
+    self.columns = tuple(columns)
+
+  def __call__(self, queryset):
+    """
+    Returns pks of objects of queryset, their values, and their URLs.
+    """
+
+    columns = self.columns
+    rows = list(queryset.values_list(*self.lookups))
+    packed = [[f(row) for f in columns] for row in rows]
+    return [row[0] for row in rows], packed, [None]*len(rows)
+
+
+def _converted(get, convert):
+  return lambda obj: convert(get(obj))
+
+
+def _related(get_column, get_related):
+  # name and manager of each class of related objects
+  related_classes = {}
+
+  def value(obj):
+    v = get_related(obj)
+    if v is None:
+      return coerce(get_column(obj))
+    cls = v.__class__
+    if cls not in related_classes:
+      related_classes[cls] = _manager_of(cls)
+    name, manager = related_classes[cls]
+    url = None
+    if manager is not None:
+      try:
+        url = manager.url_of(v)
+      except:
+        url = None
+    return (name, v.pk, _label(manager, v), url)
+
+  return value
+
+
+def _related_values(name, get_pk, get_label):
+  def value(row):
+    pk = get_pk(row)
+    if pk is None:
+      return None
+    return (name, pk, coerce(get_label(row)), None)
+  return value
+
+
+def _selected(model_class, manager, ignore_excludes, only):
+  """
+  Returns Django fields of model_class serialized, whether the pk is added as
+  id, and property fields serialized.
+  """
+
+  excludes = [] if ignore_excludes is True else manager.field_excludes
+  fields = [f for f in model_class._meta.fields
+            if f.column not in excludes and (only is None or f.column in only or f.column == 'id')]
+  add_pk = 'id' not in [f.column for f in fields]
+  properties = [f for f in manager.property_fields if only is None or f in only]
+  return fields, add_pk, properties
+
+
+def _compile_model(model_class, manager, ignore_excludes, follow_fk, only):
+  selected, add_pk, properties = _selected(model_class, manager, ignore_excludes, only)
+
+  fields = []
+  columns = []
+  for f in selected:
+    fields.append(f.column)
+    get = attrgetter(f.column)
+    if type(f) == ForeignKey and follow_fk is True:
+      columns.append(_related(get, attrgetter(f.name)))
+    elif _is_plain(f):
+      columns.append(get)
+    else:
+      columns.append(_converted(get, coerce))
+
+  if add_pk:
+    fields.append('id')
+    columns.append(_converted(attrgetter('pk'), coerce))
+
+  for f in properties:
+    fields.append(f)
+    columns.append(_converted(attrgetter(f), coerce))
+
+  return Serializer(fields, columns, manager)
+
+
+def _compile_values(model_class, manager, ignore_excludes, follow_fk, only):
+  selected, add_pk, properties = _selected(model_class, manager, ignore_excludes, only)
+  if manager.url_function is not None or len(properties) > 0:
+    return None
+
+  fields = []
+  lookups = ['pk']
+  columns = []
+
+  def lookup(name):
+    lookups.append(name)
+    return itemgetter(len(lookups)-1)
+
+  for f in selected:
+    fields.append(f.column)
+    if type(f) == ForeignKey and follow_fk is True:
+      name, related = _manager_of(f.related_model)
+      if related is None or related.label_field is None or related.url_function is not None:
+        return None
+      get_pk = lookup(f.attname)
+      get_label = lookup('%s__%s' % (f.name, related.label_field))
+      columns.append(_related_values(name, get_pk, get_label))
+    elif _is_plain(f):
+      columns.append(lookup(f.attname))
+    else:
+      columns.append(_converted(lookup(f.attname), coerce))
+
+  if add_pk:
+    fields.append('id')
+    columns.append(_converted(itemgetter(0), coerce))
+
+  return ValuesSerializer(fields, lookups, columns)
+
+
+def _config(model_class, manager, follow_fk):
+  """
+  Configuration of managers that serializers of model_class depend on.
+  """
+
+  def of(manager):
+    if manager is None:
+      return None
+    return (manager, tuple(manager.field_excludes), tuple(manager.property_fields),
+            manager.label_field, manager.url_function)
+
+  config = [of(manager)]
+  if follow_fk is True:
+    for f in model_class._meta.fields:
+      if type(f) == ForeignKey:
+        config.append(of(_manager_of(f.related_model)[1]))
+  return tuple(config)
+
+
+def _registered_manager(cls):
+  name, manager = _manager_of(cls)
+  if manager is None:
+    raise Exception("Unknown model '%s'" % name)
+  return manager
+
+
+def _compiled_for(kind, model_class, ignore_excludes, follow_fk, only, compile):
+  manager = _registered_manager(model_class)
+  key = (kind, model_class, ignore_excludes, follow_fk, only)
+  config = _config(model_class, manager, follow_fk)
+  if key in _compiled and _compiled[key][0] == config:
+    return _compiled[key][1]
+  serializer = compile(model_class, manager, ignore_excludes, follow_fk, only)
+  _compiled[key] = (config, serializer)
+  return serializer
+
+
+def _only(fields):
+  return None if fields is None else tuple(sorted(set(fields)))
+
+
+def serializer_of(obj, ignore_excludes=False, follow_fk=True, fields=None):
+  """
+  Returns serializer of objects of the class of obj, of fields if not None,
+  and id. Fields of objects of custom models, models with no _meta, are those
+  returned by fields() of obj.
+  """
+
+  only = _only(fields)
+  if not hasattr(obj, '_meta'):
+    obj_fields = [f for f in obj.fields() if only is None or f in only or f == 'id']
+    columns = [_converted(lambda obj, f=f: obj.get(f), coerce) for f in obj_fields]
+    return Serializer(obj_fields, columns, _registered_manager(obj.__class__))
+  return _compiled_for('objects', obj.__class__, ignore_excludes, follow_fk, only, _compile_model)
+
+
+def values_serializer_of(model_class, ignore_excludes=False, follow_fk=True, fields=None):
+  """
+  Returns values serializer of objects of model_class, of fields if not None,
+  and id, or None if objects of model_class need to be loaded as instances.
+  """
+
+  return _compiled_for('values', model_class, ignore_excludes, follow_fk, _only(fields),
+                       _compile_values)
+
+
+def projection(model_class, ignore_excludes=False, follow_fk=True, fields=None):
+  """
+  Returns names of fields of model_class to load with only(), and related
+  objects to load with select_related(), to serialize fields of objects of
+  model_class. Returns None instead of fields to load all fields.
+  """
+
+  only = _only(fields)
+  manager = _registered_manager(model_class)
+  selected, add_pk, properties = _selected(model_class, manager, ignore_excludes, only)
+  related = [f.name for f in selected if type(f) == ForeignKey] if follow_fk is True else []
+  if only is None or len(properties) > 0:
+    # properties may read any field
+    return None, related
+  return [f.attname for f in selected], related
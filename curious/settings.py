@@ -1,3 +1,72 @@
 from django.conf import settings
 
 DEBUG = getattr(settings, 'CURIOUS_DEBUG', False)
+
+# number of parsed queries to keep in memory; 0 disables caching
+PARSER_CACHE_SIZE = getattr(settings, 'CURIOUS_PARSER_CACHE_SIZE', 1000)
+
+# query parser: 'peg' uses the parsimonious grammar in grammar.py, 'rd' uses the
+# hand-written recursive-descent parser in rdparser.py
+PARSER_BACKEND = getattr(settings, 'CURIOUS_PARSER_BACKEND', 'peg')
+
+# run recursive relationships from a model to itself, e.g. Entry.responses*, as
+# one WITH RECURSIVE query where the database supports it
+RECURSIVE_QUERIES = getattr(settings, 'CURIOUS_RECURSIVE_QUERIES', True)
+
+# frontiers, the lists of pks traversal steps look up with __in, are split into
+# chunks of FRONTIER_CHUNK_SIZE; past FRONTIER_TABLE_SIZE they are passed as an
+# array on PostgreSQL, or loaded into a temporary table on SQLite
+FRONTIER_CHUNK_SIZE = getattr(settings, 'CURIOUS_FRONTIER_CHUNK_SIZE', 500)
+FRONTIER_TABLE_SIZE = getattr(settings, 'CURIOUS_FRONTIER_TABLE_SIZE', 1000)
+
+# results of at least COLUMNAR_SIZE pairs are joined and kept as NumPy arrays,
+# if NumPy is installed; None disables this
+COLUMNAR_SIZE = getattr(settings, 'CURIOUS_COLUMNAR_SIZE', 10000)
+
+# maximum number of threads running branches of an OR query concurrently,
+# each with its own database connection; 1 runs branches one after another
+BRANCH_THREADS = getattr(settings, 'CURIOUS_BRANCH_THREADS', 4)
+
+# while executing a query, remember edges fetched, and fetch each edge once
+EDGE_MEMO = getattr(settings, 'CURIOUS_EDGE_MEMO', True)
+
+# seconds to cache neighbors of relationships listed in cached_relationships of
+# their model's manager
+ADJACENCY_CACHE_TIMEOUT = getattr(settings, 'CURIOUS_ADJACENCY_CACHE_TIMEOUT', 60*60*24)
+
+# admission of query results into the cache, see CachePolicy in admission.py:
+# results are cached if seconds they took, times requests in the last window
+# seconds, are at least min_saved seconds plus price_per_row for each row;
+# QUERY_CACHE_POLICIES overrides these by app
+QUERY_CACHE_POLICY = getattr(settings, 'CURIOUS_QUERY_CACHE_POLICY', {})
+QUERY_CACHE_POLICIES = getattr(settings, 'CURIOUS_QUERY_CACHE_POLICIES', {})
+
+# cached query results past CACHE_TIMEOUT in api.py are served while a worker
+# thread recomputes them, until QUERY_CACHE_HARD_TIMEOUT seconds after they
+# were cached; a refresh not done in REFRESH_LOCK_TIMEOUT seconds may be
+# started again
+QUERY_CACHE_HARD_TIMEOUT = getattr(settings, 'CURIOUS_QUERY_CACHE_HARD_TIMEOUT', 60*60*24)
+REFRESH_LOCK_TIMEOUT = getattr(settings, 'CURIOUS_REFRESH_LOCK_TIMEOUT', 60*10)
+
+# requests for an uncached query result already being computed wait up to
+# SINGLE_FLIGHT_TIMEOUT seconds for it; a process computing a result holds a
+# lock in the cache for at most SINGLE_FLIGHT_LOCK_TIMEOUT seconds
+SINGLE_FLIGHT_TIMEOUT = getattr(settings, 'CURIOUS_SINGLE_FLIGHT_TIMEOUT', 60)
+SINGLE_FLIGHT_LOCK_TIMEOUT = getattr(settings, 'CURIOUS_SINGLE_FLIGHT_LOCK_TIMEOUT', 60*10)
+
+# module encoding JSON responses, with a dumps like json.dumps; None uses
+# simplejson if it is installed, or else json
+JSON_ENCODER = getattr(settings, 'CURIOUS_JSON_ENCODER', None)
+
+# stream responses of queries and batches of objects, unless requests say
+# otherwise with s; object data of streamed responses is loaded and encoded
+# STREAM_BATCH_SIZE objects at a time
+STREAM_RESPONSES = getattr(settings, 'CURIOUS_STREAM_RESPONSES', False)
+STREAM_BATCH_SIZE = getattr(settings, 'CURIOUS_STREAM_BATCH_SIZE', 1000)
+
+# tables of joined result columns, returned a page at a time with t=1, are
+# cached TABLE_CACHE_TIMEOUT seconds in blocks of TABLE_BLOCK_SIZE rows; pages
+# have TABLE_PAGE_SIZE rows unless requests set n
+TABLE_PAGE_SIZE = getattr(settings, 'CURIOUS_TABLE_PAGE_SIZE', 100)
+TABLE_BLOCK_SIZE = getattr(settings, 'CURIOUS_TABLE_BLOCK_SIZE', 1000)
+TABLE_CACHE_TIMEOUT = getattr(settings, 'CURIOUS_TABLE_CACHE_TIMEOUT', 60*60)
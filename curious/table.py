@@ -0,0 +1,125 @@
+"""
+Tables of query results: result columns joined into rows of pks the same way
+join_table.js joins them in the browser, so clients can page through rows
+without loading every (pk, src) pair of every column.
+
+Tables are cached in blocks of TABLE_BLOCK_SIZE rows, under keys of the query,
+join mode and the time its results were computed, so later pages only load
+the blocks they need. Cursors are opaque strings naming a table and the
+offset of the next page.
+"""
+
+import base64
+import json
+from . import settings
+from .cache import cache
+
+
+class CursorExpired(Exception):
+  pass
+
+
+def join_columns(results, left_join=False):
+  """
+  Joins result columns, dicts with model, join_index and (pk, src) objects.
+  Returns kept columns, as dicts with model and join_index into kept columns,
+  and rows, as tuples of pks, one per kept column; None if a row has no
+  object in a column, with left_join. Columns without a model or objects are
+  dropped.
+  """
+
+  columns = []
+  kept = []
+  join_index = [result['join_index'] for result in results]
+  for i, result in enumerate(results):
+    if result['model'] and len(result['objects']) > 0:
+      kept.append(result)
+      columns.append(dict(model=result['model'], join_index=join_index[i]))
+      # later columns joining this column join its new index
+      for j in range(i+1, len(results)):
+        if join_index[j] == i:
+          join_index[j] = len(kept)-1
+  if len(kept) == 0:
+    return columns, []
+
+  rows = [(pk,) for pk, src in kept[0]['objects']]
+  for col in range(1, len(kept)):
+    by_src = {}
+    for pk, src in kept[col]['objects']:
+      by_src.setdefault(src, []).append(pk)
+
+    index = columns[col]['join_index']
+    new_rows = []
+    for row in rows:
+      pks = by_src.get(row[index]) if row[index] is not None else None
+      if pks is not None:
+        new_rows.extend(row+(pk,) for pk in pks)
+      elif left_join:
+        new_rows.append(row+(None,))
+    rows = new_rows
+
+  return columns, rows
+
+
+def _key(table_key, block):
+  return '%s_%s' % (table_key, block)
+
+
+def store(table_key, header, rows):
+  """
+  Caches rows in blocks, and header, a dict, with total number of rows.
+  Returns header.
+  """
+
+  size = settings.TABLE_BLOCK_SIZE
+  header = dict(header, total=len(rows))
+  blocks = dict((_key(table_key, i/size), rows[i:i+size]) for i in xrange(0, len(rows), size))
+  blocks[table_key] = header
+  cache.set_many(blocks, settings.TABLE_CACHE_TIMEOUT)
+  return header
+
+
+def page(table_key, offset, n):
+  """
+  Returns header and rows of cached table, from offset, at most n. Raises
+  CursorExpired if the table is not cached.
+  """
+
+  header = cache.get(table_key)
+  if header is None:
+    raise CursorExpired('Table expired, start from the first page')
+
+  size = settings.TABLE_BLOCK_SIZE
+  end = min(offset+n, header['total'])
+  if end <= offset:
+    return header, []
+  keys = [_key(table_key, b) for b in xrange(offset/size, (end-1)/size+1)]
+  blocks = cache.get_many(keys)
+  if len(blocks) != len(keys):
+    raise CursorExpired('Table expired, start from the first page')
+
+  rows = []
+  for key in keys:
+    rows.extend(blocks[key])
+  first = (offset/size)*size
+  return header, rows[offset-first:end-first]
+
+
+def cursor(snapshot, offset):
+  return base64.urlsafe_b64encode(json.dumps([snapshot, offset]))
+
+
+def parse_cursor(s):
+  """
+  Returns snapshot and offset of cursor s. Raises Exception if s is not a
+  cursor.
+  """
+
+  try:
+    snapshot, offset = json.loads(base64.urlsafe_b64decode(str(s)))
+    offset = int(offset)
+  except Exception:
+    raise Exception('Bad cursor')
+  if offset < 0:
+    raise Exception('Bad cursor')
+  return snapshot, offset
@@ -145,6 +145,9 @@ setup(
     'parsimonious == 0.5',
     'parsedatetime ~= 1.0',
   ],
+  extras_require={
+    'columnar': ['numpy'],
+  },
   tests_require=[
     'tox',
     'nose',
@@ -0,0 +1,69 @@
+"""
+Frontier benchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_frontier -s
+
+Set CURIOUS_BENCH_SCALE to scale the size of the generated data.
+"""
+
+import os
+import time
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from curious import settings
+from curious.graph import traverse_pks
+from curious_tests.models import Blog, Entry
+
+
+SCALE = int(os.environ.get('CURIOUS_BENCH_SCALE', '1'))
+
+# (chunk size, table size) forcing each way of passing frontiers
+STRATEGIES = (
+  ('one list', 10**9, 10**9),
+  ('chunks', 500, 10**9),
+  ('table', 0, 0),
+)
+
+
+def _run(nodes, chunk_size, table_size):
+  sizes = (settings.FRONTIER_CHUNK_SIZE, settings.FRONTIER_TABLE_SIZE)
+  settings.FRONTIER_CHUNK_SIZE, settings.FRONTIER_TABLE_SIZE = chunk_size, table_size
+  try:
+    with CaptureQueriesContext(connection) as queries:
+      t = time.time()
+      pairs, model = traverse_pks(nodes, Blog, Blog.entry_set)
+      t = time.time()-t
+    return len(pairs), len(queries), t
+  finally:
+    settings.FRONTIER_CHUNK_SIZE, settings.FRONTIER_TABLE_SIZE = sizes
+
+
+class BenchFrontier(TestCase):
+  BLOGS = 100000
+  ENTRIES_PER_BLOG = 2
+  SIZES = (10, 100, 1000, 3000, 10000, 100000, 1000000)
+
+  @classmethod
+  def setUpTestData(cls):
+    Blog.objects.bulk_create([Blog(name='Blog %d' % i) for i in xrange(cls.BLOGS*SCALE)],
+                             batch_size=500)
+    Entry.objects.bulk_create([Entry(blog_id=pk, headline='Entry %d' % i)
+                               for pk in Blog.objects.values_list('pk', flat=True)
+                               for i in xrange(cls.ENTRIES_PER_BLOG)], batch_size=500)
+
+  def test_frontier_sizes(self):
+    pks = list(Blog.objects.values_list('pk', flat=True))
+    for size in self.SIZES:
+      # frontiers larger than the number of blogs include pks of missing blogs
+      nodes = (pks*(size/len(pks)+1))[:size] if size <= len(pks) else range(1, size+1)
+      line = []
+      # unknown if every strategy fails
+      rows = '?'
+      for name, chunk_size, table_size in STRATEGIES:
+        try:
+          rows, queries, t = _run(nodes, chunk_size, table_size)
+          line.append('%s %d queries %.1fms' % (name, queries, t*1000))
+        except Exception as e:
+          line.append('%s failed (%s)' % (name, str(e)[:40]))
+      print '\nfrontier of %d, %s rows: %s' % (size, rows, ', '.join(line))
@@ -0,0 +1,89 @@
+"""
+Graph traversal benchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_graph -s
+
+Set CURIOUS_BENCH_SCALE to scale the size of the generated data, and
+CURIOUS_BENCH_PROFILE=1 to print a profile of each traversal.
+"""
+
+import os
+import time
+import cProfile
+import pstats
+from django.test import TestCase
+from curious.graph import traverse
+from curious_tests.models import Blog, Entry, Author, Person
+
+
+SCALE = int(os.environ.get('CURIOUS_BENCH_SCALE', '1'))
+PROFILE = os.environ.get('CURIOUS_BENCH_PROFILE', '') not in ('', '0')
+
+# SQLite limits number of variables in a query, so traverse in batches
+BATCH = 500
+
+
+def _traverse(nodes, attr):
+  result = []
+  for i in xrange(0, len(nodes), BATCH):
+    result.extend(traverse(nodes[i:i+BATCH], attr))
+  return result
+
+
+def _run(name, nodes, attr):
+  profile = cProfile.Profile() if PROFILE else None
+  if profile:
+    profile.enable()
+  t = time.time()
+  result = _traverse(nodes, attr)
+  t = time.time()-t
+  if profile:
+    profile.disable()
+
+  print '\n%s: %d rows in %.1fms, %.1fus per row' %\
+        (name, len(result), t*1000, t*1000000/max(len(result), 1))
+  if profile:
+    pstats.Stats(profile).sort_stats('cumulative').print_stats(15)
+  return result
+
+
+class BenchTraverse(TestCase):
+  ROWS = 100000
+  BLOGS = 1000
+
+  @classmethod
+  def setUpTestData(cls):
+    n_rows = cls.ROWS*SCALE
+    n_blogs = cls.BLOGS*SCALE
+    Blog.objects.bulk_create([Blog(name='Blog %d' % i) for i in xrange(n_blogs)], batch_size=BATCH)
+    blogs = list(Blog.objects.all())
+    Entry.objects.bulk_create([Entry(blog=blogs[i % n_blogs], headline='Entry %d' % i)
+                               for i in xrange(n_rows)], batch_size=BATCH)
+    Person.objects.bulk_create([Person(gender='x') for i in xrange(n_rows)], batch_size=BATCH)
+    Author.objects.bulk_create([Author(name='Author %d' % i, person=p)
+                                for i, p in enumerate(Person.objects.all())], batch_size=BATCH)
+    through = Entry.authors.through
+    through.objects.bulk_create([through(entry_id=e, author_id=a)
+                                 for e, a in zip(Entry.objects.values_list('pk', flat=True),
+                                                 Author.objects.values_list('pk', flat=True))],
+                                batch_size=BATCH)
+
+  def test_fk(self):
+    entries = list(Entry.objects.only('pk'))
+    result = _run('FK, Entry.blog', entries, Entry.blog)
+    self.assertEquals(len(result), len(entries))
+
+  def test_reverse_fk(self):
+    blogs = list(Blog.objects.only('pk'))
+    result = _run('reverse FK, Blog.entry_set', blogs, Blog.entry_set)
+    self.assertEquals(len(result), self.ROWS*SCALE)
+
+  def test_m2m(self):
+    entries = list(Entry.objects.only('pk'))
+    result = _run('M2M, Entry.authors', entries, Entry.authors)
+    self.assertEquals(len(result), len(entries))
+
+  def test_one_to_one(self):
+    authors = list(Author.objects.only('pk'))
+    result = _run('one-to-one, Author.person', authors, Author.person)
+    self.assertEquals(len(result), len(authors))
@@ -0,0 +1,93 @@
+"""
+Join benchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_join -s
+
+Set CURIOUS_BENCH_SCALE to scale the size of the generated data. Each join runs
+in a forked process, so its peak memory can be measured on its own.
+"""
+
+import os
+import time
+import resource
+import cPickle
+from unittest import TestCase
+from curious import columns, join
+
+
+SCALE = int(os.environ.get('CURIOUS_BENCH_SCALE', '1'))
+
+
+def _set_join(left, right):
+  # how Query._extend_result used to join results
+  input_map = {}
+  for obj, src in left:
+    if obj not in input_map:
+      input_map[obj] = []
+    input_map[obj].append(src)
+
+  keep = []
+  for next_obj, next_src in right:
+    if next_src in input_map:
+      for src in input_map[next_src]:
+        keep.append((next_obj, src))
+  return list(set(keep))
+
+
+def _columns_join(left, right):
+  return columns.hash_join(columns.to_columns(left), columns.to_columns(right))
+
+
+def _measure(f, *args):
+  """
+  Runs f in a child process, returns number of results, seconds, and peak
+  memory growth in MB.
+  """
+
+  r, w = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(r)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = time.time()
+    n = len(f(*args))
+    t = time.time()-t
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    os.write(w, cPickle.dumps((n, t, (after-before)/1024.0)))
+    os._exit(0)
+  os.close(w)
+  data = ''
+  while True:
+    chunk = os.read(r, 4096)
+    if not chunk:
+      break
+    data += chunk
+  os.close(r)
+  os.waitpid(pid, 0)
+  return cPickle.loads(data)
+
+
+class BenchJoin(TestCase):
+  LEFT = 1000000
+  FAN_OUT = 10
+
+  def test_join_with_fan_out(self):
+    n = self.LEFT*SCALE
+    # every node is its own source, and reaches FAN_OUT nodes; outputs of
+    # different nodes overlap, like in real graphs
+    left = [(i, i) for i in xrange(n)]
+    right = [((i*7+j) % n, i) for i in xrange(n) for j in xrange(self.FAN_OUT)]
+
+    joins = [('set', _set_join), ('hash join', join.hash_join)]
+    if columns.numpy is not None:
+      joins.append(('columns', _columns_join))
+
+    results = {}
+    for name, f in joins:
+      rows, t, mb = _measure(f, left, right)
+      results[name] = rows
+      print '\n%d x fan-out %d, %s: %d rows, %.0fms, +%.0fMB peak' %\
+            (n, self.FAN_OUT, name, rows, t*1000, mb)
+    self.assertEquals(results['set'], results['hash join'])
+    if 'columns' in results:
+      self.assertEquals(results['columns'], results['hash join'])
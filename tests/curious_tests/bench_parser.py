@@ -0,0 +1,42 @@
+"""
+Parser microbenchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_parser -s
+"""
+
+import time
+from unittest import TestCase
+from curious.parser import GRAMMAR, ASTBuilder
+from curious.rdparser import RDParser
+
+
+def _time(f, repeat):
+  t = time.time()
+  for i in xrange(repeat):
+    f()
+  return (time.time()-t)/repeat
+
+
+class BenchParser(TestCase):
+
+  def _compare(self, label, code, repeat):
+    peg = _time(lambda: ASTBuilder().visit(GRAMMAR.parse(code)), repeat)
+    rd = _time(lambda: RDParser(code).parse(), repeat)
+    print '\n%s (%d chars): peg %.2fms, rd %.2fms, %.1fx' % (
+      label, len(code), peg*1000, rd*1000, peg/rd)
+    self.assertEquals(ASTBuilder().visit(GRAMMAR.parse(code)), RDParser(code).parse())
+
+  def test_short_query(self):
+    code = 'Blog(1) Blog.entry_set(headline__icontains="MySQL") Entry.authors'
+    self._compare('short query', code, 200)
+
+  def test_large_array_literals(self):
+    for n in (100, 1000, 10000):
+      ids = ', '.join(str(i) for i in xrange(n))
+      code = 'Blog(1) Blog.entry_set(id__in=[%s]) Entry.authors(id__in=[%s])' % (ids, ids)
+      self._compare('%d element arrays' % n, code, 3)
+
+  def test_many_steps(self):
+    step = 'Entry.response_to(blog_id__in=[1, 2, 3]).exclude(headline="x")'
+    code = 'Entry(1) ' + ' '.join([step] * 200)
+    self._compare('200 steps', code, 3)
@@ -0,0 +1,118 @@
+"""
+Query engine benchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_query -s
+
+Set CURIOUS_BENCH_SCALE to scale the size of the generated data.
+"""
+
+import os
+import time
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from curious import model_registry, settings
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author, Person
+import curious_tests.models
+
+
+SCALE = int(os.environ.get('CURIOUS_BENCH_SCALE', '1'))
+
+
+def _run(query, repeat=3):
+  with CaptureQueriesContext(connection) as queries:
+    t = time.time()
+    for i in xrange(repeat):
+      result = query()
+    t = (time.time()-t)/repeat
+  return result, len(queries)/repeat, t
+
+
+def _without_planning(f):
+  plan = Query._plan
+  Query._plan = staticmethod(lambda steps: steps)
+  try:
+    return f()
+  finally:
+    Query._plan = staticmethod(plan)
+
+
+class BenchChains(TestCase):
+  BLOGS = 20
+  ENTRIES_PER_BLOG = 50
+  AUTHORS = 500
+
+  @classmethod
+  def setUpTestData(cls):
+    n_blogs = cls.BLOGS*SCALE
+    n_authors = cls.AUTHORS*SCALE
+    Blog.objects.bulk_create([Blog(name='Blog %d' % i) for i in xrange(n_blogs)])
+    blogs = list(Blog.objects.all())
+    Person.objects.bulk_create([Person(gender='x') for i in xrange(n_authors)])
+    people = list(Person.objects.all())
+    Author.objects.bulk_create([Author(name='Author %d' % i, person=p)
+                                for i, p in enumerate(people)])
+    authors = list(Author.objects.all())
+    Entry.objects.bulk_create([Entry(blog=blog, headline='Entry %d' % i)
+                               for blog in blogs for i in xrange(cls.ENTRIES_PER_BLOG)])
+    through = Entry.authors.through
+    links = []
+    for i, entry in enumerate(Entry.objects.all()):
+      for j in xrange(3):
+        links.append(through(entry_id=entry.pk, author_id=authors[(i*7+j*13) % len(authors)].pk))
+    through.objects.bulk_create(links)
+
+  def setUp(self):
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_deep_chain(self):
+    query = Query('Blog(name__startswith="Blog"), '
+                  'Blog.entry_set Entry.authors Author.person Person.author')
+    chained, chained_queries, chained_t = _run(query)
+    separate, separate_queries, separate_t = _without_planning(lambda: _run(query))
+    print '\ndeep chain, %d rows: step by step %d queries %.1fms, chained %d queries %.1fms' % (
+      len(chained[0][1][0]), separate_queries, separate_t*1000, chained_queries, chained_t*1000)
+    self.assertEquals(len(chained[0][1][0]), len(separate[0][1][0]))
+
+
+def _without_recursive_queries(f):
+  settings.RECURSIVE_QUERIES = False
+  try:
+    return f()
+  finally:
+    settings.RECURSIVE_QUERIES = True
+
+
+class BenchRecursion(TestCase):
+  DEPTH = 200
+  THREADS = 5
+
+  @classmethod
+  def setUpTestData(cls):
+    blog = Blog.objects.create(name='Blog')
+    for t in xrange(cls.THREADS):
+      parent = None
+      for i in xrange(cls.DEPTH*SCALE):
+        parent = Entry.objects.create(blog=blog, headline='Entry %d.%d' % (t, i),
+                                      response_to=parent)
+
+  def setUp(self):
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_deep_recursion(self):
+    for recursion in ('*', '**', '$', '?'):
+      query = Query('Entry(headline__endswith=".0") Entry.responses(headline__contains="Entry")%s' %
+                    recursion)
+      one, one_queries, one_t = _run(query)
+      loop, loop_queries, loop_t = _without_recursive_queries(lambda: _run(query))
+      print '\nEntry.responses%s, %d rows: loop %d queries %.1fms, '\
+            'recursive query %d queries %.1fms' % (
+              recursion, len(one[0][0][0]), loop_queries, loop_t*1000, one_queries, one_t*1000)
+      self.assertEquals(set(one[0][0][0]), set(loop[0][0][0]))
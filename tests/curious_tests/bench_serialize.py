@@ -0,0 +1,120 @@
+"""
+Serialization benchmarks. Not collected by the default test run; run with
+
+  python tests/manage.py test curious_tests.bench_serialize -s
+
+Set CURIOUS_BENCH_SCALE to scale the number of objects. Objects are built in
+memory, with their related objects, so only serialization is measured.
+"""
+
+import os
+import time
+import types
+from decimal import Decimal
+from unittest import TestCase
+from django.db import models
+from django.db.models.fields.related import ForeignKey
+from curious import model_registry
+from curious.api import ModelView
+from curious_tests.models import Author, Blog, Comment, Entry, Person
+import curious_tests.models
+
+
+SCALE = int(os.environ.get('CURIOUS_BENCH_SCALE', '1'))
+
+
+class Review(models.Model):
+  class Meta:
+    app_label = 'curious_tests'
+
+  blog = models.ForeignKey(Blog)
+  entry = models.ForeignKey(Entry)
+  author = models.ForeignKey(Author)
+  comment = models.ForeignKey(Comment)
+  person = models.ForeignKey(Person)
+  score = models.DecimalField(max_digits=5, decimal_places=2)
+  title = models.CharField(max_length=100)
+  stars = models.IntegerField()
+
+
+def _legacy_objects_to_dict(objects, ignore_excludes=False, follow_fk=True):
+  # how ModelView.objects_to_dict used to serialize objects
+  fields = []
+  fk = []
+  add_pk = False
+
+  obj = objects[0]
+  model_name = model_registry.get_name(obj.__class__)
+  model_manager = model_registry.get_manager(model_name)
+  excludes = [] if ignore_excludes is True else model_manager.field_excludes
+
+  for f in obj._meta.fields:
+    if f.column not in excludes:
+      fields.append(f.column)
+      fk.append(f.name if type(f) == ForeignKey else None)
+  if 'id' not in fields:
+    fields.append('pk')
+    fk.append(None)
+    add_pk = True
+
+  packed = []
+  urls = []
+  for obj in objects:
+    obj_url = model_registry.get_manager(model_name).url_of(obj)
+    values = []
+    for column, fk_name in zip(fields, fk):
+      value = getattr(obj, column)
+      if type(value) is Decimal:
+        value = float(value)
+      elif not type(value) in (long, int, float, bool, types.NoneType):
+        value = unicode(value)
+      if fk_name is not None and follow_fk is True:
+        v = getattr(obj, fk_name)
+        if v is not None:
+          fk_model_name = model_registry.get_name(v.__class__)
+          try:
+            fk_url = model_registry.get_manager(fk_model_name).url_of(v)
+          except:
+            fk_url = None
+          value = (fk_model_name, v.pk, str(v), fk_url)
+      values.append(value)
+    urls.append(obj_url)
+    packed.append(values)
+
+  if add_pk is True:
+    fields[-1] = 'id'
+  return dict(fields=fields, objects=packed, urls=urls)
+
+
+class BenchSerialize(TestCase):
+  N = 50000
+
+  def setUp(self):
+    model_registry.register(curious_tests.models)
+    model_registry.register(Review)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_serialize_objects_with_five_foreign_keys(self):
+    n = self.N*SCALE
+    blogs = [Blog(id=i, name='Blog %d' % i) for i in range(100)]
+    entries = [Entry(id=i, blog=blogs[i % 100], headline='Entry %d' % i) for i in range(100)]
+    authors = [Author(id=i, name='Author %d' % i) for i in range(100)]
+    comments = [Comment(id=i, entry=entries[i], comment='Comment %d' % i) for i in range(100)]
+    people = [Person(id=i, gender='f') for i in range(100)]
+    reviews = [Review(id=i, blog=blogs[i % 100], entry=entries[i % 100], author=authors[i % 100],
+                      comment=comments[i % 100], person=people[i % 100],
+                      score=Decimal('4.5'), title='Review %d' % i, stars=i % 5)
+               for i in xrange(n)]
+
+    results = {}
+    for name, f in [('legacy', _legacy_objects_to_dict), ('compiled', ModelView.objects_to_dict)]:
+      t = time.time()
+      results[name] = f(reviews)
+      t = time.time()-t
+      print '\n%d objects with 5 foreign keys, %s: %.0fms' % (n, name, t*1000)
+
+    self.assertEquals(results['compiled']['fields'], results['legacy']['fields'])
+    self.assertEquals(results['compiled']['urls'], results['legacy']['urls'])
+    self.assertEquals(results['compiled']['objects'], results['legacy']['objects'])
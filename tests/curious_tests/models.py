@@ -70,3 +70,18 @@ class Comment(models.Model):
 
   def __unicode__(self):
     return self.comment
+
+
+class Publisher(models.Model):
+  code = models.CharField(max_length=20, unique=True)
+
+  def __unicode__(self):
+    return self.code
+
+
+class Book(models.Model):
+  publisher = models.ForeignKey(Publisher, to_field='code', related_name='books')
+  title = models.CharField(max_length=100)
+
+  def __unicode__(self):
+    return self.title
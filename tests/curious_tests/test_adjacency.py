@@ -0,0 +1,100 @@
+from django.test import TestCase
+from curious import model_registry, adjacency
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+from curious_tests import test_query_recursive_sql
+import curious_tests.models
+
+
+class CachedRelationships(object):
+
+  def setUp(self):
+    adjacency.cache.clear()
+    super(CachedRelationships, self).setUp()
+    model_registry.register(curious_tests.models)
+    model_registry.get_manager('Entry').cached_relationships = ['responses', 'response_to']
+    model_registry.get_manager('Author').cached_relationships = ['friends']
+
+  def tearDown(self):
+    super(CachedRelationships, self).tearDown()
+    model_registry.clear()
+    adjacency.cache.clear()
+
+
+class TestAdjacencyCache(CachedRelationships, TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    # 0 <- 1 <- 2, and 0 <- 3
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(4)]
+    for i, parent in ((1, 0), (2, 1), (3, 0)):
+      self.entries[i].response_to = self.entries[parent]
+      self.entries[i].save()
+    self.authors = [Author.objects.create(name='Author %d' % i) for i in range(3)]
+    self.authors[0].friends.add(self.authors[1])
+    super(TestAdjacencyCache, self).setUp()
+
+  def _responses(self):
+    result, last_model = Query('Entry(%s) Entry.responses**' % self.entries[0].pk).pks()
+    return set(pk for pk, src in result[0][0])
+
+  def test_repeated_queries_read_neighbors_from_cache(self):
+    # starting objects, then one query for each level
+    with self.assertNumQueries(4):
+      self.assertEquals(self._responses(), set(e.pk for e in self.entries))
+    # starting objects only
+    with self.assertNumQueries(1):
+      self.assertEquals(self._responses(), set(e.pk for e in self.entries))
+
+  def test_filters_apply_to_cached_neighbors(self):
+    self._responses()
+    qs = 'Entry(%s) Entry.responses(headline__in=["Entry 1", "Entry 2"])' % self.entries[0].pk
+    result, last_model = Query(qs).pks()
+    self.assertEquals(result[0][0], [(self.entries[1].pk, None)])
+
+  def test_saving_objects_invalidates_relationship(self):
+    self._responses()
+    entry = Entry.objects.create(blog=self.blog, headline='Entry 4', response_to=self.entries[2])
+    self.assertIn(entry.pk, self._responses())
+    entry.delete()
+    self.assertNotIn(entry.pk, self._responses())
+
+  def test_changing_many_to_many_rows_invalidates_relationship(self):
+    qs = 'Author(%s) Author.friends' % self.authors[0].pk
+    self.assertEquals(Query(qs).pks()[0][0][0], [(self.authors[1].pk, None)])
+    self.authors[0].friends.add(self.authors[2])
+    self.assertItemsEqual(Query(qs).pks()[0][0][0], [(self.authors[1].pk, None),
+                                                     (self.authors[2].pk, None)])
+
+  def test_other_relationships_are_not_cached(self):
+    g = adjacency.generation('curious_tests__Entry.responses')
+    Blog.objects.create(name='Unrelated')
+    self.assertEquals(adjacency.generation('curious_tests__Entry.responses'), g)
+    qs = 'Blog(%s) Blog.entry_set' % self.blog.pk
+    Query(qs).pks()
+    with self.assertNumQueries(2):
+      Query(qs).pks()
+
+  def test_changes_of_cached_relationships_are_followed(self):
+    relationship = 'curious_tests__Blog.entry_set'
+    g = adjacency.generation(relationship)
+    Blog.objects.create(name='Before')
+    self.assertEquals(adjacency.generation(relationship), g)
+    model_registry.get_manager('Blog').cached_relationships = ['entry_set']
+    Blog.objects.create(name='After')
+    self.assertNotEquals(adjacency.generation(relationship), g)
+
+  def test_cached_relationships_are_not_chained(self):
+    qs = 'Entry(%s) Entry.responses Entry.blog' % self.entries[0].pk
+    with self.assertNumQueries(3):
+      result, last_model = Query(qs).pks()
+    self.assertEquals(result[0][0], [(self.blog.pk, None)])
+
+
+class TestRecursiveQueriesCached(CachedRelationships,
+                                 test_query_recursive_sql.TestRecursiveQueries):
+  # counts queries
+  test_uses_one_query = None
+  test_uses_one_query_when_filters_limit_traversal = None
+  test_filtering_search_falls_back_to_loop = None
+  test_loop_fetches_each_level_once = None
@@ -0,0 +1,375 @@
+import os
+import json
+import sys
+import subprocess
+import threading
+import time
+from datetime import timedelta
+from django.test import TestCase
+from curious import model_registry, admission, api, flight, refresh, settings
+from curious.api import QueryView, ModelView, cache_key
+from curious.query import Query
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+TESTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KEY_SCRIPT = """
+import django
+django.setup()
+from curious import model_registry
+from curious.api import cache_key
+from curious.query import Query
+import curious_tests.models
+model_registry.register(curious_tests.models)
+print cache_key('query', Query(%r).canonical)
+"""
+
+
+class TestCacheKeys(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(3)]
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+
+  def tearDown(self):
+    model_registry.clear()
+    api.cache.clear()
+
+  def _key(self, qs):
+    return cache_key('query', Query(qs).canonical)
+
+  def test_keys_ignore_whitespace_and_order_of_filter_arguments(self):
+    self.assertEquals(self._key('Blog(1) Blog.entry_set(headline="a", id=2)'),
+                      self._key('Blog( 1 )  Blog.entry_set( id=2,headline="a" )'))
+    self.assertNotEquals(self._key('Blog(1) Blog.entry_set(headline="a", id=2)'),
+                         self._key('Blog(1) Blog.entry_set(headline="a", id=3)'))
+
+  def test_keys_change_with_cache_version_and_registry(self):
+    key = self._key('Blog(1) Blog.entry_set')
+    model_registry.get_manager('Entry').field_excludes = ['headline']
+    self.assertNotEquals(self._key('Blog(1) Blog.entry_set'), key)
+    model_registry.get_manager('Entry').field_excludes = []
+    self.assertEquals(self._key('Blog(1) Blog.entry_set'), key)
+
+    self.assertEquals(cache_key('query', Query('Blog(1) Blog.entry_set').canonical,
+                                version=model_registry.version), key)
+
+    version = api.CACHE_VERSION
+    api.CACHE_VERSION = version+1
+    try:
+      self.assertNotEquals(self._key('Blog(1) Blog.entry_set'), key)
+    finally:
+      api.CACHE_VERSION = version
+
+  def test_processes_use_the_same_keys(self):
+    qs = 'Blog(1) Blog.entry_set(headline="a", id=2)'
+    env = dict(os.environ,
+               DJANGO_SETTINGS_MODULE='dummy.settings',
+               PYTHONPATH=os.pathsep.join([os.path.dirname(TESTS_DIR), TESTS_DIR]))
+    keys = set([self._key(qs)])
+    for seed in ('1', '2'):
+      env['PYTHONHASHSEED'] = seed
+      keys.add(subprocess.check_output([sys.executable, '-c', KEY_SCRIPT % qs], env=env).strip())
+    self.assertEquals(len(keys), 1)
+
+  def test_query_results_are_cached_under_key(self):
+    query = Query('Blog(%s) Blog.entry_set' % self.blog.pk)
+    results = QueryView().get_query_results(query, False, True, 'app')
+    self.assertEquals(api.cache.get(cache_key('query', query.canonical)), results)
+    with self.assertNumQueries(0):
+      query = Query('Blog(%s)  Blog.entry_set' % self.blog.pk)
+      self.assertEquals(QueryView().get_query_results(query, False, True, 'app'), results)
+
+  def test_object_data_is_cached_regardless_of_order_of_ids(self):
+    ids = [e.pk for e in self.entries]
+    data = ModelView.get_objects_as_json(Entry, ids, False, True, False, 'app')
+    with self.assertNumQueries(0):
+      cached = ModelView.get_objects_as_json(Entry, list(reversed(ids)), False, True, False, 'app')
+    self.assertEquals(cached, json.loads(json.dumps(data)))
+
+
+class TestObjectCache(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(6)]
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    ModelView.object_cache_stats.reset()
+
+  def tearDown(self):
+    model_registry.clear()
+    api.cache.clear()
+    ModelView.object_cache_stats.reset()
+
+  def _data(self, entries, force_reload=False):
+    return ModelView.get_objects_as_json(Entry, [e.pk for e in entries], False, True, force_reload,
+                                         'app')
+
+  def test_overlapping_batches_share_cached_objects(self):
+    self._data(self.entries[:4])
+    with self.assertNumQueries(0):
+      cached = self._data(self.entries[1:3])
+    self.assertEquals(cached['objects'],
+                      [[e.pk, ['Blog', self.blog.pk, self.blog.name, None], e.headline, None, None]
+                       for e in self.entries[1:3]])
+    self.assertEquals(cached['fields'],
+                      ['id', 'blog_id', 'headline', 'response_to_id', 'related_blog_id'])
+
+  def test_only_missing_objects_are_fetched(self):
+    self._data(self.entries[:3])
+    Entry.objects.filter(pk=self.entries[0].pk).update(headline='changed')
+    Entry.objects.filter(pk=self.entries[4].pk).update(headline='changed')
+    data = self._data(self.entries[:5])
+    self.assertEquals([obj[2] for obj in data['objects']],
+                      ['Entry 0', 'Entry 1', 'Entry 2', 'Entry 3', 'changed'])
+    self.assertEquals(ModelView.object_cache_stats.hits, 3)
+    self.assertEquals(ModelView.object_cache_stats.misses, 3+2)
+    self.assertEquals(ModelView.object_cache_stats.hit_rate, 3.0/8)
+
+  def test_force_reload_fetches_all_objects(self):
+    self._data(self.entries[:3])
+    Entry.objects.filter(pk=self.entries[0].pk).update(headline='changed')
+    data = self._data(self.entries[:3], force_reload=True)
+    self.assertEquals(data['objects'][0][2], 'changed')
+    self.assertEquals(self._data(self.entries[:1])['objects'][0][2], 'changed')
+
+  def test_objects_are_not_cached_without_app(self):
+    ModelView.get_objects_as_json(Entry, [e.pk for e in self.entries], False, True, False, None)
+    with self.assertNumQueries(1):
+      ModelView.get_objects_as_json(Entry, [e.pk for e in self.entries], False, True, False, None)
+    self.assertIsNone(ModelView.object_cache_stats.hit_rate)
+
+  def test_batch_endpoint_reads_cache(self):
+    ids = [e.pk for e in self.entries]
+    data = json.dumps(dict(ids=ids, app='app'))
+    r = self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+    self.assertEquals(r.status_code, 200)
+    with self.assertNumQueries(0):
+      cached = self.client.post('/curious/models/Entry/', data=data,
+                                content_type='application/json')
+    self.assertEquals(json.loads(cached.content), json.loads(r.content))
+
+    Entry.objects.filter(pk=ids[0]).update(headline='changed')
+    data = json.dumps(dict(ids=ids, app='app', r=1))
+    r = self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+    self.assertEquals(json.loads(r.content)['result']['objects'][0][2], 'changed')
+
+  def test_custom_model_objects_are_cached(self):
+    from curious_tests.test_custom_model import MyModel
+    model_registry.register(MyModel)
+    fetched = []
+
+    def fetch(ids):
+      fetched.append(list(ids))
+      return [MyModel(i) for i in ids]
+
+    original = MyModel.__dict__['fetch']
+    MyModel.fetch = staticmethod(fetch)
+    try:
+      data = ModelView.get_objects_as_json(MyModel, [1, 2], False, True, False, 'app')
+      data = ModelView.get_objects_as_json(MyModel, [2, 3, 1], False, True, False, 'app')
+    finally:
+      MyModel.fetch = original
+    self.assertEquals(fetched, [[1, 2], [3]])
+    self.assertEquals(data['fields'], ['a', 'b', 'c', 'id'])
+    self.assertEquals(data['objects'], [['a2', 'b2', 'c2', 'my2'], ['a3', 'b3', 'c3', 'my3'],
+                                        ['a1', 'b1', 'c1', 'my1']])
+
+
+class TestCacheAdmission(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    Entry.objects.create(blog=self.blog, headline='Entry')
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    admission.stats.reset()
+    self.__policies = settings.QUERY_CACHE_POLICIES
+
+  def tearDown(self):
+    settings.QUERY_CACHE_POLICIES = self.__policies
+    model_registry.clear()
+    api.cache.clear()
+    admission.stats.reset()
+
+  def test_frequent_quick_queries_are_admitted(self):
+    policy = admission.CachePolicy()
+    self.assertTrue(policy.decide(2, 500, 100).admitted)
+    self.assertFalse(policy.decide(12, 1, 100).admitted)
+    self.assertFalse(policy.decide(2, 500, 10000000).admitted)
+
+  def test_requests_are_counted_per_key(self):
+    policy = admission.CachePolicy()
+    self.assertEquals([policy.requested('a') for i in range(3)], [1, 2, 3])
+    self.assertEquals(policy.requested('b'), 1)
+
+  def test_policies_are_configured_per_app(self):
+    settings.QUERY_CACHE_POLICIES = {'eager': dict(min_saved=0)}
+    self.assertEquals(admission.policy_for('eager').min_saved, 0)
+    self.assertEquals(admission.policy_for('other').min_saved, admission.CachePolicy().min_saved)
+
+  def _get(self, app):
+    return self.client.get('/curious/q/', dict(q='Blog(%s) Blog.entry_set' % self.blog.pk, app=app))
+
+  def test_decision_and_stats_are_returned_in_headers(self):
+    settings.QUERY_CACHE_POLICIES = {'eager': dict(min_saved=0, price_per_row=0)}
+    r = self._get('lazy')
+    self.assertTrue(r['X-Curious-Cache'].startswith('rejected; cost='))
+    self.assertIn('requests=1; size=1;', r['X-Curious-Cache'])
+    self.assertEquals(r['X-Curious-Cache-Stats'],
+                      'admitted=0; hits=0; rejected=1; shared=0; stale=0')
+    self.assertEquals(sorted(json.loads(r.content)['result'].keys()),
+                      ['computed_on', 'last_model', 'results'])
+
+    r = self._get('eager')
+    self.assertTrue(r['X-Curious-Cache'].startswith('admitted;'))
+    r = self._get('eager')
+    self.assertEquals(r['X-Curious-Cache'], 'hit')
+    self.assertEquals(r['X-Curious-Cache-Stats'],
+                      'admitted=1; hits=1; rejected=1; shared=0; stale=0')
+
+  def test_no_decision_without_app(self):
+    r = self.client.get('/curious/q/', dict(q='Blog(%s)' % self.blog.pk))
+    self.assertFalse(r.has_header('X-Curious-Cache'))
+
+
+class TestStaleWhileRevalidate(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    Entry.objects.create(blog=self.blog, headline='Entry')
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    admission.stats.reset()
+    self.refreshes = []
+    self.__start = refresh._start
+    # refresh on this thread, after the stale results are returned, since
+    # other threads do not see the test database
+    refresh._start = self.refreshes.append
+
+  def tearDown(self):
+    refresh._start = self.__start
+    model_registry.clear()
+    api.cache.clear()
+    admission.stats.reset()
+
+  def _get(self):
+    return self.client.get('/curious/q/',
+                           dict(q='Blog(%s) Blog.entry_set' % self.blog.pk, app='app', fc=1))
+
+  def _age(self, seconds):
+    query = Query('Blog(%s) Blog.entry_set' % self.blog.pk)
+    cache_k = cache_key('query', query.canonical)
+    results = api.cache.get(cache_k)
+    results['computed_on'] -= timedelta(seconds=seconds)
+    api.cache.set(cache_k, results)
+
+  def test_fresh_results_are_not_refreshed(self):
+    self._get()
+    self._age(api.CACHE_TIMEOUT-60)
+    r = self._get()
+    self.assertEquals(r['X-Curious-Cache'], 'hit')
+    self.assertEquals(self.refreshes, [])
+
+  def test_stale_results_are_served_and_refreshed_once(self):
+    self._get()
+    Entry.objects.create(blog=self.blog, headline='Another')
+    self._age(api.CACHE_TIMEOUT+60)
+
+    r = self._get()
+    self.assertEquals(r['X-Curious-Cache'], 'stale; refreshing')
+    result = json.loads(r.content)['result']
+    self.assertEquals(len(result['results'][0]['objects']), 1)
+    self.assertEquals(result['computed_since'], 'an hour ago')
+    r = self._get()
+    self.assertEquals(r['X-Curious-Cache'], 'stale')
+    self.assertEquals(len(self.refreshes), 1)
+    self.assertEquals(admission.stats.stale, 2)
+
+    self.refreshes[0]()
+    r = self._get()
+    self.assertEquals(r['X-Curious-Cache'], 'hit')
+    result = json.loads(r.content)['result']
+    self.assertEquals(len(result['results'][0]['objects']), 2)
+    self.assertNotIn('computed_since', result)
+
+  def test_results_expire_after_hard_timeout(self):
+    timeout = settings.QUERY_CACHE_HARD_TIMEOUT
+    settings.QUERY_CACHE_HARD_TIMEOUT = -1
+    try:
+      self._get()
+    finally:
+      settings.QUERY_CACHE_HARD_TIMEOUT = timeout
+    self.assertTrue(self._get()['X-Curious-Cache'].startswith('admitted;'))
+
+  def test_refreshes_run_on_worker_thread(self):
+    refresh._start = self.__start
+    done = threading.Event()
+    threads = []
+
+    def f():
+      threads.append(threading.current_thread())
+      done.set()
+
+    self.assertTrue(refresh.submit('key', f))
+    self.assertTrue(done.wait(5))
+    self.assertNotEquals(threads, [threading.current_thread()])
+    # lock is released once the refresh is done
+    for i in range(50):
+      if refresh.submit('key', lambda: None):
+        break
+      time.sleep(0.01)
+    else:
+      self.fail('refresh lock was not released')
+
+
+class TestSingleFlightQueries(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    admission.stats.reset()
+    self.qs = 'Blog(%s) Blog.entry_set' % self.blog.pk
+    self.lock_key = flight._lock_key(cache_key('query', Query(self.qs).canonical))
+    self.__timeout = settings.SINGLE_FLIGHT_TIMEOUT
+
+  def tearDown(self):
+    settings.SINGLE_FLIGHT_TIMEOUT = self.__timeout
+    model_registry.clear()
+    api.cache.clear()
+    admission.stats.reset()
+
+  def test_waiting_for_query_run_elsewhere_times_out(self):
+    settings.SINGLE_FLIGHT_TIMEOUT = 0
+    api.cache.add(self.lock_key, True)
+    r = self.client.get('/curious/q/', dict(q=self.qs, app='app'))
+    self.assertEquals(r.status_code, 503)
+    self.assertEquals(r['Retry-After'], '0')
+    self.assertIn('message', json.loads(r.content)['error'])
+
+  def test_results_computed_elsewhere_are_shared(self):
+    api.cache.add(self.lock_key, True)
+    computed = []
+
+    def finish(seconds):
+      results = QueryView().run_query(Query(self.qs))
+      computed.append(results)
+      api.cache.set(cache_key('query', Query(self.qs).canonical), results)
+      api.cache.delete(self.lock_key)
+
+    sleep = time.sleep
+    time.sleep = finish
+    try:
+      view = QueryView()
+      results = view.get_query_results(Query(self.qs), True, False, 'app')
+    finally:
+      time.sleep = sleep
+    self.assertEquals(computed, [results])
+    self.assertEquals(view.cache_decision, 'shared')
+    self.assertEquals(admission.stats.shared, 1)
@@ -2,7 +2,7 @@ import json
 from django.test import TestCase
 from curious import model_registry
 from curious.api import ModelView
-from curious_tests.models import Blog, Entry, Person
+from curious_tests.models import Author, Blog, Entry, Person
 import curious_tests.models
 
 
@@ -69,6 +69,20 @@ class TestQueryAPI(TestCase):
     objects = [[obj.id, self.blog.pk] for obj in self.entries]
     self.assertItemsEqual(j['result']['results'][1]['objects'], objects)
 
+  def test_getting_data_of_left_joined_objects(self):
+    author = Author.objects.create(name='Jane')
+    self.entries[0].authors.add(author)
+    q = 'Blog(%s) Blog.entry_set ?(Entry.authors) Entry.comment_set' % self.blog.pk
+    for s in (0, 1):
+      r = self.client.get('/curious/q/', dict(d=1, s=s, q=q))
+      self.assertEquals(r.status_code, 200)
+      content = ''.join(r.streaming_content) if s else r.content
+      j = json.loads(content)
+      authors = [objects for result, objects in zip(j['result']['results'], j['result']['data'])
+                 if result['model'] == 'Author']
+      self.assertEquals(len(authors), 1)
+      self.assertEquals(authors[0]['objects'], [[author.pk, 'Jane', None, None]])
+
   def test_getting_data_with_query(self):
     r = self.client.get('/curious/q/', dict(d=1, q='Blog(%s), Blog.entry_set' % self.blog.pk))
     self.assertEquals(r.status_code, 200)
@@ -0,0 +1,60 @@
+import time
+import threading
+from unittest import TestCase
+from django.db import transaction
+from curious import settings
+from curious.branches import run_branches
+
+
+class TestBranches(TestCase):
+
+  def setUp(self):
+    self.threads = settings.BRANCH_THREADS
+    settings.BRANCH_THREADS = 3
+    self.lock = threading.Lock()
+    self.running = 0
+    self.max_running = 0
+    self.idents = []
+
+  def tearDown(self):
+    settings.BRANCH_THREADS = self.threads
+
+  def _branch(self, x):
+    with self.lock:
+      self.running += 1
+      self.max_running = max(self.max_running, self.running)
+      self.idents.append(threading.current_thread().ident)
+    time.sleep(0.05)
+    with self.lock:
+      self.running -= 1
+    return x*2
+
+  def test_branches_run_concurrently_on_bounded_threads(self):
+    t = time.time()
+    self.assertEquals(run_branches(self._branch, range(6)), [0, 2, 4, 6, 8, 10])
+    self.assertLess(time.time()-t, 0.25)
+    self.assertEquals(self.max_running, 3)
+    self.assertNotIn(threading.current_thread().ident, self.idents)
+
+  def test_one_thread_runs_branches_one_after_another(self):
+    settings.BRANCH_THREADS = 1
+    self.assertEquals(run_branches(self._branch, range(3)), [0, 2, 4])
+    self.assertEquals(set(self.idents), set([threading.current_thread().ident]))
+
+  def test_nested_branches_run_on_their_thread(self):
+    def branch(x):
+      return run_branches(self._branch, [x, x+1])
+    self.assertEquals(run_branches(branch, [0, 10]), [[0, 2], [20, 22]])
+    self.assertEquals(self.max_running, 2)
+
+  def test_branches_in_transaction_run_one_after_another(self):
+    with transaction.atomic():
+      self.assertEquals(run_branches(self._branch, range(3)), [0, 2, 4])
+    self.assertEquals(set(self.idents), set([threading.current_thread().ident]))
+
+  def test_exceptions_are_raised(self):
+    def branch(x):
+      if x == 1:
+        raise Exception('Branch failed')
+      return x
+    self.assertRaises(Exception, run_branches, branch, range(3))
@@ -0,0 +1,119 @@
+import random
+from unittest import TestCase, skipIf
+from curious import columns, join, settings
+from curious.query import Query
+from curious_tests.models import Blog
+from curious_tests import (
+  test_query_pks,
+  test_query_joins,
+  test_sub_queries,
+  test_api_query,
+  test_query_recursive_sql,
+)
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestColumns(TestCase):
+
+  def test_pairs_iterate_as_python_ints(self):
+    pairs = columns.to_columns([(1, 2), (3, 4)])
+    self.assertEquals(len(pairs), 2)
+    self.assertEquals(list(pairs), [(1, 2), (3, 4)])
+    self.assertEquals([type(x) for t in pairs for x in t], [int]*4)
+
+  def test_inputs_may_all_be_none(self):
+    pairs = columns.to_columns([(1, None), (3, None)])
+    self.assertIsNone(pairs.inputs)
+    self.assertEquals(list(pairs), [(1, None), (3, None)])
+
+  def test_only_integers_are_converted(self):
+    self.assertIsNone(columns.to_columns([]))
+    self.assertIsNone(columns.to_columns([('1', 2)]))
+    self.assertIsNone(columns.to_columns([(1, '2')]))
+    self.assertIsNone(columns.to_columns([(1, None), (2, 1)]))
+    self.assertIsNone(columns.to_columns([(1, 2), (None, 1)]))
+    self.assertIsNone(columns.to_columns([(object(), 1)]))
+
+  def test_unique_keeps_first_of_each(self):
+    pairs = columns.to_columns([(3, 1), (1, 1), (3, 1), (3, 2), (1, 1)])
+    self.assertEquals(list(columns.unique(pairs)), [(3, 1), (1, 1), (3, 2)])
+    pairs = columns.to_columns([(3, None), (1, None), (3, None)])
+    self.assertEquals(list(columns.unique(pairs)), [(3, None), (1, None)])
+
+  def test_hash_join(self):
+    left = [(1, 7), (2, 8), (1, 9)]
+    right = [(10, 1), (20, 2), (30, 3), (10, 1), (40, 1)]
+    self.assertEquals(list(columns.hash_join(columns.to_columns(left), columns.to_columns(right))),
+                      [(10, 7), (10, 9), (20, 8), (40, 7), (40, 9)])
+    left = [(1, None), (2, None)]
+    self.assertEquals(list(columns.hash_join(columns.to_columns(left), columns.to_columns(right))),
+                      [(10, None), (20, None), (40, None)])
+
+  def test_hash_join_matches_list_join(self):
+    rand = random.Random(1)
+    for i in range(20):
+      left = [(rand.randint(0, 50), rand.randint(0, 20)) for j in range(rand.randint(0, 200))]
+      right = [(rand.randint(0, 100), rand.randint(0, 60)) for j in range(rand.randint(1, 200))]
+      if len(left) == 0:
+        continue
+      joined = columns.hash_join(columns.to_columns(left), columns.to_columns(right))
+      self.assertEquals(list(joined), join.hash_join(left, right))
+
+  def test_use_columns(self):
+    size = settings.COLUMNAR_SIZE
+    try:
+      settings.COLUMNAR_SIZE = 3
+      self.assertFalse(columns.use_columns([(1, 1)], [(2, 1)]))
+      self.assertTrue(columns.use_columns([(1, 1)], [(2, 1)]*3))
+      self.assertTrue(columns.use_columns(columns.to_columns([(1, 1)]), [(2, 1)]))
+      settings.COLUMNAR_SIZE = None
+      self.assertFalse(columns.use_columns([(1, 1)], [(2, 1)]*3))
+    finally:
+      settings.COLUMNAR_SIZE = size
+
+  def test_falls_back_to_lists_without_numpy(self):
+    numpy = columns.numpy
+    columns.numpy = None
+    try:
+      self.assertFalse(columns.use_columns([(1, 1)]*100000))
+      joined = Query._extend_result([(1, 7)], Blog, [(10, 1)]*100000)
+      self.assertEquals(joined, [(10, 7)])
+    finally:
+      columns.numpy = numpy
+
+
+class AlwaysColumns(object):
+
+  def setUp(self):
+    self.__size = settings.COLUMNAR_SIZE
+    settings.COLUMNAR_SIZE = 0
+    super(AlwaysColumns, self).setUp()
+
+  def tearDown(self):
+    super(AlwaysColumns, self).tearDown()
+    settings.COLUMNAR_SIZE = self.__size
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestQueryPksColumns(AlwaysColumns, test_query_pks.TestQueryPks):
+  pass
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestQueryJoinsColumns(AlwaysColumns, test_query_joins.TestQueryJoins):
+  pass
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestSubQueriesColumns(AlwaysColumns, test_sub_queries.TestSubQueries):
+  pass
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestQueryAPIColumns(AlwaysColumns, test_api_query.TestQueryAPI):
+  pass
+
+
+@skipIf(columns.numpy is None, 'NumPy is not installed')
+class TestRecursiveQueriesColumns(AlwaysColumns, test_query_recursive_sql.TestRecursiveQueries):
+  pass
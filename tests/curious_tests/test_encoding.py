@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+from django.test import TestCase
+from curious import api, encoding, model_registry, settings
+from curious.api import ModelView
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+class NotDecoded(object):
+  dumps = staticmethod(json.dumps)
+
+  @staticmethod
+  def loads(s):
+    raise Exception('decoded %s' % s)
+
+
+class TestEncoding(TestCase):
+
+  def test_encoded_values_are_spliced(self):
+    value = {'a': [1, 2.5, None, u'caf\xe9', (u'x', True)], 'b': {'c': u'"\x00'}}
+    for encoded in [encoding.encode(value['a']), encoding.Encoded(json.dumps(value['a']))]:
+      self.assertEquals(encoding.dumps(dict(value, a=encoded)), json.dumps(value, sort_keys=True))
+    items = [encoding.encode(v) for v in value['a']]
+    self.assertEquals(encoding.dumps(dict(value, a=encoding.EncodedList(items))),
+                      json.dumps(value, sort_keys=True))
+    self.assertEquals(encoding.dumps(value), json.dumps(value, sort_keys=True))
+
+  def test_strings_like_placeholders_are_kept(self):
+    value = [u'\x00x:0\x00', u'"\\u0000x:0\\u0000"']
+    self.assertEquals(encoding.dumps(value+[encoding.encode(1)]), json.dumps(value+[1]))
+
+  def test_values_are_decoded_when_used(self):
+    encoded = encoding.Encoded('[1, [2, "a"]]')
+    self.assertEquals(encoding.decoded({'x': [encoded]}), {'x': [[1, [2, u'a']]]})
+    self.assertEquals(encoding.encode((1, 'a')).value, (1, 'a'))
+    self.assertEquals(encoding.EncodedList([encoding.encode((1, 'a')), encoded]).value,
+                      [(1, 'a'), [1, [2, u'a']]])
+
+  def test_encoder_is_configurable(self):
+    encoder = settings.JSON_ENCODER
+    settings.JSON_ENCODER = 'json'
+    try:
+      self.assertIs(encoding.encoder(), json)
+    finally:
+      settings.JSON_ENCODER = encoder
+
+  def test_other_objects_are_not_serializable(self):
+    self.assertRaises(TypeError, encoding.dumps, [object()])
+
+
+class TestEncodedResponses(TestCase):
+
+  def setUp(self):
+    blog = Blog.objects.create(name=u'Caf\xe9 "quotes"')
+    self.entries = [Entry.objects.create(blog=blog, headline=u'Entry ☃ %d' % i) for i in range(5)]
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+
+  def tearDown(self):
+    model_registry.clear()
+    api.cache.clear()
+
+  def _post(self, entries):
+    data = json.dumps(dict(ids=[e.pk for e in entries], app='app'))
+    r = self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+    return r.content
+
+  def test_responses_are_the_same_as_encoding_values(self):
+    objects = ModelView.get_objects_as_json(Entry, [e.pk for e in self.entries], False, True, False,
+                                            None)
+    expected = json.dumps({'result': objects}, sort_keys=True)
+    self._post(self.entries[1:3])
+    # partly cached, then all cached
+    self.assertEquals(self._post(self.entries), expected)
+    self.assertEquals(self._post(self.entries), expected)
+
+  def test_cached_objects_are_not_decoded(self):
+    self._post(self.entries)
+    encoding.json = NotDecoded
+    try:
+      content = self._post(self.entries)
+    finally:
+      encoding.json = json
+    self.assertEquals(len(json.loads(content)['result']['objects']), 5)
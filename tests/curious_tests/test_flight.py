@@ -0,0 +1,106 @@
+import threading
+from unittest import TestCase
+from curious import flight, settings
+
+
+class LookupCounter(dict):
+
+  lookups = 0
+
+  def get(self, key):
+    self.lookups += 1
+    return dict.get(self, key)
+
+
+class TestSingleFlight(TestCase):
+
+  def setUp(self):
+    flight.cache.clear()
+    self.__timeout = settings.SINGLE_FLIGHT_TIMEOUT
+    self.__poll = flight.POLL_INTERVAL
+    flight.POLL_INTERVAL = 0.01
+
+  def tearDown(self):
+    settings.SINGLE_FLIGHT_TIMEOUT = self.__timeout
+    flight.POLL_INTERVAL = self.__poll
+    flight.cache.clear()
+
+  def test_threads_share_result_of_first(self):
+    release = threading.Event()
+    calls = []
+
+    def f():
+      calls.append(1)
+      release.wait(5)
+      return 'result'
+
+    results = []
+
+    def request():
+      results.append(flight.run('key', f, lambda: None))
+
+    flights = flight._flights
+    flight._flights = LookupCounter()
+    try:
+      threads = [threading.Thread(target=request) for i in range(6)]
+      for t in threads:
+        t.start()
+      # every thread found the flight of the first before it is done
+      while flight._flights.lookups < 6:
+        release.wait(0.01)
+      release.set()
+      for t in threads:
+        t.join(5)
+    finally:
+      flight._flights = flights
+
+    self.assertEquals(len(calls), 1)
+    self.assertItemsEqual(results, [('result', True)]+[('result', False)]*5)
+    self.assertIsNone(flight.cache.get(flight._lock_key('key')))
+
+  def test_errors_are_raised_in_every_waiting_thread(self):
+    release = threading.Event()
+    errors = []
+
+    def f():
+      release.wait(5)
+      raise Exception('failed')
+
+    def request():
+      try:
+        flight.run('key', f, lambda: None)
+      except Exception as e:
+        errors.append(str(e))
+
+    threads = [threading.Thread(target=request) for i in range(3)]
+    for t in threads:
+      t.start()
+    release.set()
+    for t in threads:
+      t.join(5)
+    self.assertEquals(errors, ['failed']*3)
+    self.assertEquals(flight._flights, {})
+
+  def test_waits_for_result_of_other_process(self):
+    flight.cache.add(flight._lock_key('key'), True)
+    polls = []
+
+    def get():
+      polls.append(1)
+      return 'result' if len(polls) == 3 else None
+
+    self.assertEquals(flight.run('key', lambda: 'mine', get), ('result', False))
+
+  def test_computes_once_other_process_is_done_without_result(self):
+    flight.cache.add(flight._lock_key('key'), True)
+
+    def get():
+      flight.cache.delete(flight._lock_key('key'))
+
+    self.assertEquals(flight.run('key', lambda: 'mine', get), ('mine', True))
+
+  def test_waiting_times_out(self):
+    settings.SINGLE_FLIGHT_TIMEOUT = 0.05
+    flight.cache.add(flight._lock_key('key'), True)
+    self.assertRaises(flight.Timeout, flight.run, 'key', lambda: 'mine', lambda: None)
+    self.assertEquals(flight._flights, {})
@@ -0,0 +1,112 @@
+from django.db import connection
+from django.test import TestCase
+from curious import settings, frontier
+from curious.graph import traverse_pks
+from curious_tests.models import Blog, Entry
+from curious_tests import test_graph_fk, test_graph_m2m, test_query_recursive_sql
+
+
+class FrontierSizes(object):
+  CHUNK_SIZE = 2
+  TABLE_SIZE = 1000
+
+  def setUp(self):
+    self.__sizes = (settings.FRONTIER_CHUNK_SIZE, settings.FRONTIER_TABLE_SIZE)
+    settings.FRONTIER_CHUNK_SIZE = self.CHUNK_SIZE
+    settings.FRONTIER_TABLE_SIZE = self.TABLE_SIZE
+    super(FrontierSizes, self).setUp()
+
+  def tearDown(self):
+    super(FrontierSizes, self).tearDown()
+    settings.FRONTIER_CHUNK_SIZE, settings.FRONTIER_TABLE_SIZE = self.__sizes
+
+
+class ChunkedFrontiers(FrontierSizes):
+  pass
+
+
+class TableFrontiers(FrontierSizes):
+  TABLE_SIZE = 2
+
+
+class TestFrontier(FrontierSizes, TestCase):
+
+  def setUp(self):
+    super(TestFrontier, self).setUp()
+    self.blogs = [Blog.objects.create(name='Blog %d' % i) for i in range(5)]
+    self.entries = [Entry.objects.create(blog=blog, headline='Entry %d' % j)
+                    for blog in self.blogs for j in range(2)]
+
+  def _fetch(self, values, chunk=True):
+    calls = []
+
+    def f(rhs):
+      calls.append(rhs)
+      return Entry.objects.filter(blog__in=rhs).values_list('pk', flat=True)
+    return sorted(frontier.fetch(Entry, values, f, chunk=chunk)), calls
+
+  def test_small_frontier_is_passed_as_is(self):
+    pks, calls = self._fetch([self.blogs[0].pk, self.blogs[1].pk])
+    self.assertEquals(pks, sorted(e.pk for e in self.entries[:4]))
+    self.assertEquals(calls, [[self.blogs[0].pk, self.blogs[1].pk]])
+
+  def test_frontier_is_split_into_chunks(self):
+    pks, calls = self._fetch([blog.pk for blog in self.blogs])
+    self.assertEquals(pks, sorted(e.pk for e in self.entries))
+    self.assertEquals(len(calls), 3)
+
+  def test_frontier_is_not_split_if_results_are_not_independent(self):
+    pks, calls = self._fetch([blog.pk for blog in self.blogs], chunk=False)
+    self.assertEquals(pks, sorted(e.pk for e in self.entries))
+    self.assertEquals(len(calls), 1)
+
+  def test_large_frontier_uses_temporary_table(self):
+    settings.FRONTIER_TABLE_SIZE = 3
+    pks, calls = self._fetch([blog.pk for blog in self.blogs], chunk=False)
+    self.assertEquals(pks, sorted(e.pk for e in self.entries))
+    self.assertEquals(len(calls), 1)
+    self.assertNotEquals(type(calls[0]), list)
+    # temporary table is emptied after use
+    with connection.cursor() as cursor:
+      cursor.execute('SELECT COUNT(*) FROM %s' % frontier.TEMP_TABLE)
+      self.assertEquals(cursor.fetchone()[0], 0)
+
+  def test_large_frontier_of_model_instances(self):
+    settings.FRONTIER_TABLE_SIZE = 3
+    pairs, model = traverse_pks(self.blogs, Blog, Blog.entry_set)
+    self.assertEquals(model, Entry)
+    self.assertItemsEqual(pairs, [(e.pk, e.blog_id) for e in self.entries])
+
+  def test_to_sql(self):
+    self.assertEquals(frontier.to_sql([1, 2]), ('%s, %s', [1, 2]))
+    with frontier.large_frontier(Blog, [1, 2, 3]) as rhs:
+      sql, params = frontier.to_sql(rhs)
+    self.assertEquals(sql, 'SELECT value FROM %s WHERE frontier = %%s' % frontier.TEMP_TABLE)
+    self.assertEquals(len(params), 1)
+
+
+class TestFKChunked(ChunkedFrontiers, test_graph_fk.TestFK):
+  pass
+
+
+class TestFKTable(TableFrontiers, test_graph_fk.TestFK):
+  pass
+
+
+class TestM2MChunked(ChunkedFrontiers, test_graph_m2m.TestM2M):
+  pass
+
+
+class TestM2MTable(TableFrontiers, test_graph_m2m.TestM2M):
+  pass
+
+
+class TestRecursiveQueriesChunked(ChunkedFrontiers, test_query_recursive_sql.TestRecursiveQueries):
+  # counts queries
+  test_uses_one_query = None
+  test_loop_fetches_each_level_once = None
+
+
+class TestRecursiveQueriesTable(TableFrontiers, test_query_recursive_sql.TestRecursiveQueries):
+  test_uses_one_query = None
+  test_loop_fetches_each_level_once = None
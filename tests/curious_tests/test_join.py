@@ -0,0 +1,36 @@
+from unittest import TestCase
+from curious import join
+
+
+class Node(object):
+  def __init__(self, pk):
+    self.pk = pk
+
+
+class TestJoin(TestCase):
+
+  def test_unique_keeps_first_of_each(self):
+    self.assertEquals(join.unique([3, 1, 3, 2, 1]), [3, 1, 2])
+
+  def test_difference(self):
+    self.assertEquals(join.difference([(1, 1), (2, 1), (1, 1), (3, 1)], [(2, 1)]), [(1, 1), (3, 1)])
+
+  def test_hash_join(self):
+    left = [(1, 'a'), (2, 'b'), (1, 'c')]
+    right = [(10, 1), (20, 2), (30, 3), (10, 1), (40, 1)]
+    self.assertEquals(join.hash_join(left, right),
+                      [(10, 'a'), (10, 'c'), (20, 'b'), (40, 'a'), (40, 'c')])
+
+  def test_hash_join_with_key(self):
+    nodes = [Node(1), Node(2)]
+    left = [(nodes[0], 'a'), (nodes[1], 'b')]
+    self.assertEquals(join.hash_join(left, [(10, 2), (20, 1)], lambda node: node.pk),
+                      [(10, 'b'), (20, 'a')])
+
+  def test_semi_join_and_anti_join(self):
+    pairs = [(1, 'a'), (2, 'b'), (1, 'a'), (3, 'c')]
+    self.assertEquals(join.semi_join(pairs, [1, 3]), [(1, 'a'), (3, 'c')])
+    self.assertEquals(join.anti_join(pairs, [1, 3]), [(2, 'b')])
+    nodes = [(Node(1), 'a'), (Node(2), 'b')]
+    self.assertEquals(join.semi_join(nodes, set([2]), lambda node: node.pk), [nodes[1]])
+    self.assertEquals(join.anti_join(nodes, set([2]), lambda node: node.pk), [nodes[0]])
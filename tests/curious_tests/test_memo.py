@@ -0,0 +1,99 @@
+from django.test import TestCase
+from curious import model_registry, settings, memo
+from curious.graph import traverse_pks
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+import curious_tests.models
+
+
+class TestEdgeMemo(TestCase):
+
+  def setUp(self):
+    self.calls = []
+
+  def _f(self, nodes):
+    self.calls.append(sorted(nodes))
+    return [(node*10+i, node) for node in nodes for i in range(node % 3)]
+
+  def test_fetches_each_node_once(self):
+    edges = memo.EdgeMemo()
+    self.assertItemsEqual(edges.fetch('k', [1, 2, 2], self._f, lambda row: row[1]),
+                          [(10, 1), (20, 2), (21, 2)])
+    self.assertItemsEqual(edges.fetch('k', [2, 3, 4], self._f, lambda row: row[1]),
+                          [(20, 2), (21, 2), (40, 4)])
+    self.assertEquals(self.calls, [[1, 2], [3, 4]])
+    self.assertEquals(edges.rows_saved, 2)
+    # nothing missing, nothing to fetch
+    self.assertItemsEqual(edges.fetch('k', [3, 1], self._f, lambda row: row[1]), [(10, 1)])
+    self.assertEquals(len(self.calls), 2)
+    self.assertEquals(edges.rows_saved, 3)
+
+  def test_keys_are_separate(self):
+    edges = memo.EdgeMemo()
+    edges.fetch('k', [1], self._f, lambda row: row[1])
+    edges.fetch('l', [1], self._f, lambda row: row[1])
+    self.assertEquals(self.calls, [[1], [1]])
+
+  def test_memo_is_only_used_while_executing(self):
+    memo.fetch('k', [1], self._f)
+    memo.fetch('k', [1], self._f)
+    self.assertEquals(len(self.calls), 2)
+    with memo.execution() as edges:
+      memo.fetch('k', [1], self._f)
+      memo.fetch('k', [1], self._f)
+      memo.fetch(None, [1], self._f)
+    self.assertEquals(len(self.calls), 4)
+    self.assertEquals(edges.rows_saved, 1)
+    self.assertIsNone(memo.current())
+
+
+class TestQueryMemo(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(3)]
+    self.authors = [Author.objects.create(name='Author %d' % i) for i in range(4)]
+    for i in range(4):
+      self.authors[i].friends.add(self.authors[(i+1)%4])
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    settings.EDGE_MEMO = True
+    settings.RECURSIVE_QUERIES = True
+
+  def _run(self, qs, edge_memo):
+    settings.EDGE_MEMO = edge_memo
+    query = Query(qs)
+    return query.pks(), query.rows_saved
+
+  def test_subquery_repeating_a_step_uses_memo(self):
+    qs = 'Blog(%s) ?(Blog.entry_set(headline__icontains="Entry")) '\
+         'Blog.entry_set(headline__icontains="Entry")' % self.blog.pk
+    with self.assertNumQueries(3):
+      expected, saved = self._run(qs, False)
+    self.assertEquals(saved, 0)
+    with self.assertNumQueries(2):
+      result, saved = self._run(qs, True)
+    self.assertEquals(saved, 3)
+    self.assertEquals(result, expected)
+
+  def test_paging_filters_are_not_memoized(self):
+    qs = 'Blog(%s) ?(Blog.entry_set.limit(1)) Blog.entry_set.limit(1)' % self.blog.pk
+    with self.assertNumQueries(3):
+      result, saved = self._run(qs, True)
+    self.assertEquals(saved, 0)
+
+  def test_recursion_uses_memo(self):
+    settings.RECURSIVE_QUERIES = False
+    qs = 'Author(name__startswith="Author"), Author.friends*'
+    expected, saved = self._run(qs, False)
+    result, saved = self._run(qs, True)
+    self.assertEquals([(set(r[0]), r[1], r[3]) for r in result[0]],
+                      [(set(r[0]), r[1], r[3]) for r in expected[0]])
+    self.assertGreater(saved, 0)
+
+  def test_memo_is_per_execution(self):
+    pairs, model = traverse_pks([self.blog.pk], Blog, Blog.entry_set)
+    with self.assertNumQueries(1):
+      pairs, model = traverse_pks([self.blog.pk], Blog, Blog.entry_set)
@@ -1,4 +1,6 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from curious import model_registry
 from curious.query import Query
 from curious_tests.models import Blog, Entry, Author, Comment
@@ -104,3 +106,23 @@ class TestSubQueries(TestCase):
     assertQueryResultsEqual(self, result[0][0][0], [(self.blogs[0], None)])
     self.assertEquals(result[0][1], ([], 0, None))
     self.assertEquals(result[0][2], ([], 1, None))
+
+  def test_or_branches_of_chains_use_one_union_query(self):
+    qs = 'Blog(%s) ' % self.blogs[0].pk +\
+         '(Blog.entry_set(headline__icontains="MySQL") Entry.authors) | ' +\
+         '(Blog.entry_set(headline__icontains="Postgres") Entry.authors(name__icontains="Jane"))'
+    with CaptureQueriesContext(connection) as queries:
+      result, last_model = Query(qs).pks()
+    self.assertEquals(len(queries), 2)
+    self.assertIn('UNION', queries[1]['sql'])
+    self.assertItemsEqual(result[0][0], [(self.authors[0].pk, None), (self.authors[1].pk, None)])
+    self.assertEquals(last_model, Author)
+
+  def test_or_branches_mixing_chains_and_relationship_functions(self):
+    model_registry.get_manager('Blog').allowed_relationships = ['authors']
+    qs = 'Blog(%s) ' % self.blogs[0].pk +\
+         '(Blog.entry_set(headline__icontains="Neo4J") Entry.authors) | '\
+         '(Blog.authors(name__icontains="John"))'
+    result, last_model = Query(qs).pks()
+    self.assertItemsEqual(result[0][0], [(self.authors[0].pk, None), (self.authors[2].pk, None)])
+    self.assertEquals(last_model, Author)
@@ -1,5 +1,6 @@
 from django.test import TestCase
 from curious.query import Parser
+from curious.parser import ParseCache, parse_cache
 import humanize
 
 
@@ -200,3 +201,49 @@ class TestDateTimeParsing(TestCase):
     self.assertEquals(t.year, 2014)
     self.assertEquals(t.month, 8)
     self.assertEquals(t.day, 22)
+
+
+class TestParseCache(TestCase):
+
+  def setUp(self):
+    parse_cache.clear()
+
+  def tearDown(self):
+    parse_cache.clear()
+
+  def test_reuses_parsed_query(self):
+    Parser('A(1) B.b(a=1)')
+    self.assertEquals(parse_cache.hits, 0)
+    self.assertEquals(parse_cache.misses, 1)
+
+    p = Parser('A(1) B.b(a=1)')
+    self.assertEquals(parse_cache.hits, 1)
+    self.assertEquals(parse_cache.misses, 1)
+    self.assertEquals(p.steps, [{'model': 'B', 'method': 'b',
+                                 'filters': [{'method': 'filter', 'kwargs': {'a': 1}}]}])
+
+  def test_returns_copies_of_parsed_query(self):
+    p = Parser('A(1) B.b(d=[1,2])')
+    p.steps[0]['filters'][0]['kwargs']['d'].append(3)
+    p.steps.append({})
+
+    p = Parser('A(1) B.b(d=[1,2])')
+    self.assertEquals(p.steps, [{'model': 'B', 'method': 'b',
+                                 'filters': [{'method': 'filter', 'kwargs': {'d': [1, 2]}}]}])
+
+  def test_does_not_cache_relative_dates(self):
+    Parser('A(1) B.b(a=t"3 days ago")')
+    Parser('A(1) B.b(a=t"3 days ago")')
+    self.assertEquals(parse_cache.hits, 0)
+    self.assertEquals(len(parse_cache), 0)
+
+  def test_evicts_least_recently_used(self):
+    cache = ParseCache(2)
+    cache.set('a', [1])
+    cache.set('b', [2])
+    cache.get('a')
+    cache.set('c', [3])
+    self.assertEquals(cache.get('a'), [1])
+    self.assertEquals(cache.get('b'), None)
+    self.assertEquals(cache.get('c'), [3])
+    self.assertEquals(cache.stats(), dict(hits=3, misses=1, size=2, max_size=2))
@@ -0,0 +1,107 @@
+from django.test import TestCase
+from curious import settings
+from curious.parser import GRAMMAR, ASTBuilder, parse_cache
+from curious.rdparser import RDParser
+from curious_tests import test_parser
+
+
+class RDBackend(object):
+
+  def setUp(self):
+    self.__backend = settings.PARSER_BACKEND
+    settings.PARSER_BACKEND = 'rd'
+    parse_cache.clear()
+    super(RDBackend, self).setUp()
+
+  def tearDown(self):
+    super(RDBackend, self).tearDown()
+    settings.PARSER_BACKEND = self.__backend
+    parse_cache.clear()
+
+
+class TestParserCoreRD(RDBackend, test_parser.TestParserCore):
+  pass
+
+
+class TestDateTimeParsingRD(RDBackend, test_parser.TestDateTimeParsing):
+  pass
+
+
+class TestParseCacheRD(RDBackend, test_parser.TestParseCache):
+  pass
+
+
+class TestBackendsAgree(TestCase):
+
+  QUERIES = [
+    'A(1)',
+    'A( 1 )',
+    'A(1abc)',
+    'A',
+    'A ',
+    'A(1)\n',
+    'A(1) \n',
+    'A(a=1)',
+    'A.first(10)',
+    'A(a=1).exclude(b=2).count(c)',
+    'A(1)B.b',
+    'A(1) B.b C.c',
+    'A(1), B.b, C.c',
+    'A(1) ,B.b',
+    'A(1) B.b(a=1, b="2", c=True, d=[1,2, 3], e=None, f=-1, g=1.5, h=-0.25)',
+    'A(1) B.b( a = 1 , b = \'x y\' )',
+    'A(1) B.b(a=[ ], b=( ), c=(1, 2], d=[ "a" ,\'b\' ])',
+    'A(1) B.b(a=r"^x.*$", b="(a|b)")',
+    'A(1) B.b(name).max(age).first(10).last(-2)',
+    'A(1) B.b(True)',
+    'A(1) B.b* C.c** D.d$ E.e?',
+    'A(1) B.b?(B.c)',
+    'A(1) B.b ?(B.c)',
+    'A(1) B.b +(B.c C.d) -(B.e)',
+    'A(1) B.b(B.c)',
+    'A(1) (B.c)|(B.d)',
+    'A(1), (B.c) | (B.d)  |  (B.e B.f)',
+    'A(1) ((B.c)|(B.d))',
+    'A(1) ((B.c (C.d)|(C.e))|(B.f))',
+    'A(1) B.b.exclude(x__in=[1,2])*',
+    # not valid queries
+    '',
+    'A(1) B.b ',
+    'A(1) B.b \n',
+    'A(1)\n\n',
+    'A(1) B.b(x=12.5)',
+    'A(1) B.b(x=1.5abc)',
+    'A(1) B.b(x=Truex)',
+    'A(1) B.b(x=T"today")',
+    'A(1) B.b (x=1)',
+    'A(1) B.b(x=1 ',
+    'A(1) , (B.c)',
+    'A(1) + (B.c)',
+    'A(1) ( B.c)',
+    'A(1) (B.c )',
+    'A(1) (B.c (C.d))',
+    'A(1) B.b***',
+    'A(-1)',
+    'A(1.5)',
+    'A(1).exclude(a=1)',
+    'A(1) B',
+    '1A(1)',
+    'A(1) B.b(x=1) & C.c',
+    'A(1) B.b(first(1))',
+  ]
+
+  def _parse(self, parse, code):
+    try:
+      return parse(code)
+    except Exception:
+      return 'error'
+
+  def test_backends_produce_same_queries(self):
+    for code in TestBackendsAgree.QUERIES:
+      peg = self._parse(lambda s: ASTBuilder().visit(GRAMMAR.parse(s)), code)
+      rd = self._parse(lambda s: RDParser(s).parse(), code)
+      self.assertEquals(peg, rd, 'Backends disagree on %r: %r vs %r' % (code, peg, rd))
+
+  def test_invalid_queries_are_invalid(self):
+    self.assertEquals(self._parse(lambda s: RDParser(s).parse(), 'A(1) B.b '), 'error')
+    self.assertNotEquals(self._parse(lambda s: RDParser(s).parse(), 'A(1) B.b'), 'error')
@@ -0,0 +1,126 @@
+from django.test import TestCase
+from curious import model_registry
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author, Person, Publisher, Book
+from curious_tests import assertQueryResultsEqual
+import curious_tests.models
+
+class TestQueryChains(TestCase):
+
+  def setUp(self):
+    names = ('Databases', 'Relational Databases', 'Graph Databases')
+    authors = ('John Smith', 'Jane Doe', 'Joe Plummer')
+    headlines = ('MySQL is a relational DB',
+                 'Postgres is a really good relational DB',
+                 'Neo4J is a graph DB')
+
+    self.blogs = [Blog(name=name) for name in names]
+    for blog in self.blogs:
+      blog.save()
+
+    self.entries = [Entry(headline=headline, blog=blog)
+                    for headline, blog in zip(headlines, self.blogs)]
+    for entry in self.entries:
+      entry.save()
+
+    self.people = [Person(gender='F') for name in authors]
+    for person in self.people:
+      person.save()
+
+    self.authors = [Author(name=name, age=20+i, person=person)
+                    for i, (name, person) in enumerate(zip(authors, self.people))]
+    for author in self.authors:
+      author.save()
+
+    for i, entry in enumerate(self.entries):
+      entry.authors.add(self.authors[i])
+      entry.authors.add(self.authors[(i+1)%len(self.authors)])
+
+    model_registry.register(curious_tests.models)
+    model_registry.get_manager('Blog').allowed_relationships = ['authors']
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_chain_of_relationships_uses_one_query(self):
+    qs = 'Blog(name__icontains="Databases"), Blog.entry_set Entry.authors Author.person'
+    query = Query(qs)
+    # one query for the starting objects, one for the chain
+    with self.assertNumQueries(2):
+      result = query()
+    assertQueryResultsEqual(self, result[0][1][0], [(self.people[0], self.blogs[0].pk),
+                                                    (self.people[1], self.blogs[0].pk),
+                                                    (self.people[1], self.blogs[1].pk),
+                                                    (self.people[2], self.blogs[1].pk),
+                                                    (self.people[2], self.blogs[2].pk),
+                                                    (self.people[0], self.blogs[2].pk)])
+    self.assertEquals(result[1], Person)
+
+  def test_chain_applies_filters_along_the_chain(self):
+    qs = 'Blog(name__icontains="Databases"), Blog.entry_set(headline__icontains="relational") '\
+         'Entry.authors(age__gt=20) Author.person.exclude(id=%s)' % self.people[2].pk
+    query = Query(qs)
+    with self.assertNumQueries(2):
+      result = query()
+    assertQueryResultsEqual(self, result[0][1][0], [(self.people[1], self.blogs[0].pk),
+                                                    (self.people[1], self.blogs[1].pk)])
+
+  def test_chain_is_same_as_step_by_step_traversal(self):
+    query = Query('Blog(name__icontains="Databases"), '
+                  'Blog.entry_set Entry.authors Author.entry_set')
+    with self.assertNumQueries(2):
+      chained = query()
+
+    plan = Query._plan
+    Query._plan = staticmethod(lambda steps: steps)
+    try:
+      with self.assertNumQueries(4):
+        separate = query()
+    finally:
+      Query._plan = staticmethod(plan)
+
+    self.assertEquals(len(chained[0]), 2)
+    assertQueryResultsEqual(self, chained[0][1][0], separate[0][1][0])
+
+  def test_chain_stops_at_custom_relationship_functions(self):
+    qs = 'Entry(blog__name__icontains="Databases") Entry.blog Blog.authors Author.person'
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(len(steps), 3)
+    self.assertEquals(['chain' in step for step in steps], [False, False, False])
+    qs = 'Entry(blog__name__icontains="Databases") Entry.blog Blog.entry_set Entry.authors'
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(len(steps), 1)
+    self.assertEquals(len(steps[0]['chain']), 3)
+
+  def test_chain_stops_at_paging_and_exclusions_in_the_middle(self):
+    qs = 'Blog(1) Blog.entry_set.exclude(id=1) Entry.authors Author.person.first(1)'
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(len(steps), 3)
+    qs = 'Blog(1) Blog.entry_set(blog__name="x") Entry.authors Author.person'
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(len(steps), 2)
+    self.assertEquals(len(steps[1]['chain']), 2)
+
+  def test_chain_does_not_hide_type_mismatch(self):
+    qs = 'Blog(%s) Blog.entry_set Blog.entry_set' % self.blogs[0].pk
+    query = Query(qs)
+    self.assertRaises(Exception, query)
+
+  def test_chain_stops_at_repeated_filters_in_the_middle(self):
+    qs = 'Blog(%s) Blog.entry_set(headline__icontains="a").filter(headline__icontains="l") '\
+         'Entry.authors' % self.blogs[0].pk
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(['chain' in step for step in steps], [False, False])
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(self.authors[0], None),
+                                                    (self.authors[1], None)])
+
+  def test_chain_stops_at_fk_to_other_than_pk(self):
+    publishers = [Publisher.objects.create(code='p%d' % i) for i in range(2)]
+    for publisher in publishers:
+      Book.objects.create(publisher=publisher, title='Book of %s' % publisher.code)
+    qs = 'Publisher(%s), Publisher.books Book.publisher' % publishers[1].pk
+    steps = Query._plan(Query(qs)._Query__steps)
+    self.assertEquals(['chain' in step for step in steps], [False, False])
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][1][0], [(publishers[1], publishers[1].pk)])
@@ -0,0 +1,78 @@
+from django.test import TestCase
+from curious import model_registry
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+from curious_tests import assertQueryResultsEqual
+import curious_tests.models
+
+class TestQueryPks(TestCase):
+
+  def setUp(self):
+    names = ('Databases', 'Relational Databases', 'Graph Databases')
+    authors = ('John Smith', 'Jane Doe', 'Joe Plummer')
+    headlines = ('MySQL is a relational DB',
+                 'Postgres is a really good relational DB',
+                 'Neo4J is a graph DB')
+
+    self.blogs = [Blog(name=name) for name in names]
+    for blog in self.blogs:
+      blog.save()
+
+    self.entries = [Entry(headline=headline, blog=blog)
+                    for headline, blog in zip(headlines, self.blogs)]
+    for entry in self.entries:
+      entry.save()
+
+    self.authors = [Author(name=name, age=20+i) for i, name in enumerate(authors)]
+    for author in self.authors:
+      author.save()
+
+    for i, entry in enumerate(self.entries):
+      entry.authors.add(self.authors[i])
+
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_returns_pks_and_models_of_results(self):
+    qs = 'Blog(name__icontains="Databases") '\
+         'Blog.entry_set(headline__icontains="relational"), Entry.authors'
+    result, last_model = Query(qs).pks()
+    self.assertEquals(last_model, Author)
+    self.assertEquals(len(result), 2)
+
+    pk_src, join_index, tree, model = result[0]
+    self.assertEquals(model, Entry)
+    self.assertEquals(join_index, -1)
+    self.assertItemsEqual(pk_src, [(self.entries[0].pk, None), (self.entries[1].pk, None)])
+
+    pk_src, join_index, tree, model = result[1]
+    self.assertEquals(model, Author)
+    self.assertEquals(join_index, 0)
+    self.assertItemsEqual(pk_src, [(self.authors[0].pk, self.entries[0].pk),
+                                   (self.authors[1].pk, self.entries[1].pk)])
+
+  def test_left_join_without_results_has_no_model(self):
+    qs = 'Blog(name="Graph Databases"), '\
+         'Blog.entry_set(headline__icontains="relational") ?(Entry.authors)'
+    result, last_model = Query(qs).pks()
+    self.assertEquals(last_model, None)
+    self.assertEquals(result[1][3], None)
+
+  def test_does_not_fetch_objects_between_steps(self):
+    qs = 'Blog(name__icontains="Databases") Blog.entry_set, Entry.authors'
+    query = Query(qs)
+    # starting objects, then one query per relationship, each returning pks
+    with self.assertNumQueries(3):
+      result, last_model = query.pks()
+    self.assertItemsEqual([pk for pk, src in result[1][0]], [a.pk for a in self.authors])
+
+  def test_objects_from_call_are_built_from_pks(self):
+    qs = 'Blog(name__icontains="Databases") Blog.entry_set Entry.authors'
+    query = Query(qs)
+    # starting objects, then the chain; no query to fetch authors
+    with self.assertNumQueries(2):
+      result, last_model = query()
+    assertQueryResultsEqual(self, result[0][0], [(author, None) for author in self.authors])
+    self.assertEquals(last_model, Author)
@@ -0,0 +1,161 @@
+from django.test import TestCase
+from curious import model_registry, settings
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+from curious_tests import test_query_recursive, test_query_self_fk, test_query_self_m2m
+import curious_tests.models
+
+class TestRecursiveQueries(TestCase):
+
+  def setUp(self):
+    blog = Blog(name='Databases')
+    blog.save()
+    self.blog = blog
+
+    headlines = ('MySQL is a relational DB',
+                 'Postgres is a relational DB',
+                 'Neo4J is a graph DB',
+                 'But we are not comparing relational and graph DBs',
+                 'Relational DBs are graph DBs',
+                 'SQL Server is also a relational DB')
+
+    self.entries = [Entry(headline=headline, blog=blog) for headline in headlines]
+    for entry in self.entries:
+      entry.save()
+
+    # 0 <- 1 <- 2 <- 3, and 1 <- 4 <- 5
+    for i, parent in ((1, 0), (2, 1), (3, 2), (4, 1), (5, 4)):
+      self.entries[i].response_to = self.entries[parent]
+      self.entries[i].save()
+
+    # friends form a loop, plus one more friend
+    self.authors = [Author(name='Author %d' % i, age=20+i) for i in range(5)]
+    for author in self.authors:
+      author.save()
+    for i in range(4):
+      self.authors[i].friends.add(self.authors[(i+1)%4])
+    self.authors[2].friends.add(self.authors[4])
+
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    settings.RECURSIVE_QUERIES = True
+
+  def _run(self, qs, recursive_queries, marked_steps=True):
+    settings.RECURSIVE_QUERIES = recursive_queries
+    marked_step = Query._marked_step
+    if not marked_steps:
+      Query._marked_step = staticmethod(lambda *args, **kwargs: None)
+    try:
+      result, last_model = Query(qs).pks()
+    finally:
+      Query._marked_step = staticmethod(marked_step)
+    return [(set(pk_src), join_index, set(tree or []), model)
+            for pk_src, join_index, tree, model in result], last_model
+
+  def assertSameAsLoop(self, qs):
+    expected = self._run(qs, False, False)
+    self.assertEquals(self._run(qs, True), expected, qs)
+    self.assertEquals(self._run(qs, False), expected, qs)
+
+  def test_fk_to_self(self):
+    e = self.entries
+    for rel in ('Entry.responses', 'Entry.response_to'):
+      for start in (e[0].pk, e[3].pk, e[5].pk):
+        for recursion in ('*', '**', '$', '?'):
+          for f in ('', '(headline__icontains="relational")',
+                    '.exclude(headline__icontains="graph")', '(authors__name="Nobody")',
+                    '.exclude(blog__name="Databases")'):
+            self.assertSameAsLoop('Entry(%s) %s%s%s' % (start, rel, f, recursion))
+
+  def test_m2m_to_self_with_loops(self):
+    for start in (self.authors[0].pk, self.authors[4].pk):
+      for recursion in ('*', '**', '$', '?'):
+        for f in ('', '(age__gt=20)', '(age__lt=23)', '(age=22)'):
+          self.assertSameAsLoop('Author(%s) Author.friends%s%s' % (start, f, recursion))
+
+  def test_many_starting_objects_and_joins(self):
+    for recursion in ('*', '**', '$', '?'):
+      for f in ('', '(headline__icontains="relational")'):
+        self.assertSameAsLoop('Blog(%s) Blog.entry_set, Entry.responses%s%s' %
+                              (self.blog.pk, f, recursion))
+        self.assertSameAsLoop('Blog(%s), Blog.entry_set Entry.response_to%s%s Entry.blog' %
+                              (self.blog.pk, f, recursion))
+
+  def test_many_starting_objects_of_initial_query(self):
+    for start in ((0, 1), (0, 2, 4), (1, 4), (2, 3, 4)):
+      entries = ','.join(str(self.entries[i].pk) for i in start)
+      authors = ','.join(str(self.authors[i].pk) for i in start)
+      for recursion in ('*', '**', '$', '?'):
+        for f in ('', '(headline__icontains="relational")', '(headline__icontains="graph")'):
+          self.assertSameAsLoop('Entry(id__in=[%s]) Entry.responses%s%s' % (entries, f, recursion))
+          self.assertSameAsLoop('Entry(id__in=[%s]) Entry.response_to%s%s' %
+                                (entries, f, recursion))
+        for f in ('', '(age__gt=21)', '(age=22)'):
+          self.assertSameAsLoop('Author(id__in=[%s]) Author.friends%s%s' % (authors, f, recursion))
+
+  def test_uses_one_query(self):
+    qs = 'Entry(%s) Entry.responses(headline__icontains="relational")**' % self.entries[0].pk
+    # one query for the starting objects, one for the recursion
+    with self.assertNumQueries(2):
+      result, last_model = Query(qs).pks()
+    self.assertItemsEqual([pk for pk, src in result[0][0]],
+                          [self.entries[i].pk for i in (0, 1, 3, 4, 5)])
+    self.assertItemsEqual(result[0][2], [(self.entries[1].pk, self.entries[0].pk),
+                                         (self.entries[3].pk, self.entries[2].pk),
+                                         (self.entries[4].pk, self.entries[1].pk),
+                                         (self.entries[5].pk, self.entries[4].pk)])
+
+  def test_uses_one_query_when_filters_limit_traversal(self):
+    for recursion in ('*', '$'):
+      qs = 'Entry(%s) Entry.responses(headline__icontains="relational")%s' %\
+           (self.entries[0].pk, recursion)
+      with self.assertNumQueries(2):
+        Query(qs).pks()
+
+  def test_filtering_search_falls_back_to_loop(self):
+    qs = 'Entry(%s) Entry.responses(headline__icontains="graph")?' % self.entries[0].pk
+    # starting objects, filtering starting objects, then one query for each of
+    # the two levels
+    with self.assertNumQueries(4):
+      result, last_model = Query(qs).pks()
+    self.assertItemsEqual([pk for pk, src in result[0][0]],
+                          [self.entries[i].pk for i in (2, 4)])
+
+  def test_loop_fetches_each_level_once(self):
+    settings.RECURSIVE_QUERIES = False
+    qs = 'Entry(%s) Entry.responses(headline__icontains="relational")**' % self.entries[0].pk
+    # starting objects, filtering starting objects, then one query for each of
+    # the four levels
+    with self.assertNumQueries(6):
+      result, last_model = Query(qs).pks()
+    self.assertItemsEqual([pk for pk, src in result[0][0]],
+                          [self.entries[i].pk for i in (0, 1, 3, 4, 5)])
+
+  def test_relationship_to_other_model_still_fails(self):
+    qs = 'Blog(%s) Blog.entry_set*' % self.blog.pk
+    self.assertRaises(Exception, Query(qs))
+
+
+class WithoutRecursiveQueries(object):
+
+  def setUp(self):
+    settings.RECURSIVE_QUERIES = False
+    super(WithoutRecursiveQueries, self).setUp()
+
+  def tearDown(self):
+    super(WithoutRecursiveQueries, self).tearDown()
+    settings.RECURSIVE_QUERIES = True
+
+
+class TestQueryRecursiveLoop(WithoutRecursiveQueries, test_query_recursive.TestQueryRecursive):
+  pass
+
+
+class TestQueryFkToSelfLoop(WithoutRecursiveQueries, test_query_self_fk.TestQueryFkToSelf):
+  pass
+
+
+class TestQueryM2MLoop(WithoutRecursiveQueries, test_query_self_m2m.TestQueryM2M):
+  pass
@@ -0,0 +1,123 @@
+from django.test import TestCase
+from curious import model_registry, settings
+from curious.parser import Parser
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author, Comment
+import curious_tests.models
+
+class TestQuerySharedPrefixes(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    headlines = ('MySQL is a relational DB',
+                 'Postgres is a really good relational DB',
+                 'Neo4J is a graph DB')
+    self.entries = [Entry.objects.create(headline=headline, blog=self.blog)
+                    for headline in headlines]
+    self.authors = [Author.objects.create(name=name)
+                    for name in ('John Smith', 'Jane Doe', 'Joe Plummer')]
+    for i, entry in enumerate(self.entries):
+      entry.authors.add(self.authors[i])
+      entry.authors.add(self.authors[(i+1)%len(self.authors)])
+      Comment.objects.create(entry=entry, comment='Comment %d' % i)
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def _unshared(self, qs):
+    share_prefixes = Query._share_prefixes
+    subquery_prefixes = Query._subquery_prefixes
+    Query._share_prefixes = staticmethod(lambda query: query)
+    Query._subquery_prefixes = staticmethod(lambda planned: {})
+    try:
+      return Query(qs).pks()
+    finally:
+      Query._share_prefixes = staticmethod(share_prefixes)
+      Query._subquery_prefixes = staticmethod(subquery_prefixes)
+
+  def assertFewerQueries(self, qs, shared, unshared):
+    # the memo of edges also saves repeated steps; only count what planning
+    # saves
+    settings.EDGE_MEMO = False
+    try:
+      with self.assertNumQueries(unshared):
+        expected = self._unshared(qs)
+      with self.assertNumQueries(shared):
+        result = Query(qs).pks()
+    finally:
+      settings.EDGE_MEMO = True
+    self.assertEquals(result, expected)
+    return result
+
+  def test_factor_branches(self):
+    a, b, c = dict(model='A', method='a'), dict(model='B', method='b'), dict(model='C', method='c')
+    self.assertEquals(Query._factor_branches([[a, b], [a, c], [c]]),
+                      [[a, dict(orquery=[[b], [c]], join=False)], [c]])
+    self.assertEquals(Query._factor_branches([[a, b, c], [a, b, a]]),
+                      [[a, b, dict(orquery=[[c], [a]], join=False)]])
+    # a branch that is only the shared step cannot be factored
+    self.assertEquals(Query._factor_branches([[a], [a, c]]), [[a], [a, c]])
+    # nor can recursive steps
+    r = dict(a, recursive=True, collect='all')
+    self.assertEquals(Query._factor_branches([[r, b], [r, c]]), [[r, b], [r, c]])
+
+  def test_or_branches_share_first_steps(self):
+    # entries excluding something cannot be chained with the next step, so
+    # each branch takes two queries, and the branches cannot be one UNION
+    step = 'Blog.entry_set.exclude(headline__icontains="graph")'
+    qs = 'Blog(%s) (%s Entry.authors(name__icontains="John")) | '\
+         '(%s Entry.authors(name__icontains="Jane"))' % (self.blog.pk, step, step)
+    # starting objects, shared step, then the rest of branches as a UNION
+    result, last_model = self.assertFewerQueries(qs, 3, 5)
+    self.assertItemsEqual(result[0][0], [(self.authors[0].pk, None), (self.authors[1].pk, None)])
+    self.assertEquals(last_model, Author)
+
+  def test_or_branches_that_are_chains_are_not_rewritten(self):
+    qs = 'Blog(%s) (Blog.entry_set Entry.authors(name__icontains="John")) | '\
+         '(Blog.entry_set Entry.authors(name__icontains="Jane"))' % self.blog.pk
+    steps = Parser(qs).steps
+    self.assertEquals(Query._share_prefixes(steps), steps)
+    self.assertFewerQueries(qs, 2, 2)
+
+  def test_or_branches_sharing_steps_after_join(self):
+    step = 'Blog.entry_set.exclude(headline__icontains="graph")'
+    qs = 'Blog(%s), (%s Entry.authors(name__icontains="John")) | '\
+         '(%s Entry.authors(name__icontains="Jane"))' % (self.blog.pk, step, step)
+    result, last_model = self.assertFewerQueries(qs, 3, 5)
+    self.assertEquals(len(result), 2)
+    self.assertItemsEqual(result[1][0], [(self.authors[0].pk, self.blog.pk),
+                                         (self.authors[1].pk, self.blog.pk)])
+
+  def test_subqueries_share_first_steps(self):
+    step = 'Blog.entry_set.exclude(headline__icontains="graph")'
+    qs = 'Blog(%s) ?(%s Entry.authors) ?(%s Entry.comment_set) Blog.entry_set' %\
+         (self.blog.pk, step, step)
+    # starting objects, shared step, one query for the rest of each subquery,
+    # then the last step
+    result, last_model = self.assertFewerQueries(qs, 5, 6)
+    self.assertEquals(len(result), 4)
+    self.assertItemsEqual([pk for pk, src in result[1][0]], [a.pk for a in self.authors])
+    self.assertItemsEqual([pk for pk, src in result[2][0]],
+                          [c.pk for c in Comment.objects.filter(entry__in=self.entries[:2])])
+    self.assertEquals(last_model, Entry)
+
+  def test_subqueries_that_are_chains_are_not_shared(self):
+    qs = 'Blog(%s) ?(Blog.entry_set Entry.authors) ?(Blog.entry_set Entry.comment_set)' %\
+         self.blog.pk
+    self.assertEquals(Query._subquery_prefixes(Query._plan(Parser(qs).steps)), {})
+    self.assertFewerQueries(qs, 3, 3)
+
+  def test_subqueries_sharing_prefixes_of_different_lengths(self):
+    s1 = 'Blog.entry_set.exclude(headline__icontains="graph")'
+    s2 = 'Entry.authors.exclude(name="qq")'
+    qs = 'Blog(%s) ?(%s %s Author.entry_set) ?(%s Entry.comment_set) ?(%s %s Author.friends)' %\
+         (self.blog.pk, s1, s2, s1, s1, s2)
+    # only the first and last subqueries share both steps
+    prefixes = Query._subquery_prefixes(Query._plan(Parser(qs).steps))
+    self.assertEquals(sorted(prefixes.keys()), [0, 2])
+    self.assertEquals(len(prefixes[0]), 2)
+    result, last_model = Query(qs).pks()
+    self.assertEquals(result, self._unshared(qs)[0])
+    self.assertItemsEqual([pk for pk, src in result[2][0]],
+                          [c.pk for c in Comment.objects.filter(entry__in=self.entries[:2])])
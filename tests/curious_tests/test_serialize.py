@@ -0,0 +1,166 @@
+import json
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from curious import model_registry, serialize
+from curious.api import ModelView
+from curious_tests.models import Blog, Entry, Person
+import curious_tests.models
+
+
+class TestSerializers(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entry = Entry.objects.create(blog=self.blog, headline='MySQL')
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_serializers_are_compiled_once(self):
+    serializer = serialize.serializer_of(self.entry)
+    self.assertIs(serialize.serializer_of(Entry.objects.get(pk=self.entry.pk)), serializer)
+    self.assertIsNot(serialize.serializer_of(self.entry, follow_fk=False), serializer)
+    self.assertIsNot(serialize.serializer_of(self.entry, ignore_excludes=True), serializer)
+
+  def test_serializers_follow_changes_of_managers(self):
+    self.assertIn('headline', serialize.serializer_of(self.entry).fields)
+    model_registry.get_manager('Entry').field_excludes.append('headline')
+    self.assertNotIn('headline', serialize.serializer_of(self.entry).fields)
+    model_registry.get_manager('Entry').field_excludes = []
+    self.assertIn('headline', serialize.serializer_of(self.entry).fields)
+
+    person = Person(gender='f')
+    model_registry.get_manager('Person').property_fields = ['example_property_field']
+    self.assertEquals(serialize.serializer_of(person).fields[-1], 'example_property_field')
+
+  def test_serializers_are_dropped_when_models_change(self):
+    serializer = serialize.serializer_of(self.entry)
+    serialize.invalidate()
+    self.assertIsNot(serialize.serializer_of(self.entry), serializer)
+    serializer = serialize.serializer_of(self.entry)
+    model_registry.unregister('Comment')
+    self.assertIsNot(serialize.serializer_of(self.entry), serializer)
+    serializer = serialize.serializer_of(self.entry)
+    model_registry.register(curious_tests.models)
+    self.assertIsNot(serialize.serializer_of(self.entry), serializer)
+
+  def test_values_of_related_objects(self):
+    model_registry.get_manager('Blog').url_function = lambda obj: '/blog/%s' % obj.pk
+    r = ModelView.objects_to_dict([self.entry])
+    blog = ('Blog', self.blog.pk, 'Databases', '/blog/%s' % self.blog.pk)
+    self.assertEquals(r['objects'], [[self.entry.pk, blog, 'MySQL', None, None]])
+    self.assertEquals(r['urls'], [None])
+    r = ModelView.objects_to_dict([self.entry], follow_fk=False)
+    self.assertEquals(r['objects'], [[self.entry.pk, self.blog.pk, 'MySQL', None, None]])
+
+  def test_values_are_coerced(self):
+    person = Person(id=3, gender=u'f')
+    r = ModelView.objects_to_dict([person])
+    self.assertEquals(r['fields'], ['id', 'alive', 'gender'])
+    self.assertEquals(r['objects'], [[3, True, u'f']])
+    self.assertEquals([type(v) for v in r['objects'][0]], [int, bool, unicode])
+
+
+class TestModelNames(TestCase):
+
+  def setUp(self):
+    model_registry.clear()
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_names_of_registered_and_unregistered_models(self):
+    self.assertEquals(model_registry.get_name(Blog), 'curious_tests__Blog')
+    model_registry.register(Blog)
+    self.assertEquals(model_registry.get_name(Blog), 'Blog')
+    model_registry.unregister('Blog')
+    self.assertEquals(model_registry.get_name(Blog), 'curious_tests__Blog')
+
+  def test_ambiguous_short_names(self):
+    model_registry.register(Blog)
+    model_registry.register(Entry, short_name='Blog')
+    self.assertEquals(model_registry.get_name(Blog), 'curious_tests__Blog')
+    self.assertEquals(model_registry.get_name(Entry), 'curious_tests__Entry')
+
+
+class TestLoadingValues(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entry = Entry.objects.create(blog=self.blog, headline='MySQL')
+    self.response = Entry.objects.create(blog=self.blog, headline='Postgres',
+                                         response_to=self.entry)
+    model_registry.register(curious_tests.models)
+    model_registry.get_manager('Blog').label_field = 'name'
+    model_registry.get_manager('Entry').label_field = 'headline'
+    self.ids = [self.entry.pk, self.response.pk]
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def _load(self, fields=None):
+    return ModelView.get_objects_as_json(Entry, self.ids, False, True, False, None, fields)
+
+  def test_values_are_loaded_without_instances(self):
+    self.assertIsNotNone(serialize.values_serializer_of(Entry))
+
+    def no_instances(*args):
+      raise Exception('instance constructed')
+
+    Entry.from_db = classmethod(no_instances)
+    try:
+      with self.assertNumQueries(1):
+        data = self._load()
+    finally:
+      del Entry.from_db
+
+    self.assertEquals(data['fields'],
+                      ['id', 'blog_id', 'headline', 'response_to_id', 'related_blog_id'])
+    self.assertEquals(data['objects'], [
+      [self.entry.pk, ('Blog', self.blog.pk, 'Databases', None), 'MySQL', None, None],
+      [self.response.pk, ('Blog', self.blog.pk, 'Databases', None), 'Postgres',
+       ('Entry', self.entry.pk, 'MySQL', None), None],
+    ])
+    self.assertEquals(data['urls'], [None, None])
+
+  def test_values_match_instances(self):
+    data = self._load()
+    # URLs need instances
+    model_registry.get_manager('Entry').url_function = lambda obj: None
+    self.assertIsNone(serialize.values_serializer_of(Entry))
+    self.assertEquals(self._load(), data)
+
+  def test_instances_are_loaded_without_label_fields(self):
+    model_registry.get_manager('Blog').label_field = None
+    self.assertIsNone(serialize.values_serializer_of(Entry))
+    self.assertIsNotNone(serialize.values_serializer_of(Entry, follow_fk=False))
+    self.assertEquals(self._load()['objects'][0][1], ('Blog', self.blog.pk, 'Databases', None))
+
+  def test_labels_stand_in_for_unicode_of_instances(self):
+    model_registry.get_manager('Blog').label_field = 'id'
+    model_registry.get_manager('Entry').property_fields = ['pk']
+    self.assertIsNone(serialize.values_serializer_of(Entry))
+    self.assertEquals(self._load()['objects'][0][1], ('Blog', self.blog.pk, self.blog.pk, None))
+
+  def test_subsets_of_fields(self):
+    data = self._load(fields=['headline', 'response_to_id'])
+    self.assertEquals(data['fields'], ['id', 'headline', 'response_to_id'])
+    self.assertEquals(data['objects'][1],
+                      [self.response.pk, 'Postgres', ('Entry', self.entry.pk, 'MySQL', None)])
+
+  def test_subsets_of_fields_of_instances_are_projected(self):
+    model_registry.get_manager('Entry').url_function = lambda obj: '/entry/%s' % obj.pk
+    with CaptureQueriesContext(connection) as queries:
+      data = self._load(fields=['headline'])
+    self.assertEquals(data['fields'], ['id', 'headline'])
+    self.assertEquals(data['objects'], [[self.entry.pk, 'MySQL'], [self.response.pk, 'Postgres']])
+    self.assertEquals(data['urls'], ['/entry/%s' % self.entry.pk, '/entry/%s' % self.response.pk])
+    self.assertEquals(len(queries), 1)
+    self.assertNotIn('blog_id', queries[0]['sql'])
+
+  def test_batch_endpoint_takes_fields(self):
+    data = json.dumps(dict(ids=self.ids, fields=['headline']))
+    r = self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+    self.assertEquals(json.loads(r.content)['result']['fields'], ['id', 'headline'])
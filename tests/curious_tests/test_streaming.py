@@ -0,0 +1,129 @@
+import json
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from curious import api, encoding, model_registry, settings
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+class TestIterencode(TestCase):
+
+  def test_chunks_join_to_json(self):
+    value = {'a': [1, (2, u'\xe9')], 'b': {}, 'c': {'d': None, 'e': encoding.encode([1.5])}}
+    self.assertEquals(''.join(encoding.iterencode(value)),
+                      json.dumps(encoding.decoded(value), sort_keys=True))
+    lazy = dict(value, l=encoding.Lazy(iter([{'x': 1}, encoding.encode(2), encoding.Lazy([])])))
+    expected = encoding.decoded(dict(value, l=[{'x': 1}, 2, []]))
+    self.assertEquals(''.join(encoding.iterencode(lazy)), json.dumps(expected, sort_keys=True))
+    self.assertEquals(''.join(encoding.iterencode({1: 2})), json.dumps({1: 2}))
+
+  def test_keys_are_encoded_in_sorted_order(self):
+    value = dict(urls=[None], objects=encoding.Lazy([1]), fields=['id'])
+    expected = '{"fields": ["id"], "objects": [1], "urls": [null]}'
+    self.assertEquals(''.join(encoding.iterencode(value)), expected)
+    self.assertEquals(encoding.dumps(encoding.decoded(value)), expected)
+
+  def test_lazy_items_are_produced_while_encoding(self):
+    produced = []
+
+    def items():
+      for i in range(3):
+        produced.append(i)
+        yield i
+
+    chunks = encoding.iterencode({'a': encoding.Lazy(items())})
+    self.assertEquals([next(chunks) for i in range(4)], ['{', '"a"', ': ', '['])
+    self.assertEquals(produced, [])
+    next(chunks)
+    self.assertEquals(produced, [0])
+
+  def test_batches_are_encoded_a_batch_at_a_time(self):
+    batches = [[1, encoding.encode({'a': 2})], [], encoding.encode([3, None]), [u'\xe9']]
+    expected = json.dumps([1, {'a': 2}, 3, None, u'\xe9'])
+    self.assertEquals(list(encoding.iterencode(encoding.Batches(iter(batches)))),
+                      ['[', '1, {"a": 2}', ', ', '3, null', ', ', '"\\u00e9"', ']'])
+    self.assertEquals(''.join(encoding.iterencode({'b': encoding.Batches(batches)})),
+                      '{"b": %s}' % expected)
+    self.assertEquals(encoding.decoded(encoding.Batches(batches)), json.loads(expected))
+    self.assertEquals(''.join(encoding.iterencode(encoding.Batches([[], []]))), '[]')
+
+  def test_buffered(self):
+    self.assertEquals(list(encoding.buffered(['ab', 'c', 'def', 'g'], 3)), ['abc', 'def', 'g'])
+    self.assertEquals(list(encoding.buffered([], 3)), [])
+
+
+class TestStreamedResponses(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(5)]
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    self.__size = settings.STREAM_BATCH_SIZE
+    settings.STREAM_BATCH_SIZE = 2
+
+  def tearDown(self):
+    settings.STREAM_BATCH_SIZE = self.__size
+    model_registry.clear()
+    api.cache.clear()
+
+  def _post(self, stream, **kwargs):
+    data = json.dumps(dict(ids=[e.pk for e in reversed(self.entries)], s=stream, **kwargs))
+    return self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+
+  def test_streamed_objects_are_the_same(self):
+    r = self._post(1)
+    self.assertIsInstance(r, StreamingHttpResponse)
+    self.assertEquals(''.join(r.streaming_content), self._post(0).content)
+
+    # partly cached
+    self.client.post('/curious/models/Entry/',
+                     data=json.dumps(dict(ids=[self.entries[2].pk], app='app')),
+                     content_type='application/json')
+    self.assertEquals(''.join(self._post(1, app='app').streaming_content), self._post(0).content)
+
+  def test_objects_are_loaded_in_batches_while_streaming(self):
+    with CaptureQueriesContext(connection) as queries:
+      r = self._post(1)
+    # first batch is loaded to tell if there are any objects
+    self.assertEquals(len(queries), 1)
+    with CaptureQueriesContext(connection) as queries:
+      content = ''.join(r.streaming_content)
+    self.assertEquals(len(queries), 2)
+    self.assertEquals(len(json.loads(content)['result']['objects']), 5)
+
+  def test_objects_and_urls_are_kept_a_batch_at_a_time(self):
+    r = api.ModelView.stream_objects_as_json(Entry, [e.pk for e in self.entries], False, True,
+                                             False, None)
+    chunks = list(encoding.iterencode(r['objects']))
+    # brackets, three batches and two separators
+    self.assertEquals(len(chunks), 7)
+    self.assertEquals(len(json.loads(''.join(chunks))), 5)
+    self.assertEquals(len(r['urls'].items), 3)
+    self.assertEquals(json.loads(''.join(encoding.iterencode(r['urls']))),
+                      encoding.decoded(r['urls']))
+
+  def test_no_objects(self):
+    data = json.dumps(dict(ids=[0], s=1))
+    r = self.client.post('/curious/models/Entry/', data=data, content_type='application/json')
+    self.assertEquals(json.loads(''.join(r.streaming_content)),
+                      {'result': {'fields': [], 'objects': []}})
+
+  def test_streamed_query_data_is_the_same(self):
+    params = dict(q='Blog(%s), Blog.entry_set' % self.blog.pk, d=1, app='app', fc=1)
+    content = self.client.get('/curious/q/', dict(params, s=0)).content
+    r = self.client.get('/curious/q/', dict(params, s=1))
+    self.assertIsInstance(r, StreamingHttpResponse)
+    self.assertEquals(''.join(r.streaming_content), content)
+    self.assertEquals(len(json.loads(content)['result']['data'][1]['objects']), 5)
+
+  def test_streaming_is_configurable(self):
+    stream = settings.STREAM_RESPONSES
+    settings.STREAM_RESPONSES = True
+    try:
+      r = self.client.get('/curious/q/', dict(q='Blog(%s)' % self.blog.pk))
+    finally:
+      settings.STREAM_RESPONSES = stream
+    self.assertIsInstance(r, StreamingHttpResponse)
@@ -1,5 +1,8 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from curious import model_registry
+from curious.parser import Parser
 from curious.query import Query
 from curious_tests.models import Blog, Entry, Author, Comment
 from curious_tests import assertQueryResultsEqual
@@ -179,3 +182,44 @@ class TestSubQueries(TestCase):
 
     self.assertEquals(len(result[0]), 3)
     self.assertEquals(result[1], Blog)
+
+  def _pks_without_exists(self, qs):
+    as_chain = Query._as_chain
+    Query._as_chain = staticmethod(lambda subquery: None)
+    try:
+      return Query(qs).pks()
+    finally:
+      Query._as_chain = staticmethod(as_chain)
+
+  def test_filtering_queries_check_existence_in_sql(self):
+    qs = 'Entry(blog__id=%s) -(Entry.comment_set(comment__icontains="it"))' % self.blogs[0].pk
+    with CaptureQueriesContext(connection) as queries:
+      result, last_model = Query(qs).pks()
+    self.assertItemsEqual(result[0][0], [(self.entries[0].pk, None), (self.entries[2].pk, None)])
+    # one query for the starting objects, one filtering them with a subselect
+    self.assertEquals(len(queries), 2)
+    self.assertIn('NOT', queries[1]['sql'])
+    self.assertIn('(SELECT', queries[1]['sql'])
+
+  def test_filtering_queries_in_sql_match_filtering_fetched_results(self):
+    blog = self.blogs[0].pk
+    for having in ('+', '-'):
+      for sub in ('Blog.entry_set', 'Blog.entry_set(headline__icontains="relational")',
+                  'Blog.entry_set Entry.comment_set',
+                  'Blog.entry_set.exclude(headline__icontains="graph")',
+                  'Blog.entry_set(headline__icontains="graph") '
+                  'Entry.authors(name__icontains="Jane")',
+                  'Blog.entry_set Entry.authors.exclude(name__icontains="J")'):
+        qs = 'Blog(%s) %s(%s)' % (blog, having, sub)
+        self.assertEquals(Query(qs).pks(), self._pks_without_exists(qs), qs)
+      for sub in ('Entry.authors', 'Entry.authors(name="Jane Doe")',
+                  'Entry.comment_set Comment.entry'):
+        qs = 'Blog(%s) Blog.entry_set %s(%s)' % (blog, having, sub)
+        self.assertEquals(Query(qs).pks(), self._pks_without_exists(qs), qs)
+
+  def test_filtering_queries_with_relationship_functions_fetch_results(self):
+    model_registry.get_manager('Blog').allowed_relationships = ['authors']
+    qs = 'Blog(%s) +(Blog.authors(name__icontains="Jane"))' % self.blogs[0].pk
+    self.assertIsNone(Query._as_chain(Parser(qs).steps[0]['subquery']))
+    result, last_model = Query(qs).pks()
+    self.assertEquals(result[0][0], [(self.blogs[0].pk, None)])
@@ -0,0 +1,110 @@
+import json
+from django.test import TestCase
+from curious import api, model_registry, settings, table
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+class TestJoinColumns(TestCase):
+
+  def test_columns_are_joined_by_join_index(self):
+    results = [dict(model='Blog', join_index=-1, objects=[(1, None), (2, None), (3, None)]),
+               dict(model='Entry', join_index=0, objects=[(10, 1), (11, 1), (12, 2)]),
+               dict(model='Author', join_index=1, objects=[(20, 10), (21, 12), (22, 12)]),
+               dict(model='Comment', join_index=0, objects=[(30, 2), (31, 1)])]
+    columns, rows = table.join_columns(results)
+    self.assertEquals(columns, [dict(model='Blog', join_index=-1),
+                                dict(model='Entry', join_index=0),
+                                dict(model='Author', join_index=1),
+                                dict(model='Comment', join_index=0)])
+    self.assertEquals(rows, [(1, 10, 20, 31), (2, 12, 21, 30), (2, 12, 22, 30)])
+
+    columns, rows = table.join_columns(results, left_join=True)
+    self.assertEquals(rows, [(1, 10, 20, 31), (1, 11, None, 31), (2, 12, 21, 30), (2, 12, 22, 30),
+                             (3, None, None, None)])
+
+  def test_objects_without_pks_are_empty_cells(self):
+    results = [dict(model='Blog', join_index=-1, objects=[(1, None), (2, None)]),
+               dict(model='Entry', join_index=0, objects=[(10, 1), (None, 2)]),
+               dict(model='Author', join_index=1, objects=[(20, 10)])]
+    self.assertEquals(table.join_columns(results)[1], [(1, 10, 20)])
+    self.assertEquals(table.join_columns(results, True)[1], [(1, 10, 20), (2, None, None)])
+
+  def test_empty_columns_are_dropped(self):
+    results = [dict(model='Blog', join_index=-1, objects=[(1, None)]),
+               dict(model=None, join_index=0, objects=[(5, 1)]),
+               dict(model='Entry', join_index=0, objects=[]),
+               dict(model='Author', join_index=0, objects=[(20, 1)]),
+               dict(model='Comment', join_index=3, objects=[(30, 20)])]
+    columns, rows = table.join_columns(results)
+    self.assertEquals(columns, [dict(model='Blog', join_index=-1),
+                                dict(model='Author', join_index=0),
+                                dict(model='Comment', join_index=1)])
+    self.assertEquals(rows, [(1, 20, 30)])
+    self.assertEquals(table.join_columns([dict(model='Blog', join_index=-1, objects=[])]), ([], []))
+
+  def test_cursors(self):
+    self.assertEquals(table.parse_cursor(table.cursor('2017-01-01', 200)), ('2017-01-01', 200))
+    self.assertRaises(Exception, table.parse_cursor, 'not a cursor')
+
+
+class TestTableAPI(TestCase):
+
+  def setUp(self):
+    self.blog = Blog.objects.create(name='Databases')
+    self.entries = [Entry.objects.create(blog=self.blog, headline='Entry %d' % i) for i in range(7)]
+    model_registry.register(curious_tests.models)
+    api.cache.clear()
+    self.__block_size = settings.TABLE_BLOCK_SIZE
+    settings.TABLE_BLOCK_SIZE = 3
+
+  def tearDown(self):
+    settings.TABLE_BLOCK_SIZE = self.__block_size
+    model_registry.clear()
+    api.cache.clear()
+
+  def _get(self, **params):
+    params = dict(dict(q='Blog(%s), Blog.entry_set' % self.blog.pk, t=1), **params)
+    return self.client.get('/curious/q/', params)
+
+  def test_pages_of_joined_rows(self):
+    r = json.loads(self._get(n=2).content)['result']
+    self.assertEquals(r['columns'], [dict(model='Blog', join_index=-1),
+                                     dict(model='Entry', join_index=0)])
+    self.assertEquals(r['total'], 7)
+    self.assertEquals(r['offset'], 0)
+    self.assertNotIn('results', r)
+    rows = r['rows']
+    self.assertEquals(len(rows), 2)
+
+    # later pages are read from the cache
+    while r['next'] is not None:
+      with self.assertNumQueries(0):
+        r = json.loads(self._get(n=2, cursor=r['next']).content)['result']
+      rows.extend(r['rows'])
+    self.assertEquals(len(r['rows']), 1)
+    self.assertItemsEqual(rows, [[self.blog.pk, e.pk] for e in self.entries])
+
+  def test_first_page_reuses_cached_table(self):
+    r = json.loads(self._get(n=3, app='app', fc=1).content)['result']
+    with self.assertNumQueries(0):
+      self.assertEquals(json.loads(self._get(n=3, app='app').content)['result'], r)
+
+  def test_data_of_objects_on_page(self):
+    r = json.loads(self._get(n=2, d=1).content)['result']
+    self.assertEquals(len(r['data']), 2)
+    self.assertEquals(len(r['data'][0]['objects']), 1)
+    self.assertEquals([obj[0] for obj in r['data'][1]['objects']],
+                      sorted(row[1] for row in r['rows']))
+
+  def test_expired_and_bad_cursors(self):
+    r = json.loads(self._get(n=2).content)['result']
+    api.cache.clear()
+    self.assertEquals(self._get(n=2, cursor=r['next']).status_code, 410)
+    self.assertEquals(self._get(cursor='bad').status_code, 400)
+    self.assertEquals(self._get(n=0).status_code, 400)
+    self.assertEquals(self._get(n='x').status_code, 400)
+
+  def test_cursors_of_other_queries_do_not_match(self):
+    r = json.loads(self._get(n=2).content)['result']
+    self.assertEquals(self._get(n=2, cursor=r['next'], lj=1).status_code, 410)